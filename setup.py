@@ -8,6 +8,7 @@ setup(
     install_requires=[
         "sipyco@git+https://github.com/m-labs/sipyco.git@v1.8",
         "asyncserial@git+https://github.com/m-labs/asyncserial.git@1.0",
+        "numpy",
     ],
     extras_require={
         "docs": [
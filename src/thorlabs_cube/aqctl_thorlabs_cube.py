@@ -7,6 +7,8 @@ import asyncio
 from sipyco import common_args
 from sipyco.pc_rpc import simple_server_loop
 
+from thorlabs_cube.driver.align import AlignmentLoop, AlignmentLoopSim
+from thorlabs_cube.driver.group import MotorGroup, MotorGroupSim
 from thorlabs_cube.driver.kcube.kdc import Kdc, KdcSim
 from thorlabs_cube.driver.kcube.kpa import Kpa, KpaSim
 from thorlabs_cube.driver.kcube.kpz import Kpz, KpzSim
@@ -27,6 +29,12 @@ controller = {
     "kpa101": (Kpa, KpaSim),
 }
 
+# products that can be controlled as a group of axes
+motor_products = ("tdc001", "kdc101")
+
+# products that can drive piezo controllers in an alignment loop
+detector_products = ("tpa101", "kpa101")
+
 
 def get_argparser():
     parser = argparse.ArgumentParser()
@@ -40,8 +48,26 @@ def get_argparser():
         "-d",
         "--device",
         default=None,
+        action="append",
         help="serial device. See documentation for how to specify a USB Serial"
-        " Number.",
+        " Number. Repeat to control several motor controllers of the same"
+        " product as one group.",
+    )
+    parser.add_argument(
+        "--state-file",
+        default=None,
+        help="JSON file keeping the homed state of a group of motor"
+        " controllers across restarts.",
+    )
+    parser.add_argument(
+        "--piezo",
+        default=None,
+        action="append",
+        metavar="AXIS:PRODUCT:DEVICE",
+        help="piezo controller driven by the alignment loop of a position"
+        " sensing detector (tpa101/kpa101), e.g. x:kpz101:/dev/ttyUSB1. AXIS is"
+        " the detector axis it corrects, x or y. Repeat for each piezo. The"
+        " loop is served as the 'alignment' target.",
     )
     parser.add_argument(
         "--simulation",
@@ -53,6 +79,21 @@ def get_argparser():
     return parser
 
 
+def _parse_piezos(specs):
+    piezos = []
+    for spec in specs:
+        try:
+            axis, product, device = spec.split(":", 2)
+        except ValueError:
+            raise ValueError(
+                f"Invalid piezo (--piezo) '{spec}', expected AXIS:PRODUCT:DEVICE"
+            ) from None
+        if product.lower() not in ("tpz001", "kpz101"):
+            raise ValueError(f"Invalid piezo product '{product}' in '{spec}'")
+        piezos.append((axis, controller[product.lower()][0], device))
+    return piezos
+
+
 def main():
     args = get_argparser().parse_args()
     common_args.init_logger_from_args(args)
@@ -75,21 +116,53 @@ def main():
             )
 
         physicalDevice, simulationDevice = controller[product]
-        if args.simulation:
+        if args.device is not None and len(args.device) > 1:
+            if product not in motor_products:
+                raise ValueError(
+                    f"Several devices (-d/--device) given for '{product}', "
+                    "which cannot be grouped. Choose from:\n"
+                    + "\n".join(f"  - {option}" for option in motor_products)
+                )
+            if args.simulation:
+                dev = MotorGroupSim(len(args.device), args.device, args.state_file)
+            else:
+                dev = MotorGroup(
+                    [physicalDevice(device) for device in args.device],
+                    args.device,
+                    args.state_file,
+                )
+        elif args.simulation:
             dev = simulationDevice()
         else:
-            dev = physicalDevice(args.device)
+            dev = physicalDevice(args.device[0])
             if product == "tpz001" or product == "kpz101":
                 loop.run_until_complete(dev.get_tpz_io_settings())
+        targets = {product: dev}
+        if args.piezo is not None:
+            if product not in detector_products:
+                raise ValueError(
+                    "Piezo controllers (--piezo) can only be driven by a "
+                    + " or ".join(detector_products)
+                )
+            piezos = _parse_piezos(args.piezo)
+            axes = [axis for axis, _, _ in piezos]
+            if args.simulation:
+                targets["alignment"] = AlignmentLoopSim(len(piezos), axes)
+            else:
+                actuators = [driver(device) for _, driver, device in piezos]
+                for actuator in actuators:
+                    loop.run_until_complete(actuator.get_tpz_io_settings())
+                targets["alignment"] = AlignmentLoop(dev, actuators, axes)
         try:
             simple_server_loop(
-                {product: dev},
+                targets,
                 common_args.bind_address_from_args(args),
                 args.port,
                 loop=loop,
             )
         finally:
-            dev.close()
+            for target in targets.values():
+                target.close()
     finally:
         loop.close()
 
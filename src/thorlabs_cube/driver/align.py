@@ -0,0 +1,281 @@
+"""Beam alignment feedback from a position sensing detector to piezo
+controllers.
+
+The loop runs in the controller process: it is woken up by each status
+update of a TPA101/KPA101 detector, computes the piezo output voltages with
+a PI law on the normalised beam position, and writes them to the TPZ001/
+KPZ101 controllers of the same process. Each iteration thus costs a single
+serial write per piezo, without network round trips.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AlignmentLoop:
+    """PI feedback from a quad detector to piezo output voltages.
+
+    The error of each axis is its setpoint minus the normalised beam
+    position ``x_diff / sum_val`` or ``y_diff / sum_val``, in range [-1; 1].
+    Each piezo output is ``offset + kp * error + integral`` where the
+    integral accumulates ``ki * error * dt``, with ``dt`` the time between
+    detector updates. The output is clipped to the piezo voltage range and
+    the integral is not accumulated while clipped.
+
+    The detector status updates must be enabled, e.g. with
+    :py:meth:`hardware_start_update_messages()
+    <thorlabs_cube.driver.base._Cube.hardware_start_update_messages>`.
+
+    :param detector: The Tpa or Kpa driver.
+    :param actuators: The Tpz or Kpz drivers, in open loop mode with their
+        voltage limit known.
+    :param axes: The detector axis corrected by each actuator, ``"x"`` or
+        ``"y"``.
+    """
+
+    def __init__(self, detector, actuators: list, axes: list[str]) -> None:
+        if len(actuators) != len(axes):
+            raise ValueError("Expected one axis per actuator")
+        for axis in axes:
+            if axis not in ("x", "y"):
+                raise ValueError("Axis must be 'x' or 'y', got {}".format(axis))
+        self.detector = detector
+        self.actuators = actuators
+        self.axes = axes
+        self.kp = [0.0] * len(actuators)
+        self.ki = [0.0] * len(actuators)
+        self.setpoint = {"x": 0.0, "y": 0.0}
+        self.min_sum = 1
+        self._task: Optional[asyncio.Task] = None
+        self._update = asyncio.Event()
+        self._reading: Optional[tuple] = None
+        self._received = 0.0
+        self._error: Optional[BaseException] = None
+        self._closing = False
+        self._reset_stats()
+
+    def close(self) -> None:
+        """Stop the loop and close the piezo controllers."""
+        if self._task is not None:
+            if not self._task.done():
+                self.detector.remove_status_listener(self._on_status)
+                self._task.cancel()
+            self._task = None
+        for actuator in self.actuators:
+            actuator.close()
+
+    def _reset_stats(self) -> None:
+        self._frames = 0
+        self._iterations = 0
+        self._skipped = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+        self._last_errors: dict[str, float] = {"x": 0.0, "y": 0.0}
+        self._started = time.monotonic()
+
+    def set_gains(self, kp: list[float], ki: list[float]) -> None:
+        """Set the PI gains of each actuator.
+
+        The gain signs set the direction of the correction, which depends on
+        how each piezo moves the beam on the detector.
+
+        :param kp: Proportional gain of each actuator, in volts.
+        :param ki: Integral gain of each actuator, in volts per second.
+        """
+        if len(kp) != len(self.actuators) or len(ki) != len(self.actuators):
+            raise ValueError(
+                "Expected gains for each actuator ({})".format(len(self.actuators))
+            )
+        self.kp = [float(k) for k in kp]
+        self.ki = [float(k) for k in ki]
+
+    def set_setpoint(self, x: float, y: float) -> None:
+        """Set the target normalised beam position.
+
+        :param x: Target ``x_diff / sum_val``, 0 for a centered beam.
+        :param y: Target ``y_diff / sum_val``, 0 for a centered beam.
+        """
+        self.setpoint = {"x": float(x), "y": float(y)}
+
+    def _on_status(self, reading: tuple, timestamp: float) -> None:
+        # only the latest detector reading is used
+        self._reading = reading
+        self._received = timestamp
+        self._frames += 1
+        self._update.set()
+
+    async def start(self, max_rate: float = 1000.0, min_sum: int = 1) -> None:
+        """Start the feedback loop.
+
+        The piezo outputs are read once to start from the current voltages.
+        A loop that stopped on an error can be started again without calling
+        :py:meth:`stop` first.
+
+        :param max_rate: Maximum number of iterations per second. Detector
+            updates arriving faster are coalesced.
+        :param min_sum: Minimum detector sum signal, below which the beam is
+            considered lost and the outputs are held.
+        """
+        if self._task is not None and not self._task.done():
+            raise ValueError("The alignment loop is already running")
+        if max_rate <= 0:
+            raise ValueError("Maximum rate must be positive, got {}".format(max_rate))
+        self.min_sum = min_sum
+        outputs = [await actuator.get_output_volts() for actuator in self.actuators]
+        self._error = None
+        self._closing = False
+        self._reading = None
+        self._update.clear()
+        self._reset_stats()
+        self.detector.add_status_listener(self._on_status)
+        self._task = asyncio.ensure_future(self._run(outputs, 1.0 / max_rate))
+
+    async def _run(self, offsets: list[float], period: float) -> None:
+        integrals = [0.0] * len(self.actuators)
+        outputs = list(offsets)
+        # start time of the last iteration and reception time of its reading
+        last = None
+        last_received = None
+        try:
+            while True:
+                await self._update.wait()
+                if last is not None:
+                    await asyncio.sleep(last + period - time.monotonic())
+                if self._closing:
+                    break
+                last = time.monotonic()
+                self._update.clear()
+                reading, received = self._reading, self._received
+                dt = 0.0 if last_received is None else received - last_received
+                last_received = received
+                x_diff, y_diff, sum_val = reading[:3]
+                if sum_val < self.min_sum:
+                    self._skipped += 1
+                    continue
+                errors = {
+                    "x": self.setpoint["x"] - x_diff / sum_val,
+                    "y": self.setpoint["y"] - y_diff / sum_val,
+                }
+                writes = []
+                for i, actuator in enumerate(self.actuators):
+                    error = errors[self.axes[i]]
+                    limit = actuator.voltage_limit
+                    integral = integrals[i] + self.ki[i] * error * dt
+                    output = offsets[i] + self.kp[i] * error + integral
+                    if 0 <= output <= limit:
+                        integrals[i] = integral
+                    else:
+                        output = min(max(output, 0), limit)
+                    if output != outputs[i]:
+                        outputs[i] = output
+                        writes.append(actuator.set_output_volts(output))
+                await asyncio.gather(*writes)
+                latency = time.monotonic() - received
+                self._iterations += 1
+                self._latency_sum += latency
+                self._latency_max = max(self._latency_max, latency)
+                self._last_errors = errors
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._error = e
+            self.detector.remove_status_listener(self._on_status)
+            logger.error("alignment loop failed", exc_info=True)
+
+    async def stop(self) -> dict:
+        """Stop the feedback loop, keeping the piezo outputs.
+
+        :return: The loop statistics, see :py:meth:`get_stats`.
+        :rtype: dict
+        """
+        if self._task is None:
+            raise ValueError("The alignment loop is not running")
+        task = self._task
+        if not task.done():
+            # let the current iteration finish its writes
+            self.detector.remove_status_listener(self._on_status)
+            self._closing = True
+            self._update.set()
+            await asyncio.shield(task)
+        self._task = None
+        return self.get_stats()
+
+    def get_stats(self) -> dict:
+        """Get the statistics of the loop since it was started.
+
+        :return: A dict with the number of detector ``frames`` received, of
+            loop ``iterations`` and of iterations ``skipped`` for a low sum
+            signal, the iteration ``rate`` per second, the ``mean_latency``
+            and ``max_latency`` in seconds from the reception of a detector
+            update to the end of the piezo writes, the last ``error`` of
+            each axis as a dict, and whether the loop is ``running``. If the
+            loop stopped on an error, its message is given as ``failure``.
+        :rtype: dict
+        """
+        elapsed = time.monotonic() - self._started
+        return {
+            "frames": self._frames,
+            "iterations": self._iterations,
+            "skipped": self._skipped,
+            "rate": self._iterations / elapsed if elapsed > 0 else 0.0,
+            "mean_latency": (
+                self._latency_sum / self._iterations if self._iterations else None
+            ),
+            "max_latency": self._latency_max,
+            "error": dict(self._last_errors),
+            "running": self._task is not None and not self._task.done(),
+            "failure": None if self._error is None else str(self._error),
+        }
+
+
+class AlignmentLoopSim:
+    def __init__(self, num_actuators: int, axes: list[str]) -> None:
+        if num_actuators != len(axes):
+            raise ValueError("Expected one axis per actuator")
+        self.axes = axes
+        self.kp = [0.0] * num_actuators
+        self.ki = [0.0] * num_actuators
+        self.setpoint = {"x": 0.0, "y": 0.0}
+        self.running = False
+
+    def close(self) -> None:
+        pass
+
+    def set_gains(self, kp: list[float], ki: list[float]) -> None:
+        if len(kp) != len(self.axes) or len(ki) != len(self.axes):
+            raise ValueError(
+                "Expected gains for each actuator ({})".format(len(self.axes))
+            )
+        self.kp = list(kp)
+        self.ki = list(ki)
+
+    def set_setpoint(self, x: float, y: float) -> None:
+        self.setpoint = {"x": x, "y": y}
+
+    def start(self, max_rate: float = 1000.0, min_sum: int = 1) -> None:
+        if self.running:
+            raise ValueError("The alignment loop is already running")
+        self.running = True
+
+    def stop(self) -> dict:
+        if not self.running:
+            raise ValueError("The alignment loop is not running")
+        self.running = False
+        return self.get_stats()
+
+    def get_stats(self) -> dict:
+        return {
+            "frames": 0,
+            "iterations": 0,
+            "skipped": 0,
+            "rate": 0.0,
+            "mean_latency": None,
+            "max_latency": 0.0,
+            "error": {"x": 0.0, "y": 0.0},
+            "running": self.running,
+            "failure": None,
+        }
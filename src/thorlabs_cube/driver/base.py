@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import struct as st
+import time
 
 import asyncserial
 
@@ -13,18 +14,34 @@ class _Cube:
     _RESERVED: int = 0x00
     _CHANNEL: int = 0x01
     _REQUEST_LENGTH: int = 1
+    _BAUDRATE: int = 115200
 
     def __init__(self, serial_dev):
-        self.port = asyncserial.AsyncSerial(serial_dev, baudrate=115200, rtscts=True)
+        self.port = asyncserial.AsyncSerial(
+            serial_dev, baudrate=self._BAUDRATE, rtscts=True
+        )
+        self._reader = None
+        self._waiters = []
+        # (time, position) samples from the status updates, while recording
+        self._samples = None
 
     def close(self):
         """Close the device."""
+        if self._reader is not None:
+            self._reader.cancel()
         self.port.close()
 
     async def send(self, message):
         logger.debug("sending: %s", message)
+        self._start_reader()
         await self.port.write(message.pack())
 
+    async def _send_frames(self, frames):
+        """Write already packed messages in a single call."""
+        logger.debug("sending %d bytes of packed messages", len(frames))
+        self._start_reader()
+        await self.port.write(frames)
+
     async def recv(self):
         header = await self.port.read_exactly(6)
         logger.debug("received header: %s", header)
@@ -40,15 +57,80 @@ class _Cube:
         # derived classes must implement this
         raise NotImplementedError
 
+    def _start_reader(self):
+        # Once the device has been talked to, a single task reads every frame
+        # so that unsolicited messages are handled as they arrive.
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.ensure_future(self._read_messages())
+
+    async def _read_messages(self):
+        try:
+            while True:
+                msg = await self.recv()
+                await self.handle_message(msg)
+                self._dispatch(msg)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            pending = [future for _, future in self._waiters if not future.done()]
+            self._waiters = []
+            if not pending:
+                logger.error("message handling failed", exc_info=True)
+            for future in pending:
+                future.set_exception(e)
+
+    def _dispatch(self, msg):
+        waiters = []
+        for msg_ids, future in self._waiters:
+            if future.done():
+                continue
+            if msg.id in msg_ids:
+                future.set_result(msg)
+            else:
+                waiters.append((msg_ids, future))
+        self._waiters = waiters
+
+    def _start_recording(self):
+        self._samples = []
+
+    def _record_position(self, position):
+        if self._samples is not None:
+            self._samples.append((time.time(), position))
+
+    def _stop_recording(self):
+        samples = self._samples or []
+        self._samples = None
+        return {
+            "time": [t for t, _ in samples],
+            "position": [position for _, position in samples],
+        }
+
+    def _expect(self, wait_for_msgs):
+        """Get a future resolved by the next message whose ID is in
+        ``wait_for_msgs``."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((wait_for_msgs, future))
+        self._start_reader()
+        return future
+
+    async def _send_and_expect(self, message, wait_for_msgs):
+        """Send a message and return a future for its reply, without waiting
+        for it."""
+        future = self._expect(wait_for_msgs)
+        try:
+            await self.send(message)
+        except BaseException:
+            future.cancel()
+            raise
+        return future
+
     async def send_request(
         self, msgreq_id, wait_for_msgs, param1=0, param2=0, data=None
     ):
-        await self.send(Message(msgreq_id, param1, param2, data=data))
-        msg = None
-        while msg is None or msg.id not in wait_for_msgs:
-            msg = await self.recv()
-            await self.handle_message(msg)
-        return msg
+        reply = await self._send_and_expect(
+            Message(msgreq_id, param1, param2, data=data), wait_for_msgs
+        )
+        return await reply
 
     async def set_channel_enable_state(self, activated):
         """Enable or Disable channel 1.
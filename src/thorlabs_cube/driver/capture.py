@@ -0,0 +1,239 @@
+"""Bulk decoding of captured APT frame streams.
+
+A capture is the raw byte stream read from a controller's serial port, i.e.
+back to back frames as they would be consumed by :py:meth:`_Cube.recv()
+<thorlabs_cube.driver.base._Cube.recv>`. The frame boundaries are found with
+array operations over the header bytes of the whole capture rather than frame
+by frame, and the status fields are then gathered from every frame at once.
+"""
+
+import numpy as np
+
+from thorlabs_cube.driver.message import MGMSG
+
+_HEADER_SIZE = 6
+
+# Payload fields as (name, format, offset in the data part of the frame).
+# They mirror the layouts unpacked by Tdc, Tsc and Tpa handle_message().
+STATUS_LAYOUTS: dict[MGMSG, tuple[tuple[str, str, int], ...]] = {
+    MGMSG.MOT_GET_DCSTATUSUPDATE: (
+        ("position", "<i4", 2),
+        ("velocity", "<u2", 6),
+        ("status", "<u4", 10),
+    ),
+    MGMSG.MOT_GET_STATUSUPDATE: (
+        ("position", "<u4", 2),
+        ("encoder_count", "<u4", 6),
+        ("status_bits", "<u4", 10),
+        ("chan_identity_two", "<u2", 14),
+    ),
+    MGMSG.QUAD_GET_STATUSUPDATE: (
+        ("x_diff", "<i2", 6),
+        ("y_diff", "<i2", 8),
+        ("sum_val", "<u4", 10),
+        ("x_pos", "<i2", 14),
+        ("y_pos", "<i2", 16),
+        ("status_bits", "<u4", 18),
+    ),
+}
+
+FRAME_INDEX_DTYPE = np.dtype([("offset", "<i8"), ("id", "<u2"), ("size", "<u4")])
+
+# Frames can only start with one of these message IDs
+_KNOWN_IDS = np.zeros(1 << 16, dtype=bool)
+_KNOWN_IDS[[msg.value for msg in MGMSG]] = True
+
+# Chains of frames followed before the rest of a stream is walked frame by frame
+_MAX_CHAINS = 16
+
+
+def _unaligned(buf: np.ndarray, fmt: str, count: int) -> np.ndarray:
+    # view of the values of type fmt starting at each of the first count bytes
+    return np.ndarray((max(count, 0),), dtype=fmt, buffer=buf, strides=(1,))
+
+
+def _headers(buf: np.ndarray, offsets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # message IDs and frame sizes of the headers at the given offsets
+    words = _unaligned(buf, "<u2", len(buf) - 1)
+    lengths = words[offsets + 2].astype(np.int64)
+    sizes = np.where(buf[offsets + 4] & 0x80, _HEADER_SIZE + lengths, _HEADER_SIZE)
+    return words[offsets], sizes
+
+
+def _walk(buf: np.ndarray) -> np.ndarray:
+    # frame by frame reference walk, for streams with unknown message IDs
+    offsets = []
+    offset = 0
+    while len(buf) - offset >= _HEADER_SIZE:
+        size = _HEADER_SIZE
+        if buf[offset + 4] & 0x80:
+            size += int(buf[offset + 2]) | (int(buf[offset + 3]) << 8)
+        if len(buf) - offset < size:
+            break
+        offsets.append(offset)
+        offset += size
+    return np.array(offsets, dtype=np.int64)
+
+
+def _chain(buf: np.ndarray) -> tuple[np.ndarray, int]:
+    """Follow the frames of a stream from its first byte.
+
+    Every byte offset holding a known message ID is a candidate header, and so
+    is every offset where the frame of such a candidate ends, for frames of
+    unknown ID. Each candidate leads to the candidate where its frame ends, and
+    the frames of the stream are the candidates reached from offset 0. They are
+    collected by pointer doubling, in a number of passes logarithmic in the
+    number of frames, while false candidates found in the data part of frames
+    are never reached.
+
+    :return: The offsets of the complete frames reached and the offset where
+        the last of them ends, which is before the end of the stream if two
+        frames of unknown ID follow each other there.
+    """
+    heads = len(buf) - _HEADER_SIZE + 1
+    known = _KNOWN_IDS[_unaligned(buf, "<u2", heads)]
+    known[0] = True
+    offsets = np.flatnonzero(known)
+    ends = offsets + _headers(buf, offsets)[1]
+    # no frame header fits after the last frame, which may be truncated
+    last = ends >= heads
+    unknown = np.zeros(heads, dtype=bool)
+    unknown[ends[~last]] = True
+    unknown = np.flatnonzero(unknown & ~known)
+    unknown_ends = unknown + _headers(buf, unknown)[1]
+    # candidates leading nowhere, except for the first one, are never reached
+    candidates = known.copy()
+    linked = (unknown_ends >= heads) | known[np.minimum(unknown_ends, heads - 1)]
+    candidates[unknown[linked]] = True
+    candidates[offsets[~last & ~candidates[np.minimum(ends, heads - 1)]]] = False
+    candidates[0] = True
+    offsets = np.flatnonzero(candidates)
+    ends = offsets + _headers(buf, offsets)[1]
+    last = ends >= heads
+
+    # index of the next candidate, past the end for the last frame of the
+    # stream and one more where the chain breaks
+    count = len(offsets)
+    jump = np.empty(count + 2, dtype=np.int64)
+    jump[:count] = np.searchsorted(offsets, ends)
+    jump[:count][last] = count
+    jump[:count][~last & (offsets[np.minimum(jump[:count], count - 1)] != ends)] = (
+        count + 1
+    )
+    jump[count:] = count, count + 1
+    chain = np.zeros(1, dtype=np.int64)
+    while True:
+        # chain holds the first 2**k frames and jump leads 2**k frames ahead
+        reached = jump[chain]
+        reached = reached[reached < count]
+        if not len(reached):
+            break
+        chain = np.concatenate((chain, reached))
+        jump = jump[jump]
+    chain.sort()
+    end = int(ends[chain[-1]])
+    if end > len(buf):
+        chain = chain[:-1]
+    return offsets[chain], end
+
+
+def _frame_offsets(buf: np.ndarray) -> np.ndarray:
+    """Find the offset of every complete frame.
+
+    Streams holding frames of a single type are checked at once. Others are
+    followed with :py:func:`_chain`, again from where it stops, and the rest of
+    streams where it stops too often is walked frame by frame.
+    """
+    heads = len(buf) - _HEADER_SIZE + 1
+    if heads <= 0:
+        return np.empty(0, dtype=np.int64)
+    # most captures only hold frames of the type of the first one
+    size = int(_headers(buf, np.zeros(1, dtype=np.int64))[1][0])
+    count = len(buf) // size
+    if len(buf) - count * size < _HEADER_SIZE:
+        frames = np.ndarray((count, 5), dtype=np.uint8, buffer=buf, strides=(size, 1))
+        # the parameters of frames without data may differ
+        columns = [0, 1, 2, 3] if size > _HEADER_SIZE else [0, 1]
+        if np.all(frames[:, columns] == frames[0, columns]) and not np.any(
+            (frames[:, 4] ^ frames[0, 4]) & 0x80
+        ):
+            return np.arange(count, dtype=np.int64) * size
+
+    chunks = []
+    start = 0
+    for _ in range(_MAX_CHAINS):
+        offsets, end = _chain(buf[start:])
+        chunks.append(offsets + start)
+        start += end
+        if len(buf) - start < _HEADER_SIZE:
+            break
+    else:
+        chunks.append(_walk(buf[start:]) + start)
+    return np.concatenate(chunks)
+
+
+def index_frames(buffer) -> np.ndarray:
+    """Locate every frame in a captured byte stream.
+
+    A truncated frame at the end of the buffer is ignored.
+
+    :param buffer: Captured bytes (any object supporting the buffer protocol).
+    :return: A structured array with one entry per frame and the fields
+        ``offset`` (byte offset of the header), ``id`` (raw message ID) and
+        ``size`` (header plus data length).
+    :rtype: numpy.ndarray
+    """
+    buf = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = _frame_offsets(buf)
+    index = np.empty(len(offsets), dtype=FRAME_INDEX_DTYPE)
+    index["offset"] = offsets
+    index["id"], index["size"] = _headers(buf, offsets)
+    return index
+
+
+def status_dtype(msg_id: MGMSG) -> np.dtype:
+    """Get the decoded record type for a status update message.
+
+    :param msg_id: One of the messages in :py:data:`STATUS_LAYOUTS`.
+    :return: A packed structured dtype with the payload fields.
+    :rtype: numpy.dtype
+    """
+    return np.dtype([(name, fmt) for name, fmt, _ in STATUS_LAYOUTS[msg_id]])
+
+
+def decode_status_frames(buffer, msg_id: MGMSG) -> np.ndarray:
+    """Decode every status update of one type from a captured byte stream.
+
+    Frames of other types are skipped. Frames whose data part is too short
+    for the layout raise an error instead of being silently dropped.
+
+    :param buffer: Captured bytes (any object supporting the buffer protocol).
+    :param msg_id: The status message to decode:
+        ``MGMSG.MOT_GET_DCSTATUSUPDATE`` (TDC001/KDC101),
+        ``MGMSG.MOT_GET_STATUSUPDATE`` (TSC001/KSC101) or
+        ``MGMSG.QUAD_GET_STATUSUPDATE`` (TPA101/KPA101).
+    :return: A structured array with one record per frame, in capture order,
+        see :py:func:`status_dtype`.
+    :rtype: numpy.ndarray
+    """
+    if msg_id not in STATUS_LAYOUTS:
+        raise ValueError("No status layout known for {}".format(msg_id))
+    min_size = _HEADER_SIZE + max(
+        offset + np.dtype(fmt).itemsize for _, fmt, offset in STATUS_LAYOUTS[msg_id]
+    )
+    buf = np.frombuffer(buffer, dtype=np.uint8)
+    index = index_frames(buf)
+    index = index[index["id"] == msg_id.value]
+    short = np.flatnonzero(index["size"] < min_size)
+    if len(short):
+        raise ValueError(
+            "{} frame at offset {} is {} bytes, expected at least {}".format(
+                msg_id, index["offset"][short[0]], index["size"][short[0]], min_size
+            )
+        )
+
+    status = np.empty(len(index), dtype=status_dtype(msg_id))
+    for name, fmt, offset in STATUS_LAYOUTS[msg_id]:
+        values = _unaligned(buf, fmt, len(buf) - np.dtype(fmt).itemsize + 1)
+        status[name] = values[index["offset"] + _HEADER_SIZE + offset]
+    return status
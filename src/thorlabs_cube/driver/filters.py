@@ -0,0 +1,344 @@
+"""Streaming filters and decimation of the quad detector status updates.
+
+The TPA101/KPA101 status updates arrive faster than most consumers need.
+A :py:class:`FilterBank` collects the decoded updates of a detector into
+blocks, and passes each block to any number of named :py:class:`FilterChain`,
+each made of moving average, CIC decimation and first-order IIR stages
+processed with NumPy. Each chain keeps its own output buffer, at its own
+decimated rate, so that consumers read the rate they need without
+decoding or filtering the updates again.
+"""
+
+from typing import Callable, Optional
+
+import numpy as np
+
+from thorlabs_cube.driver.quad import ReadingBuffer
+
+# Fields of the status updates that are filtered
+FILTERED_FIELDS = ("x_diff", "y_diff", "sum_val", "x_pos", "y_pos")
+
+# A filter chain output, with the reception time of its last status update
+FILTERED_DTYPE = np.dtype(
+    [("time", "<f8")] + [(field, "<f8") for field in FILTERED_FIELDS]
+)
+
+
+def _moving_sum(history: np.ndarray, block: np.ndarray, length: int) -> np.ndarray:
+    # sum of each sample of the block with the length - 1 samples before it,
+    # history holding the length - 1 samples preceding the block
+    data = np.concatenate((history, block))
+    total = np.zeros((len(data) + 1, data.shape[1]))
+    np.cumsum(data, axis=0, out=total[1:])
+    return total[length:] - total[:-length]
+
+
+class MovingAverage:
+    """Mean of the last ``length`` samples, at the input rate.
+
+    The samples before the first one are taken equal to it.
+
+    :param length: Number of samples averaged.
+    """
+
+    factor = 1
+
+    def __init__(self, length: int) -> None:
+        if length <= 0:
+            raise ValueError("Length must be positive, got {}".format(length))
+        self.length = length
+        self._history: Optional[np.ndarray] = None
+
+    def to_dict(self) -> dict:
+        return {"type": "moving_average", "length": self.length}
+
+    def process(
+        self, values: np.ndarray, times: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Filter a block of samples.
+
+        :param values: Array of shape (number of samples, channels).
+        :param times: The time of each sample.
+        :return: The filtered samples and their times.
+        """
+        if not len(values):
+            return values, times
+        if self._history is None:
+            self._history = np.repeat(values[:1], self.length - 1, axis=0)
+        out = _moving_sum(self._history, values, self.length) / self.length
+        data = np.concatenate((self._history, values))
+        self._history = data[len(data) - self.length + 1 :]
+        return out, times
+
+
+class CICDecimator:
+    """Cascaded integrator-comb decimation.
+
+    Each output is the sample mean, repeated ``order`` times, over windows of
+    ``factor`` samples, taken every ``factor`` input samples. Order 1 is a
+    boxcar average of consecutive samples, higher orders attenuate the
+    aliased frequencies more at the cost of a longer response. The
+    integrators and combs are computed as running sums over each block with
+    the previous samples, which keeps their values bounded.
+
+    :param factor: Decimation factor.
+    :param order: Number of integrator-comb stages.
+    """
+
+    def __init__(self, factor: int, order: int = 1) -> None:
+        if factor <= 0 or order <= 0:
+            raise ValueError(
+                "Factor and order must be positive, got {} and {}".format(factor, order)
+            )
+        self.factor = factor
+        self.order = order
+        self._histories: list[Optional[np.ndarray]] = [None] * order
+        # number of input samples since the last output
+        self._phase = 0
+
+    def to_dict(self) -> dict:
+        return {"type": "cic", "factor": self.factor, "order": self.order}
+
+    def process(
+        self, values: np.ndarray, times: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Filter and decimate a block of samples.
+
+        :param values: Array of shape (number of samples, channels).
+        :param times: The time of each sample.
+        :return: The output samples and the time of the last input sample of
+            each.
+        """
+        if not len(values):
+            return values, times
+        sums = values
+        for k in range(self.order):
+            history = self._histories[k]
+            if history is None:
+                history = np.repeat(sums[:1], self.factor - 1, axis=0)
+            data = np.concatenate((history, sums))
+            sums = _moving_sum(history, sums, self.factor)
+            self._histories[k] = data[len(data) - self.factor + 1 :]
+        start = (self.factor - 1 - self._phase) % self.factor
+        self._phase = (self._phase + len(values)) % self.factor
+        return (
+            sums[start :: self.factor] / self.factor**self.order,
+            times[start :: self.factor],
+        )
+
+
+class FirstOrderIIR:
+    """First-order low-pass IIR filter, at the input rate.
+
+    Each output is ``y[n] = y[n-1] + alpha * (x[n] - y[n-1])``, starting from
+    the first sample. The time constant is about ``1 / alpha`` samples.
+
+    :param alpha: Smoothing factor, in range (0; 1]. 1 passes the samples
+        through.
+    """
+
+    factor = 1
+
+    # largest growth of the scaled running sums, which bounds their rounding
+    _MAX_GAIN = 1e4
+
+    def __init__(self, alpha: float) -> None:
+        if not 0 < alpha <= 1:
+            raise ValueError("Alpha must be in range (0;1], got {}".format(alpha))
+        self.alpha = alpha
+        beta = 1 - alpha
+        # the block is processed in chunks over which beta**-n stays bounded
+        chunk = 1
+        if beta > 0:
+            chunk = max(int(np.log(self._MAX_GAIN) / -np.log(beta)), 1)
+        self._powers = beta ** np.arange(chunk)[:, np.newaxis]
+        self._state: Optional[np.ndarray] = None
+
+    def to_dict(self) -> dict:
+        return {"type": "iir", "alpha": self.alpha}
+
+    def process(
+        self, values: np.ndarray, times: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Filter a block of samples.
+
+        :param values: Array of shape (number of samples, channels).
+        :param times: The time of each sample.
+        :return: The filtered samples and their times.
+        """
+        if not len(values):
+            return values, times
+        if self._state is None:
+            self._state = values[0].copy()
+        beta = 1 - self.alpha
+        out = np.empty(values.shape)
+        # y[n] = beta**(n+1) y[-1] + alpha beta**n sum(x[k] beta**-k, k <= n)
+        for start in range(0, len(values), len(self._powers)):
+            x = values[start : start + len(self._powers)]
+            powers = self._powers[: len(x)]
+            y = powers * (
+                beta * self._state + self.alpha * np.cumsum(x / powers, axis=0)
+            )
+            out[start : start + len(x)] = y
+            self._state = y[-1]
+        return out, times
+
+
+_STAGES = {
+    "moving_average": MovingAverage,
+    "cic": CICDecimator,
+    "iir": FirstOrderIIR,
+}
+
+
+def make_stage(spec: dict):
+    """Create a filter stage from its description.
+
+    :param spec: A dict with the stage ``type``, ``"moving_average"``,
+        ``"cic"`` or ``"iir"``, and the parameters of its class, e.g.
+        ``{"type": "cic", "factor": 10, "order": 2}``.
+    :return: The filter stage.
+    """
+    params = dict(spec)
+    kind = params.pop("type", None)
+    if kind not in _STAGES:
+        raise ValueError(
+            "Filter type must be one of {}, got {}".format(", ".join(_STAGES), kind)
+        )
+    return _STAGES[kind](**params)
+
+
+class FilterChain:
+    """Filter stages applied in sequence, with a buffer of their outputs.
+
+    :param stages: The filter stages, see :py:func:`make_stage`.
+    :param size: Number of outputs kept.
+    """
+
+    def __init__(self, stages: list, size: int = 1000) -> None:
+        self.stages = stages
+        self.factor = int(np.prod([stage.factor for stage in stages]))
+        self.outputs = ReadingBuffer(size, FILTERED_DTYPE)
+        self._listeners: list[Callable[[np.ndarray], None]] = []
+
+    def to_dict(self) -> dict:
+        """Get the description of the chain.
+
+        :return: A dict with the ``stages`` descriptions, the total
+            ``decimation`` factor and the number of ``outputs`` buffered.
+        :rtype: dict
+        """
+        return {
+            "stages": [stage.to_dict() for stage in self.stages],
+            "decimation": self.factor,
+            "outputs": len(self.outputs),
+        }
+
+    def add_listener(self, listener: Callable[[np.ndarray], None]) -> None:
+        """Call a function with the outputs of each processed block.
+
+        :param listener: The function to call, with an array of
+            :py:data:`FILTERED_DTYPE` outputs. It must not block.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[np.ndarray], None]) -> None:
+        """Stop calling a function added with :py:meth:`add_listener`."""
+        self._listeners.remove(listener)
+
+    def process(self, values: np.ndarray, times: np.ndarray) -> None:
+        """Filter a block of samples into the output buffer.
+
+        :param values: Array of shape (number of samples,
+            len(:py:data:`FILTERED_FIELDS`)).
+        :param times: The time of each sample.
+        """
+        for stage in self.stages:
+            values, times = stage.process(values, times)
+        if not len(values):
+            return
+        outputs = np.empty(len(values), dtype=FILTERED_DTYPE)
+        outputs["time"] = times
+        for i, field in enumerate(FILTERED_FIELDS):
+            outputs[field] = values[:, i]
+        self.outputs.extend(outputs)
+        for listener in self._listeners:
+            listener(outputs)
+
+
+class FilterBank:
+    """Named filter chains fed with the same status updates.
+
+    The status updates are collected into blocks, and each block is passed
+    to every chain, so that a status update is only converted once whatever
+    the number of chains. The block size bounds the latency of the chain
+    outputs, which are also updated when read with :py:meth:`latest`.
+
+    :param block_size: Number of status updates processed at once.
+    """
+
+    def __init__(self, block_size: int = 32) -> None:
+        self.chains: dict[str, FilterChain] = {}
+        self._values = np.empty((block_size, len(FILTERED_FIELDS)))
+        self._times = np.empty(block_size)
+        self._pending = 0
+
+    def add(self, name: str, chain: FilterChain) -> None:
+        """Add a chain, replacing the chain of the same name.
+
+        The pending status updates are processed first, so that the new
+        chain starts from the next one.
+        """
+        self.flush()
+        self.chains[name] = chain
+
+    def remove(self, name: str) -> None:
+        """Remove a chain."""
+        if name not in self.chains:
+            raise ValueError("No filter chain named {}".format(name))
+        del self.chains[name]
+
+    def append(self, reading: tuple, timestamp: float) -> None:
+        """Add a status update, e.g. as a Tpa status listener.
+
+        :param reading: The (x_diff, y_diff, sum_val, x_pos, y_pos,
+            status_bits) values of a status update.
+        :param timestamp: The reception time of the status update.
+        """
+        self._values[self._pending] = reading[: len(FILTERED_FIELDS)]
+        self._times[self._pending] = timestamp
+        self._pending += 1
+        if self._pending == len(self._times):
+            self.flush()
+
+    def flush(self) -> None:
+        """Process the status updates added since the last block."""
+        if not self._pending:
+            return
+        values = self._values[: self._pending]
+        times = self._times[: self._pending]
+        for chain in self.chains.values():
+            chain.process(values, times)
+        self._pending = 0
+
+    def latest(
+        self,
+        name: str,
+        num_samples: Optional[int] = None,
+        duration: Optional[float] = None,
+    ) -> dict:
+        """Get the latest outputs of a chain.
+
+        :param name: Name of the chain.
+        :param num_samples: Maximum number of outputs, all by default.
+        :param duration: Only get the outputs within this many seconds of
+            the last one.
+        :return: A dict with a list of values, oldest first, for ``time``
+            and each of :py:data:`FILTERED_FIELDS`.
+        :rtype: dict
+        """
+        if name not in self.chains:
+            raise ValueError("No filter chain named {}".format(name))
+        self.flush()
+        outputs = self.chains[name].outputs.latest(num_samples, duration)
+        return {field: outputs[field].tolist() for field in FILTERED_DTYPE.names}
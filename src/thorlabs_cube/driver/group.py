@@ -0,0 +1,506 @@
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+import numpy as np
+
+from thorlabs_cube.driver.profile import move_time, vector_profile
+from thorlabs_cube.driver.tcube.tdc import (
+    _MOVE_END_MSGS,
+    _MOVE_HISTORY,
+    _MOVE_TIMEOUT_FACTOR,
+    _MOVE_TIMEOUT_MARGIN,
+    Tdc,
+    _move_state,
+)
+
+logger = logging.getLogger(__name__)
+
+# "Homed" status bit of the DC servo controllers
+_HOMED_BIT = 0x400
+
+
+class _GroupMove:
+    def __init__(self, axes: list, handles: list[int], sent: list[float]) -> None:
+        self.axes = axes
+        self.handles = handles
+        self.futures = [axis._move_future(h) for axis, h in zip(axes, handles)]
+        self.sent = sent
+        self.completed: list[Optional[float]] = [None] * len(axes)
+        # predicted move durations, for vector moves
+        self.durations: Optional[list[float]] = None
+        for i, future in enumerate(self.futures):
+            future.add_done_callback(functools.partial(self._done, i))
+
+    def _done(self, i: int, future: asyncio.Future) -> None:
+        self.completed[i] = time.monotonic()
+
+    def done(self) -> bool:
+        return all(future.done() for future in self.futures)
+
+    def timeout(self) -> Optional[float]:
+        if self.durations is not None:
+            return max(self.durations) * _MOVE_TIMEOUT_FACTOR + _MOVE_TIMEOUT_MARGIN
+        timeouts = [
+            axis._move_timeouts.get(handle)
+            for axis, handle in zip(self.axes, self.handles)
+        ]
+        return None if None in timeouts else max(timeouts)
+
+    def release(self) -> None:
+        # the moves of the axes are only waited for through the group
+        for axis, handle in zip(self.axes, self.handles):
+            axis._moves.pop(handle, None)
+            axis._move_timeouts.pop(handle, None)
+
+    def report(self) -> dict:
+        t0 = self.sent[0]
+        return {
+            "end": [_move_state(future) for future in self.futures],
+            "skew": self.sent[-1] - t0,
+            "start": [t - t0 for t in self.sent],
+            "completed": [None if t is None else t - t0 for t in self.completed],
+            "predicted": (
+                None
+                if self.durations is None
+                else [t - t0 + d for t, d in zip(self.sent, self.durations)]
+            ),
+        }
+
+
+class MotorGroup:
+    """Several DC servo motor controllers (TDC001 or KDC101) driven as one
+    group.
+
+    Moves are started on all axes from one task: the targets are loaded on
+    every controller first, then the start messages are written back to back
+    so that the axes start as close together as the serial links allow.
+
+    :param axes: The :py:class:`Tdc<thorlabs_cube.driver.tcube.tdc.Tdc>` or
+        :py:class:`Kdc<thorlabs_cube.driver.kcube.kdc.Kdc>` drivers. Axes are
+        identified by their index in this list.
+    :param names: A stable name per axis, e.g. its serial device, used as
+        the key of the homed state. Defaults to the axis indices.
+    :param state_file: Path of a JSON file where the homed state of the axes
+        is kept across restarts of the controller process, or None.
+    """
+
+    def __init__(
+        self,
+        axes: list,
+        names: Optional[list[str]] = None,
+        state_file: Optional[str] = None,
+    ) -> None:
+        if not axes:
+            raise ValueError("A motor group needs at least one axis")
+        if names is not None and len(names) != len(axes):
+            raise ValueError("Expected one name per axis")
+        for i, axis in enumerate(axes):
+            # the solenoid controllers have no move bookkeeping nor velocity
+            # parameters
+            if not isinstance(axis, Tdc):
+                raise ValueError(
+                    "Axis {} is not a DC servo motor controller: {}".format(
+                        i, type(axis).__name__
+                    )
+                )
+        self.axes = axes
+        self.names = names if names is not None else [str(i) for i in range(len(axes))]
+        self.state_file = state_file
+        # position counter of each homed axis, by name
+        self._homed: dict[str, int] = self._load_homed_state()
+        self._move_handles = itertools.count(1)
+        self._moves: dict[int, _GroupMove] = {}
+        self._velocity_limits: list[Optional[tuple[int, int]]] = [None] * len(axes)
+
+    def close(self) -> None:
+        """Close all the devices of the group."""
+        for axis in self.axes:
+            axis.close()
+
+    def _check_positions(self, positions: list[int]) -> None:
+        if len(positions) != len(self.axes):
+            raise ValueError(
+                "Expected one position per axis ({}), got {}".format(
+                    len(self.axes), len(positions)
+                )
+            )
+
+    def _move(self, handle: int) -> _GroupMove:
+        try:
+            return self._moves[handle]
+        except KeyError:
+            raise ValueError("Unknown move handle: {}".format(handle)) from None
+
+    async def start_move_absolute(self, positions: list[int]) -> int:
+        """Start an absolute move on every axis without waiting for it to end.
+
+        :param positions: The absolute position of each axis, in encoder
+            counts.
+        :return: A move handle for :py:meth:`wait_move()
+            <MotorGroup.wait_move>` and :py:meth:`move_status()
+            <MotorGroup.move_status>`.
+        :rtype: int
+        """
+        self._check_positions(positions)
+        messages = await asyncio.gather(
+            *(
+                axis._prepare_move_absolute(position)
+                for axis, position in zip(self.axes, positions)
+            )
+        )
+        handles = []
+        sent = []
+        for axis, position, message in zip(self.axes, positions, messages):
+            axis_handle, axis_sent = await axis._send_move(
+                message, _MOVE_END_MSGS, axis._estimate_move_time(position), position
+            )
+            handles.append(axis_handle)
+            sent.append(axis_sent)
+
+        handle = next(self._move_handles)
+        self._moves[handle] = _GroupMove(self.axes, handles, sent)
+        for old in list(self._moves):
+            if len(self._moves) <= _MOVE_HISTORY:
+                break
+            if self._moves[old].done():
+                self._moves.pop(old).release()
+        return handle
+
+    async def wait_move(self, handle: int, timeout: Optional[float] = None) -> dict:
+        """Wait for a group move to end on every axis.
+
+        :param handle: The handle returned when the move was started.
+        :param timeout: Maximum time to wait in seconds. By default, twice
+            the predicted duration plus 2 seconds for vector moves, and the
+            longest default timeout of the axes otherwise, cf.
+            :py:meth:`Tdc.wait_move()
+            <thorlabs_cube.driver.tcube.tdc.Tdc.wait_move>`. Expiry raises
+            ``asyncio.TimeoutError`` but does not affect the move, which can be
+            waited for again. The blocking moves only time out when given a
+            timeout.
+        :return: The move report, a dict with the keys ``end`` (how the move
+            ended on each axis), ``skew`` (time between the first and the last
+            start message, in seconds), ``start`` and ``completed`` (per axis
+            times in seconds since the first start message) and ``predicted``
+            (per axis predicted arrival times for vector moves, None
+            otherwise).
+        :rtype: dict
+        """
+        if timeout is None:
+            timeout = self._move(handle).timeout()
+        return await self._wait_move(handle, timeout)
+
+    async def _wait_move(self, handle: int, timeout: Optional[float] = None) -> dict:
+        # as Tdc._wait_move(), without the default timeout of the blocking moves
+        move = self._move(handle)
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(asyncio.gather(*move.futures)), timeout
+            )
+        finally:
+            if move.done():
+                self._moves.pop(handle, None)
+                move.release()
+        await self._update_homed_state()
+        return move.report()
+
+    def move_status(self, handle: int) -> dict:
+        """Get the state of a group move without waiting.
+
+        :param handle: The handle returned when the move was started.
+        :return: The move report, cf. :py:meth:`wait_move()
+            <MotorGroup.wait_move>`. Axes still moving are reported as
+            "moving" with a ``completed`` time of None.
+        :rtype: dict
+        """
+        return self._move(handle).report()
+
+    async def move_absolute(
+        self, positions: list[int], timeout: Optional[float] = None
+    ) -> dict:
+        """Move every axis to an absolute position.
+
+        This call is blocking until the move has ended on all the axes.
+
+        :param positions: The absolute position of each axis, in encoder
+            counts.
+        :param timeout: Maximum time to wait in seconds, or None.
+        :return: The move report, cf. :py:meth:`wait_move()
+            <MotorGroup.wait_move>`.
+        :rtype: dict
+        """
+        return await self._wait_move(await self.start_move_absolute(positions), timeout)
+
+    def _load_homed_state(self) -> dict[str, int]:
+        if self.state_file is None:
+            return {}
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning("ignoring corrupt homed state file %s", self.state_file)
+            return {}
+
+    def _save_homed_state(self) -> None:
+        if self.state_file is None:
+            return
+        # replace the file atomically so a crash never leaves half a state
+        tmp = self.state_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._homed, f)
+        os.replace(tmp, self.state_file)
+
+    async def _update_homed_state(self) -> None:
+        # the position of the status updates may be stale, the counters are
+        # read once the move has ended
+        homed = [
+            (name, axis)
+            for name, axis in zip(self.names, self.axes)
+            if name in self._homed
+        ]
+        if not homed:
+            return
+        status = await asyncio.gather(*(axis.get_status_bits() for _, axis in homed))
+        # an axis without the homed bit lost its home, e.g. by a power cycle
+        for (name, _), bits in zip(homed, status):
+            if not bits & _HOMED_BIT:
+                del self._homed[name]
+        homed = [(name, axis) for name, axis in homed if name in self._homed]
+        positions = await asyncio.gather(
+            *(axis.get_position_counter() for _, axis in homed)
+        )
+        for (name, _), position in zip(homed, positions):
+            self._homed[name] = position
+        self._save_homed_state()
+
+    async def _is_homed(self, i: int) -> bool:
+        axis = self.axes[i]
+        status = await axis.get_status_bits()
+        if status & _HOMED_BIT:
+            return True
+        # The position counter restarts from 0 at power up, finding the
+        # counter recorded after the last move proves the axis kept its home.
+        recorded = self._homed.get(self.names[i])
+        position = await axis.get_position_counter()
+        return recorded is not None and recorded != 0 and position == recorded
+
+    async def _home_axes(self, axes: list[int], force: bool, result: list) -> None:
+        # axes of one homing group are homed one after the other
+        for i in axes:
+            if not force and await self._is_homed(i):
+                result[i] = "skipped"
+                continue
+            axis = self.axes[i]
+            end = await axis.wait_move(await axis.start_move_home())
+            if end != "homed":
+                raise ValueError("Homing axis {} {}".format(i, end))
+            self._homed[self.names[i]] = await axis.get_position_counter()
+            self._save_homed_state()
+            result[i] = "homed"
+
+    async def home(
+        self, groups: Optional[list[list[int]]] = None, force: bool = False
+    ) -> list[str]:
+        """Home the axes of the group concurrently.
+
+        Axes that are already homed are skipped: either the controller
+        reports the homed status bit, or its position counter matches the
+        value recorded after the last homing or group move, which proves that
+        it was not power cycled since. Group moves forget the axes that no
+        longer report the homed bit.
+
+        :param groups: Lists of axis indices that must not move together.
+            The axes of a list are homed one after the other, while distinct
+            lists, and the axes not in any list, are homed concurrently. By
+            default, all the axes are homed concurrently.
+        :param force: Home every axis, even if it is known to be homed.
+        :return: "homed" or "skipped" for each axis.
+        :rtype: list of str
+        """
+        groups = [list(group) for group in groups or []]
+        grouped = [i for group in groups for i in group]
+        if len(set(grouped)) != len(grouped) or not all(
+            0 <= i < len(self.axes) for i in grouped
+        ):
+            raise ValueError("Homing groups must hold distinct axis indices")
+        groups += [[i] for i in range(len(self.axes)) if i not in grouped]
+
+        result = [None] * len(self.axes)
+        await asyncio.gather(
+            *(self._home_axes(group, force, result) for group in groups)
+        )
+        return result
+
+    def set_velocity_limits(self, limits: list[tuple[int, int]]) -> None:
+        """Set the velocity limits used by vector moves.
+
+        By default, the limits of an axis are the velocity parameters it has
+        when the first vector move is planned.
+
+        :param limits: An (acceleration, max_velocity) tuple per axis, in
+            encoder counts/sec/sec and encoder counts/sec.
+        """
+        if len(limits) != len(self.axes):
+            raise ValueError(
+                "Expected limits for each axis ({}), got {}".format(
+                    len(self.axes), len(limits)
+                )
+            )
+        self._velocity_limits = [
+            (int(acceleration), int(max_velocity))
+            for acceleration, max_velocity in limits
+        ]
+
+    async def get_velocity_limits(self) -> list[tuple[int, int]]:
+        """Get the velocity limits used by vector moves.
+
+        :return: An (acceleration, max_velocity) tuple per axis.
+        :rtype: list of 2 int tuples
+        """
+        for i, axis in enumerate(self.axes):
+            if self._velocity_limits[i] is None:
+                self._velocity_limits[i] = tuple(await axis.get_velocity_parameters())
+        return list(self._velocity_limits)
+
+    async def start_move_vector(self, positions: list[int]) -> int:
+        """Start a coordinated absolute move so that all axes arrive together.
+
+        The velocity parameters of each axis are scaled from the
+        :py:meth:`velocity limits<MotorGroup.set_velocity_limits>` so that
+        all the axes follow the same trapezoidal profile, scaled by their
+        distance. Only the parameters that differ from the values last set
+        on an axis are written. The velocity parameters are left scaled after
+        the move.
+
+        :param positions: The absolute position of each axis, in encoder
+            counts.
+        :return: A move handle for :py:meth:`wait_move()
+            <MotorGroup.wait_move>` and :py:meth:`move_status()
+            <MotorGroup.move_status>`.
+        :rtype: int
+        """
+        self._check_positions(positions)
+        limits = np.array(await self.get_velocity_limits(), dtype=float)
+        current = await asyncio.gather(
+            *(axis.get_position_counter() for axis in self.axes)
+        )
+        distances = np.subtract(positions, current)
+        accelerations, velocities, _ = vector_profile(
+            distances, limits[:, 0], limits[:, 1]
+        )
+        # round down to stay within the limits
+        accelerations = np.maximum(np.floor(accelerations), 1).astype(int)
+        velocities = np.maximum(np.floor(velocities), 1).astype(int)
+
+        writes = []
+        for axis, distance, acceleration, velocity in zip(
+            self.axes, distances, accelerations.tolist(), velocities.tolist()
+        ):
+            if distance != 0 and axis.velocity_parameters != (acceleration, velocity):
+                writes.append(axis.set_velocity_parameters(acceleration, velocity))
+        await asyncio.gather(*writes)
+
+        handle = await self.start_move_absolute(positions)
+        self._moves[handle].durations = move_time(
+            distances, accelerations, velocities
+        ).tolist()
+        return handle
+
+    async def move_vector(
+        self, positions: list[int], timeout: Optional[float] = None
+    ) -> dict:
+        """Make a coordinated absolute move so that all axes arrive together.
+
+        This call is blocking until the move has ended on all the axes. See
+        :py:meth:`start_move_vector()<MotorGroup.start_move_vector>`.
+
+        :param positions: The absolute position of each axis, in encoder
+            counts.
+        :param timeout: Maximum time to wait in seconds, or None.
+        :return: The move report, cf. :py:meth:`wait_move()
+            <MotorGroup.wait_move>`, with the predicted arrival times.
+        :rtype: dict
+        """
+        return await self._wait_move(await self.start_move_vector(positions), timeout)
+
+
+class MotorGroupSim:
+    def __init__(
+        self,
+        num_axes: int,
+        names: Optional[list[str]] = None,
+        state_file: Optional[str] = None,
+    ) -> None:
+        self.positions = [0] * num_axes
+        self.moves: dict[int, dict] = {}
+        self.velocity_limits = [(1, 1)] * num_axes
+
+    def close(self) -> None:
+        pass
+
+    def start_move_absolute(self, positions: list[int]) -> int:
+        if len(positions) != len(self.positions):
+            raise ValueError(
+                "Expected one position per axis ({}), got {}".format(
+                    len(self.positions), len(positions)
+                )
+            )
+        self.positions = list(positions)
+        handle = len(self.moves) + 1
+        self.moves[handle] = {
+            "end": ["completed"] * len(positions),
+            "skew": 0.0,
+            "start": [0.0] * len(positions),
+            "completed": [0.0] * len(positions),
+            "predicted": None,
+        }
+        return handle
+
+    def wait_move(self, handle: int, timeout: Optional[float] = None) -> dict:
+        return self.move_status(handle)
+
+    def move_status(self, handle: int) -> dict:
+        if handle not in self.moves:
+            raise ValueError("Unknown move handle: {}".format(handle))
+        return self.moves[handle]
+
+    def move_absolute(
+        self, positions: list[int], timeout: Optional[float] = None
+    ) -> dict:
+        return self.wait_move(self.start_move_absolute(positions), timeout)
+
+    def home(
+        self, groups: Optional[list[list[int]]] = None, force: bool = False
+    ) -> list[str]:
+        self.positions = [0] * len(self.positions)
+        return ["homed"] * len(self.positions)
+
+    def set_velocity_limits(self, limits: list[tuple[int, int]]) -> None:
+        if len(limits) != len(self.positions):
+            raise ValueError(
+                "Expected limits for each axis ({}), got {}".format(
+                    len(self.positions), len(limits)
+                )
+            )
+        self.velocity_limits = [tuple(limit) for limit in limits]
+
+    def get_velocity_limits(self) -> list[tuple[int, int]]:
+        return self.velocity_limits
+
+    def start_move_vector(self, positions: list[int]) -> int:
+        handle = self.start_move_absolute(positions)
+        self.moves[handle]["predicted"] = [0.0] * len(positions)
+        return handle
+
+    def move_vector(
+        self, positions: list[int], timeout: Optional[float] = None
+    ) -> dict:
+        return self.wait_move(self.start_move_vector(positions), timeout)
@@ -1,6 +1,8 @@
 import struct as st
+from typing import Optional
 
 from thorlabs_cube.driver.message import MGMSG, Message, MsgError
+from thorlabs_cube.driver.scan import PositionTriggerScan
 from thorlabs_cube.driver.tcube.tdc import Tdc, TdcSim
 
 
@@ -29,13 +31,9 @@ class Kdc(Tdc):
             MGMSG.MOT_MOVE_STOPPED,
             MGMSG.MOT_GET_DCSTATUSUPDATE,
         ]:
-            if self.status_report_counter == 25:
-                self.status_report_counter = 0
-                await self.send(Message(MGMSG.MOT_ACK_DCSTATUSUPDATE))
-            else:
-                self.status_report_counter += 1
-            # 'r' is a currently unused and reserved field
-            self.position, self.velocity, r, self.status = st.unpack("<LHHL", data[2:])
+            await self._handle_status(data)
+        elif msg_id == MGMSG.MOT_MOVE_HOMED:
+            self._set_moving(False)
 
     async def set_digital_outputs_config(self):
         """Set digital output pins on the motor control output port.
@@ -378,6 +376,74 @@ class Kdc(Tdc):
         )
         return st.unpack("<llllllll", get_msg.data[2:34])
 
+    async def start_position_scan(
+        self,
+        start: int,
+        stop: int,
+        step: int,
+        pulse_width: int = 100,
+        port: int = 1,
+        polarity: int = 1,
+        margin: Optional[int] = None,
+    ) -> dict:
+        """Start a scan with hardware-timed trigger pulses at regular
+        positions.
+
+        The stage is moved just before ``start``, then the TRIG port is set to
+        pulse at ``start``, ``start + step``, ... up to ``stop`` and the sweep
+        move is started. The pulses are generated by the controller, the host
+        only waits for the end of the sweep. The configuration of the other
+        TRIG port is kept.
+
+        :param start: First trigger position, in encoder counts.
+        :param stop: Scan end, in encoder counts. The scan moves backwards if
+            it is below ``start``.
+        :param step: Distance between trigger positions, in encoder counts.
+        :param pulse_width: Trigger output pulse width, in µs.
+        :param port: The TRIG port that outputs the pulses, 1 or 2.
+        :param polarity: The active state of the port, 1 for high or 2 for
+            low.
+        :param margin: Run-up and run-out distance in encoder counts, half a
+            step by default.
+        :return: A dict with the ``handle`` of the sweep move, for
+            :py:meth:`wait_move()<thorlabs_cube.driver.tcube.tdc.Tdc.wait_move>`,
+            and the expected pulse ``positions``.
+        :rtype: dict
+        """
+        scan = PositionTriggerScan(start, stop, step, pulse_width, margin)
+        await self.move_absolute(scan.move_from)
+        config = scan.trigger_io_config(
+            await self.get_trigger_io_config(), port, polarity
+        )
+        await self.set_trigger_io_config(*config)
+        await self.set_position_trigger_parameters(*scan.trigger_parameters)
+        handle = await self.start_move_absolute(scan.move_to)
+        return {"handle": handle, "positions": scan.positions.tolist()}
+
+    async def position_scan(
+        self,
+        start: int,
+        stop: int,
+        step: int,
+        pulse_width: int = 100,
+        port: int = 1,
+        polarity: int = 1,
+        margin: Optional[int] = None,
+    ) -> list[int]:
+        """Run a scan with hardware-timed trigger pulses at regular positions.
+
+        This call is blocking until the sweep move has ended. See
+        :py:meth:`start_position_scan()<Kdc.start_position_scan>`.
+
+        :return: The expected pulse positions, in encoder counts.
+        :rtype: list of int
+        """
+        scan = await self.start_position_scan(
+            start, stop, step, pulse_width, port, polarity, margin
+        )
+        await self.wait_move(scan["handle"])
+        return scan["positions"]
+
 
 class KdcSim(TdcSim):
     def set_digital_outputs_config(self):
@@ -467,3 +533,36 @@ class KdcSim(TdcSim):
             self.pulse_width,
             self.num_cycles,
         )
+
+    async def start_position_scan(
+        self,
+        start: int,
+        stop: int,
+        step: int,
+        pulse_width: int = 100,
+        port: int = 1,
+        polarity: int = 1,
+        margin: Optional[int] = None,
+    ) -> dict:
+        scan = PositionTriggerScan(start, stop, step, pulse_width, margin)
+        await self.set_trigger_io_config(
+            *scan.trigger_io_config((0, 1, 0, 1), port, polarity)
+        )
+        await self.set_position_trigger_parameters(*scan.trigger_parameters)
+        handle = self.start_move_absolute(scan.move_to)
+        return {"handle": handle, "positions": scan.positions.tolist()}
+
+    async def position_scan(
+        self,
+        start: int,
+        stop: int,
+        step: int,
+        pulse_width: int = 100,
+        port: int = 1,
+        polarity: int = 1,
+        margin: Optional[int] = None,
+    ) -> list[int]:
+        scan = await self.start_position_scan(
+            start, stop, step, pulse_width, port, polarity, margin
+        )
+        return scan["positions"]
@@ -1,7 +1,12 @@
+import asyncio
 import struct as st
+import time
 from typing import Tuple
 
+import numpy as np
+
 from thorlabs_cube.driver.message import MGMSG, QUADMSG, Message, MsgError
+from thorlabs_cube.driver.quad import READING_DTYPE, trigger_thresholds
 from thorlabs_cube.driver.tcube.tpa import Tpa, TpaSim
 
 
@@ -32,23 +37,7 @@ class Kpa(Tpa):
             raise MsgError("Hardware error, please disconnect and reconnect the KPA101")
 
         elif msg_id == MGMSG.QUAD_GET_STATUSUPDATE:
-            x_diff, y_diff, sum_val, x_pos, y_pos, status_bits = st.unpack(
-                "<hhIhhI", data[6:20]
-            )
-
-            # Update internal state variables with the extracted values
-            self.x_diff = x_diff
-            self.y_diff = y_diff
-            self.sum_val = sum_val
-            self.x_pos = x_pos
-            self.y_pos = y_pos
-            self.status_bits = status_bits
-
-            if self.status_report_counter == 25:
-                self.status_report_counter = 0
-                await self.send(Message(MGMSG.QUAD_ACK_STATUSUPDATE))
-            else:
-                self.status_report_counter += 1
+            await self._handle_status(data)
 
     async def set_trigger_config(
         self,
@@ -111,6 +100,54 @@ class Kpa(Tpa):
 
         return st.unpack("<HHHHHHHHHHHHHHHHH", get_msg.data)[1:]
 
+    async def calibrate_trigger(
+        self, duration: float = 1.0, false_rate: float = 1e-3, apply: bool = True
+    ) -> dict:
+        """Calibrate the trigger thresholds on the current beam.
+
+        The status updates are recorded for ``duration``, with the beam in
+        the state the triggers should not fire in, and the sum window and
+        difference threshold are set from their distributions, see
+        :py:func:`trigger_thresholds()
+        <thorlabs_cube.driver.quad.trigger_thresholds>`. Both triggers get
+        the same thresholds in a single configuration write, keeping their
+        modes and polarities.
+
+        The status updates must be enabled, e.g. with
+        :py:meth:`hardware_start_update_messages()
+        <thorlabs_cube.driver.base._Cube.hardware_start_update_messages>`.
+
+        :param duration: Recording time, in seconds.
+        :param false_rate: Fraction of the status updates of the nominal
+            beam that may trigger.
+        :param apply: False to only propose the thresholds.
+        :return: The thresholds and the statistics they were taken from, see
+            :py:func:`trigger_thresholds()
+            <thorlabs_cube.driver.quad.trigger_thresholds>`, and whether
+            they were ``applied``.
+        :rtype: dict
+        """
+        frames = []
+
+        def record(reading: tuple, timestamp: float) -> None:
+            frames.append((timestamp, *reading))
+
+        self.add_status_listener(record)
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            self.remove_status_listener(record)
+        result = trigger_thresholds(np.array(frames, dtype=READING_DTYPE), false_rate)
+        if apply:
+            config = list((await self.get_trigger_config())[:10])
+            for trigger in (0, 5):
+                config[trigger + 2] = result["sum_min"]
+                config[trigger + 3] = result["sum_max"]
+                config[trigger + 4] = result["diff_threshold"]
+            await self.set_trigger_config(*config)
+        result["applied"] = apply
+        return result
+
     async def set_digital_outputs(self, trigOne: int, trigTwo: int) -> None:
         """Set digital outputs for TRIG1 and TRIG2.
 
@@ -142,6 +179,7 @@ class KpaSim(TpaSim):
     """Simulation class for KPA101."""
 
     def __init__(self):
+        super().__init__()
         self.trigger_config = (0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
         self.digital_outputs = 0x00
 
@@ -180,6 +218,24 @@ class KpaSim(TpaSim):
     ) -> tuple[int, int, int, int, int, int, int, int, int, int]:
         return self.trigger_config
 
+    def calibrate_trigger(
+        self, duration: float = 1.0, false_rate: float = 1e-3, apply: bool = True
+    ) -> dict:
+        # a single reading of the simulated state
+        reading = (time.monotonic(), *self.quad_readings, self.status_bits)
+        result = trigger_thresholds(
+            np.array([reading], dtype=READING_DTYPE), false_rate
+        )
+        if apply:
+            config = list(self.trigger_config)
+            for trigger in (0, 5):
+                config[trigger + 2] = result["sum_min"]
+                config[trigger + 3] = result["sum_max"]
+                config[trigger + 4] = result["diff_threshold"]
+            self.set_trigger_config(*config)
+        result["applied"] = apply
+        return result
+
     def set_digital_outputs(self, digital_outputs: int) -> None:
         self.digital_outputs = digital_outputs
 
@@ -1,6 +1,9 @@
 import struct as st
+import time
+from typing import Optional
 
 from thorlabs_cube.driver.message import MGMSG, Message
+from thorlabs_cube.driver.scan import PositionTriggerScan
 from thorlabs_cube.driver.tcube.tsc import Tsc, TscSim
 
 
@@ -195,6 +198,75 @@ class Ksc(Tsc):
 
         return st.unpack("<LLLLLLLL", get_msg.data[2:])
 
+    async def position_scan(
+        self,
+        start: int,
+        stop: int,
+        step: int,
+        pulse_width: int = 100,
+        port: int = 1,
+        polarity: int = 1,
+        margin: Optional[int] = None,
+    ) -> list[int]:
+        """Run a scan with hardware-timed trigger pulses at regular positions.
+
+        The stage is moved just before ``start``, then the TRIG port is set to
+        pulse at ``start``, ``start + step``, ... up to ``stop`` and the stage
+        is swept across them. The pulses are generated by the controller.
+        This call is blocking until the sweep has ended.
+
+        :param start: First trigger position, in encoder counts.
+        :param stop: Scan end, in encoder counts. The scan moves backwards if
+            it is below ``start``.
+        :param step: Distance between trigger positions, in encoder counts.
+        :param pulse_width: Trigger output pulse width, in µs.
+        :param port: The TRIG port that outputs the pulses, 1 or 2.
+        :param polarity: The active state of the port, 1 for high or 2 for
+            low.
+        :param margin: Run-up and run-out distance in encoder counts, half a
+            step by default.
+        :return: The expected pulse positions, in encoder counts.
+        :rtype: list of int
+        """
+        scan = PositionTriggerScan(start, stop, step, pulse_width, margin)
+        await self.set_absolute_position(scan.move_from)
+        config = scan.trigger_io_config(
+            await self.get_kcubetrigio_config(), port, polarity
+        )
+        await self.set_kcubetrigio_config(*config)
+        await self.set_kcubepostrig_params(*scan.trigger_parameters)
+        await self.set_absolute_position(scan.move_to)
+        return scan.positions.tolist()
+
+    async def fly_scan(self, start: int, stop: int, update_rate: int = 10) -> dict:
+        """Make a continuous scan, recording the position as the stage moves.
+
+        The stage is moved to ``start``, then status update messages are
+        turned on (and left on) and the stage is moved to ``stop``. Every
+        status update received during that move is recorded with its receive
+        time, so that detector samples taken during the move can be assigned
+        a position with
+        :py:func:`thorlabs_cube.driver.scan.interpolate_positions`. This call
+        is blocking until the scan move has ended.
+
+        :param start: Scan start position, in encoder counts. The stage is
+            moved there first.
+        :param stop: Scan end position, in encoder counts.
+        :param update_rate: Rate of the status update messages.
+        :return: A dict of two lists of the same length: ``time`` (UNIX
+            timestamps of the status updates, in seconds) and ``position``
+            (in encoder counts).
+        :rtype: dict
+        """
+        await self.set_absolute_position(start)
+        await self.hardware_start_update_messages(update_rate)
+        self._start_recording()
+        try:
+            await self.set_absolute_position(stop)
+        finally:
+            samples = self._stop_recording()
+        return samples
+
 
 class KscSim(TscSim):
     def set_kcubemmi_params(
@@ -291,3 +363,26 @@ class KscSim(TscSim):
             self.pulse_width,
             self.num_cycles,
         )
+
+    def position_scan(
+        self,
+        start: int,
+        stop: int,
+        step: int,
+        pulse_width: int = 100,
+        port: int = 1,
+        polarity: int = 1,
+        margin: Optional[int] = None,
+    ) -> list[int]:
+        scan = PositionTriggerScan(start, stop, step, pulse_width, margin)
+        self.set_kcubetrigio_config(
+            *scan.trigger_io_config((0, 1, 0, 1), port, polarity)
+        )
+        self.set_kcubepostrig_params(*scan.trigger_parameters)
+        self.set_absolute_position(scan.move_to)
+        return scan.positions.tolist()
+
+    def fly_scan(self, start: int, stop: int, update_rate: int = 10) -> dict:
+        self.set_absolute_position(stop)
+        now = time.time()
+        return {"time": [now, now + 1.0], "position": [start, stop]}
@@ -0,0 +1,106 @@
+"""Trapezoidal velocity profile model of the motor controllers.
+
+A move accelerates at a constant rate up to the maximum velocity, cruises,
+then decelerates at the same rate. Moves too short to reach the maximum
+velocity have a triangular profile. All functions accept scalars or NumPy
+arrays and broadcast their arguments.
+"""
+
+import numpy as np
+
+
+def _result(t):
+    return float(t) if np.ndim(t) == 0 else t
+
+
+def move_time(distance, acceleration, max_velocity):
+    """Duration of a move.
+
+    :param distance: Move distance in encoder counts (sign is ignored).
+    :param acceleration: Acceleration in encoder counts/sec/sec.
+    :param max_velocity: Maximum velocity in encoder counts/sec.
+    :return: The move duration in seconds.
+    :rtype: float or numpy.ndarray
+    """
+    d = np.abs(np.asarray(distance, dtype=float))
+    a = np.asarray(acceleration, dtype=float)
+    v = np.asarray(max_velocity, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # the cruise phase exists once the distance covers a full ramp up and
+        # ramp down
+        t = np.where(d * a >= v * v, d / v + v / a, 2 * np.sqrt(d / a))
+    return _result(np.where(d == 0, 0.0, t))
+
+
+def vector_profile(distances, accelerations, max_velocities):
+    """Scale the profile of several axes so that they arrive together.
+
+    All axes follow the same normalised profile, scaled by their distance, so
+    the move is a straight line in the joint space. The normalised profile is
+    the fastest one that keeps every axis within its own limits.
+
+    :param distances: Move distance of each axis in encoder counts.
+    :param accelerations: Acceleration limit of each axis in encoder
+        counts/sec/sec.
+    :param max_velocities: Velocity limit of each axis in encoder counts/sec.
+    :return: A tuple (accelerations, max_velocities, duration) with the
+        per-axis profile parameters (zero for axes that do not move) and the
+        common move duration in seconds.
+    :rtype: (numpy.ndarray, numpy.ndarray, float)
+    """
+    d, a_lim, v_lim = np.broadcast_arrays(
+        np.abs(np.asarray(distances, dtype=float)),
+        np.asarray(accelerations, dtype=float),
+        np.asarray(max_velocities, dtype=float),
+    )
+    moving = d > 0
+    if not moving.any():
+        return np.zeros_like(d), np.zeros_like(d), 0.0
+    # normalised acceleration and velocity, in path lengths (per second)
+    a = np.min(a_lim[moving] / d[moving])
+    v = np.min(v_lim[moving] / d[moving])
+    return d * a, d * v, float(move_time(1.0, a, v))
+
+
+def distance_travelled(
+    elapsed, distance, velocity, acceleration, max_velocity, brake=True
+):
+    """Distance covered by a move already under way, after some time.
+
+    The motor starts at ``velocity``, accelerates up to the maximum velocity,
+    then decelerates to stop after ``distance``. A motor too fast to stop
+    within ``distance`` brakes straight away.
+
+    :param elapsed: Time since the motor was at ``velocity``, in seconds.
+    :param distance: Remaining distance to the target in encoder counts
+        (sign is ignored), may be infinite.
+    :param velocity: Current speed in encoder counts/sec.
+    :param acceleration: Acceleration in encoder counts/sec/sec.
+    :param max_velocity: Maximum velocity in encoder counts/sec.
+    :param brake: False to keep accelerating and cruising instead of
+        decelerating before the target, which bounds how far the motor can
+        have gone.
+    :return: The distance covered, at most ``distance``, in encoder counts.
+    :rtype: float or numpy.ndarray
+    """
+    t = np.asarray(elapsed, dtype=float)
+    d = np.abs(np.asarray(distance, dtype=float))
+    v0 = np.asarray(velocity, dtype=float)
+    a = np.asarray(acceleration, dtype=float)
+    v_max = np.asarray(max_velocity, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if brake:
+            # peak velocity of a ramp up from v0 then down to 0 over d
+            peak = np.maximum(np.minimum(v_max, np.sqrt(a * d + v0 * v0 / 2)), v0)
+            ramp_down = peak / a
+        else:
+            peak = np.maximum(v_max, v0)
+            ramp_down = np.zeros_like(peak)
+        ramp_up = (peak - v0) / a
+        cruise_distance = d - (v0 + peak) / 2 * ramp_up - peak * ramp_down / 2
+        cruise = np.where(peak > 0, np.maximum(cruise_distance, 0) / peak, 0.0)
+        t1 = np.clip(t, 0, ramp_up)
+        t2 = np.clip(t - ramp_up, 0, cruise)
+        t3 = np.clip(t - ramp_up - cruise, 0, ramp_down)
+        s = v0 * t1 + a * t1 * t1 / 2 + peak * t2 + peak * t3 - a * t3 * t3 / 2
+    return _result(np.minimum(s, d))
@@ -0,0 +1,201 @@
+"""Recording and statistics of the quad detector status updates.
+
+Each QUAD_GET_STATUSUPDATE of a TPA101/KPA101 is appended, with its reception
+time, to a preallocated ring buffer. Statistics are computed over a window of
+the buffer with NumPy, so that pointing stability can be monitored, and the
+KPA101 trigger thresholds calibrated, without transferring the raw readings.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+# A decoded QUAD_GET_STATUSUPDATE, with its time.monotonic() reception time
+READING_DTYPE = np.dtype(
+    [
+        ("time", "<f8"),
+        ("x_diff", "<i2"),
+        ("y_diff", "<i2"),
+        ("sum_val", "<u4"),
+        ("x_pos", "<i2"),
+        ("y_pos", "<i2"),
+        ("status_bits", "<u4"),
+    ]
+)
+
+# Fields of the readings with statistics
+_STAT_FIELDS = ("x_diff", "y_diff", "sum_val", "x_pos", "y_pos")
+
+
+class ReadingBuffer:
+    """Ring buffer of the latest quad detector readings.
+
+    :param size: Number of readings kept, the oldest ones are overwritten.
+    :param dtype: Type of the readings, with a ``time`` field first.
+    """
+
+    def __init__(self, size: int = 10000, dtype: np.dtype = READING_DTYPE) -> None:
+        if size <= 0:
+            raise ValueError("Buffer size must be positive, got {}".format(size))
+        self._data = np.zeros(size, dtype=dtype)
+        self._next = 0
+        self._count = 0
+
+    @property
+    def size(self) -> int:
+        return len(self._data)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, reading: tuple, timestamp: float) -> None:
+        """Add a reading, overwriting the oldest one if the buffer is full.
+
+        :param reading: The (x_diff, y_diff, sum_val, x_pos, y_pos,
+            status_bits) values of a status update.
+        :param timestamp: The reception time of the status update.
+        """
+        self._data[self._next] = (timestamp, *reading)
+        self._next = (self._next + 1) % len(self._data)
+        self._count = min(self._count + 1, len(self._data))
+
+    def extend(self, readings: np.ndarray) -> None:
+        """Add several readings, oldest first.
+
+        :param readings: Array of readings of the buffer type.
+        """
+        readings = readings[max(len(readings) - len(self._data), 0) :]
+        n = len(readings)
+        first = min(n, len(self._data) - self._next)
+        self._data[self._next : self._next + first] = readings[:first]
+        self._data[: n - first] = readings[first:]
+        self._next = (self._next + n) % len(self._data)
+        self._count = min(self._count + n, len(self._data))
+
+    def clear(self) -> None:
+        """Remove all the readings."""
+        self._next = 0
+        self._count = 0
+
+    def latest(
+        self, num_samples: Optional[int] = None, duration: Optional[float] = None
+    ) -> np.ndarray:
+        """Get the latest readings, oldest first.
+
+        :param num_samples: Maximum number of readings, all by default.
+        :param duration: Only get the readings received within this many
+            seconds of the last one.
+        :return: A copy of the readings, see :py:data:`READING_DTYPE`.
+        :rtype: numpy.ndarray
+        """
+        n = self._count if num_samples is None else min(num_samples, self._count)
+        start = self._next - n
+        if start >= 0:
+            readings = self._data[start : self._next].copy()
+        else:
+            readings = np.concatenate((self._data[start:], self._data[: self._next]))
+        if duration is not None and len(readings):
+            first = np.searchsorted(readings["time"], readings["time"][-1] - duration)
+            readings = readings[first:]
+        return readings
+
+
+def _summary(values: np.ndarray) -> dict:
+    mean = values.mean()
+    return {
+        "mean": float(mean),
+        "rms": float(np.sqrt(np.mean((values - mean) ** 2))),
+        "ptp": float(np.ptp(values)),
+    }
+
+
+def beam_statistics(readings: np.ndarray) -> dict:
+    """Compute the statistics of a window of readings.
+
+    The normalised centroid of the beam, ``x_diff / sum_val`` and
+    ``y_diff / sum_val``, is computed over the readings with a non zero sum.
+
+    :param readings: Readings as returned by :py:meth:`ReadingBuffer.latest`.
+    :return: A dict with the number of ``samples``, their time span as
+        ``duration`` in seconds, and for each of ``x_diff``, ``y_diff``,
+        ``sum_val``, ``x_pos``, ``y_pos``, ``x_centroid`` and
+        ``y_centroid``, a dict with its ``mean``, ``rms`` deviation from the
+        mean and peak-to-peak (``ptp``) range. The centroid statistics are
+        None if no reading has a non zero sum.
+    :rtype: dict
+    """
+    if len(readings) == 0:
+        raise ValueError("No quad detector readings in the window")
+    stats = {
+        "samples": len(readings),
+        "duration": float(readings["time"][-1] - readings["time"][0]),
+    }
+    for field in _STAT_FIELDS:
+        stats[field] = _summary(readings[field].astype(float))
+    lit = readings[readings["sum_val"] > 0]
+    for axis in "xy":
+        stats[axis + "_centroid"] = (
+            _summary(lit[axis + "_diff"] / lit["sum_val"]) if len(lit) else None
+        )
+    return stats
+
+
+def _histogram(values: np.ndarray, bins: int) -> dict:
+    counts, edges = np.histogram(values, bins)
+    return {"counts": counts.tolist(), "edges": edges.tolist()}
+
+
+def trigger_thresholds(readings: np.ndarray, false_rate: float, bins: int = 64) -> dict:
+    """Propose KPA101 trigger thresholds from readings of an aligned beam.
+
+    The readings are taken as the nominal state, in which the triggers should
+    not fire. The sum window and the difference threshold are set at the
+    quantiles of the readings that leave ``false_rate`` of them outside,
+    half of it for the sum window (a quarter on each side) and half for the
+    difference threshold, so that a trigger on both stays within the rate.
+    The difference of a reading is the larger of ``|x_diff|`` and
+    ``|y_diff|``. A small rate is only resolved by at least ``1 / false_rate``
+    readings, below which the thresholds are the extreme readings.
+
+    :param readings: Readings as returned by :py:meth:`ReadingBuffer.latest`.
+    :param false_rate: Fraction of nominal readings that may trigger, in
+        range (0; 1).
+    :param bins: Number of bins of the histograms.
+    :return: A dict with the proposed ``sum_min``, ``sum_max`` and
+        ``diff_threshold``, the fraction of the readings outside them as
+        ``false_fraction``, the number of ``samples``, the status
+        ``update_rate`` in Hz (None if unknown), and the ``sum_histogram``
+        and ``diff_histogram`` of the readings as dicts of ``counts`` and
+        bin ``edges``.
+    :rtype: dict
+    """
+    if len(readings) == 0:
+        raise ValueError("No quad detector readings in the window")
+    if not 0 < false_rate < 1:
+        raise ValueError(
+            "False trigger rate must be in range (0;1), got {}".format(false_rate)
+        )
+    sums = readings["sum_val"].astype(float)
+    diffs = np.maximum(
+        np.abs(readings["x_diff"].astype(float)),
+        np.abs(readings["y_diff"].astype(float)),
+    )
+    low, high = np.quantile(sums, [false_rate / 4, 1 - false_rate / 4])
+    # the trigger settings are 16 bit unsigned values
+    sum_min = int(np.clip(np.floor(low), 0, 0xFFFF))
+    sum_max = int(np.clip(np.ceil(high), 0, 0xFFFF))
+    diff_threshold = int(
+        np.clip(np.ceil(np.quantile(diffs, 1 - false_rate / 2)), 0, 0xFFFF)
+    )
+    outside = (sums < sum_min) | (sums > sum_max) | (diffs > diff_threshold)
+    span = readings["time"][-1] - readings["time"][0]
+    return {
+        "sum_min": sum_min,
+        "sum_max": sum_max,
+        "diff_threshold": diff_threshold,
+        "false_fraction": float(np.mean(outside)),
+        "samples": len(readings),
+        "update_rate": float((len(readings) - 1) / span) if span > 0 else None,
+        "sum_histogram": _histogram(sums, bins),
+        "diff_histogram": _histogram(diffs, bins),
+    }
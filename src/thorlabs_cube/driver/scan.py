@@ -0,0 +1,113 @@
+"""Scans with the stage in continuous motion.
+
+The KDC101 and KSC101 can pulse one of their TRIG ports each time the stage
+crosses a position of an arithmetic sequence. A scan is compiled once into
+the trigger port configuration, the position trigger parameters and the two
+moves that sweep the stage across the sequence, so that the acquisition is
+clocked by the controller rather than by host-side polling.
+
+Fly scans instead record the timestamped positions of the status updates
+during the move, and detector samples are placed by interpolation.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+# TRIG port operating modes, cf. Kdc.set_trigger_io_config()
+TRIGGER_MODE_POSITION_FWD = 0x0D
+TRIGGER_MODE_POSITION_REV = 0x0E
+
+
+class PositionTriggerScan:
+    """A position trigger scan from ``start`` to ``stop``.
+
+    The stage is first moved ``margin`` counts before ``start`` so that the
+    first trigger position is crossed while moving, then swept to ``margin``
+    counts past the last trigger position.
+
+    :param start: First trigger position, in encoder counts.
+    :param stop: Scan end, in encoder counts. It is the last trigger position
+        if ``stop - start`` is a multiple of ``step``.
+    :param step: Distance between trigger positions, in encoder counts.
+    :param pulse_width: Trigger output pulse width, in µs.
+    :param margin: Run-up and run-out distance in encoder counts, half a step
+        by default.
+    """
+
+    def __init__(
+        self,
+        start: int,
+        stop: int,
+        step: int,
+        pulse_width: int = 100,
+        margin: Optional[int] = None,
+    ) -> None:
+        if step <= 0:
+            raise ValueError("Scan step must be positive, got {}".format(step))
+        if start == stop:
+            raise ValueError("Scan start and stop must differ")
+        if margin is None:
+            margin = max(step // 2, 1)
+        self.direction = 1 if stop > start else -1
+        num_pulses = abs(stop - start) // step + 1
+        self.positions = start + self.direction * step * np.arange(
+            num_pulses, dtype=np.int64
+        )
+        self.move_from = start - self.direction * margin
+        self.move_to = int(self.positions[-1]) + self.direction * margin
+        if self.direction > 0:
+            self.trigger_mode = TRIGGER_MODE_POSITION_FWD
+            self.trigger_parameters = (start, step, num_pulses, 0, 0, 0)
+        else:
+            self.trigger_mode = TRIGGER_MODE_POSITION_REV
+            self.trigger_parameters = (0, 0, 0, start, step, num_pulses)
+        # pulse width and a single forward/reverse cycle
+        self.trigger_parameters += (pulse_width, 1)
+
+    def trigger_io_config(
+        self, current: tuple[int, int, int, int], port: int, polarity: int
+    ) -> tuple[int, int, int, int]:
+        """Get the TRIG ports configuration for the scan.
+
+        :param current: The current (mode1, polarity1, mode2, polarity2)
+            configuration, kept for the port not used by the scan.
+        :param port: The TRIG port that outputs the pulses, 1 or 2.
+        :param polarity: The active state of the port, 1 for high or 2 for
+            low.
+        :return: The new (mode1, polarity1, mode2, polarity2) configuration.
+        :rtype: A 4 int tuple
+        """
+        if port not in (1, 2):
+            raise ValueError("Trigger port must be 1 or 2, got {}".format(port))
+        config = list(current)
+        config[2 * (port - 1)] = self.trigger_mode
+        config[2 * (port - 1) + 1] = polarity
+        return tuple(config)
+
+
+def interpolate_positions(timestamps, sample_times, sample_positions):
+    """Map timestamps to stage positions from the samples of a fly scan.
+
+    Positions are linearly interpolated between the two surrounding
+    samples. Timestamps outside of the recorded samples give NaN.
+
+    :param timestamps: Times to get the position at, as UNIX timestamps in
+        seconds (scalar or array).
+    :param sample_times: Increasing sample times, e.g. the ``time`` list of a
+        fly scan result.
+    :param sample_positions: Positions at ``sample_times`` in encoder counts,
+        e.g. the ``position`` list of a fly scan result.
+    :return: The interpolated positions, in encoder counts.
+    :rtype: float or numpy.ndarray
+    """
+    if len(sample_times) == 0:
+        raise ValueError("No position samples to interpolate from")
+    positions = np.interp(
+        timestamps,
+        np.asarray(sample_times, dtype=float),
+        np.asarray(sample_positions, dtype=float),
+        left=np.nan,
+        right=np.nan,
+    )
+    return float(positions) if np.ndim(positions) == 0 else positions
@@ -0,0 +1,239 @@
+"""Online pointing stability analysis of the quad detector status updates.
+
+The normalised beam centroid ``x_diff / sum_val`` and ``y_diff / sum_val``
+of each status update feeds an overlapping Allan deviation, at octave spaced
+averaging times, and a Welch power spectral density. Both are updated by
+blocks of samples with NumPy, at a constant cost per sample whatever the
+length of the record, and can be read at any time.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+
+class AllanDeviation:
+    """Overlapping Allan deviation at averaging factors 1, 2, 4, ...
+
+    The variance at averaging factor ``m`` is half the mean square
+    difference between the averages of two adjacent windows of ``m``
+    samples, over every window position. It is computed from the cumulative
+    sum of the samples, of which only the last ``4 * 2**(num_octaves - 1)``
+    values are kept.
+
+    :param num_octaves: Number of averaging factors.
+    :param channels: Number of signals analysed together.
+    """
+
+    def __init__(self, num_octaves: int = 16, channels: int = 1) -> None:
+        if num_octaves <= 0:
+            raise ValueError(
+                "Number of octaves must be positive, got {}".format(num_octaves)
+            )
+        self.factors = 2 ** np.arange(num_octaves)
+        self.channels = channels
+        # cumulative sums, indexed by sample count modulo the ring size
+        self._ring = np.zeros((4 * int(self.factors[-1]), channels))
+        self._count = 0
+        self._offset: Optional[np.ndarray] = None
+        self._sums = np.zeros((num_octaves, channels))
+        self._terms = np.zeros(num_octaves, dtype=np.int64)
+
+    def update(self, samples) -> None:
+        """Add samples.
+
+        :param samples: Array of shape (number of samples, channels).
+        """
+        y = np.asarray(samples, dtype=float).reshape(-1, self.channels)
+        if not len(y):
+            return
+        if self._offset is None:
+            # sums of the differences to the first sample keep their precision
+            self._offset = y[0].copy()
+        size = len(self._ring)
+        # a chunk must not overwrite the values it is compared to
+        chunk = size - 2 * int(self.factors[-1])
+        for start in range(0, len(y), chunk):
+            block = y[start : start + chunk] - self._offset
+            first = self._count + 1
+            index = np.arange(first, first + len(block))
+            total = self._ring[self._count % size]
+            self._ring[index % size] = total + np.cumsum(block, axis=0)
+            self._count += len(block)
+            for k, m in enumerate(self.factors):
+                valid = index[index >= 2 * m]
+                if not len(valid):
+                    continue
+                diff = (
+                    self._ring[valid % size]
+                    - 2 * self._ring[(valid - m) % size]
+                    + self._ring[(valid - 2 * m) % size]
+                ) / m
+                self._sums[k] += np.sum(diff * diff, axis=0)
+                self._terms[k] += len(valid)
+
+    def result(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get the Allan deviation at the averaging factors with data.
+
+        :return: The averaging factors, the Allan deviation of each channel
+            at each factor (one row per factor) and the number of terms
+            averaged for each factor.
+        :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        """
+        known = self._terms > 0
+        deviation = np.sqrt(self._sums[known] / (2 * self._terms[known, np.newaxis]))
+        return self.factors[known], deviation, self._terms[known]
+
+
+class WelchPSD:
+    """Welch power spectral density with Hann windowed, half overlapping
+    segments.
+
+    The mean of each segment is removed before its periodogram is
+    accumulated.
+
+    :param segment_length: Number of samples per segment, even.
+    :param channels: Number of signals analysed together.
+    """
+
+    def __init__(self, segment_length: int = 256, channels: int = 1) -> None:
+        if segment_length < 2 or segment_length % 2:
+            raise ValueError(
+                "Segment length must be even and at least 2, got {}".format(
+                    segment_length
+                )
+            )
+        self.segment_length = segment_length
+        self.channels = channels
+        self._window = np.hanning(segment_length + 1)[:-1]
+        # samples not yet part of a complete segment, or of the next one
+        self._tail = np.empty((0, channels))
+        self._sum = np.zeros((segment_length // 2 + 1, channels))
+        self.segments = 0
+
+    def update(self, samples) -> None:
+        """Add samples.
+
+        :param samples: Array of shape (number of samples, channels).
+        """
+        y = np.asarray(samples, dtype=float).reshape(-1, self.channels)
+        data = np.concatenate((self._tail, y))
+        hop = self.segment_length // 2
+        count = (len(data) - self.segment_length) // hop + 1
+        if count <= 0:
+            self._tail = data
+            return
+        windows = np.lib.stride_tricks.sliding_window_view(
+            data, self.segment_length, axis=0
+        )[: count * hop : hop]
+        # windows has shape (segment, channel, sample)
+        windows = windows - windows.mean(axis=2, keepdims=True)
+        spectra = np.fft.rfft(windows * self._window, axis=2)
+        self._sum += np.sum(np.abs(spectra) ** 2, axis=0).T
+        self.segments += count
+        self._tail = data[count * hop :]
+
+    def result(self, sample_rate: float) -> tuple[np.ndarray, np.ndarray]:
+        """Get the one-sided power spectral density.
+
+        :param sample_rate: The sample rate of the signals, in Hz.
+        :return: The frequencies in Hz, and the density of each channel at
+            each frequency (one row per frequency), in signal units squared
+            per Hz.
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        freqs = np.fft.rfftfreq(self.segment_length, 1 / sample_rate)
+        if not self.segments:
+            return freqs, np.zeros_like(self._sum)
+        scale = 1 / (sample_rate * np.sum(self._window**2) * self.segments)
+        psd = self._sum * scale
+        # fold the negative frequencies, except for DC and Nyquist
+        psd[1:-1] *= 2
+        return freqs, psd
+
+
+class StabilityAnalysis:
+    """Allan deviation and PSD of the beam centroid, fed by status updates.
+
+    Samples are processed by blocks, when a block is full or when the
+    results are read. Status updates with a zero sum signal are ignored.
+
+    :param num_octaves: Number of Allan deviation averaging factors.
+    :param segment_length: Number of samples per PSD segment.
+    :param block_size: Number of samples processed at once.
+    """
+
+    def __init__(
+        self, num_octaves: int = 16, segment_length: int = 256, block_size: int = 256
+    ) -> None:
+        self.adev = AllanDeviation(num_octaves, channels=2)
+        self.psd = WelchPSD(segment_length, channels=2)
+        self._block = np.empty((block_size, 2))
+        self._pending = 0
+        self.samples = 0
+        self._first_time: Optional[float] = None
+        self._last_time: Optional[float] = None
+
+    def append(self, reading: tuple, timestamp: float) -> None:
+        """Add a status update, e.g. as a Tpa status listener.
+
+        :param reading: The (x_diff, y_diff, sum_val, x_pos, y_pos,
+            status_bits) values of a status update.
+        :param timestamp: The reception time of the status update.
+        """
+        x_diff, y_diff, sum_val = reading[:3]
+        if sum_val <= 0:
+            return
+        self._block[self._pending] = (x_diff / sum_val, y_diff / sum_val)
+        self._pending += 1
+        self.samples += 1
+        if self._first_time is None:
+            self._first_time = timestamp
+        self._last_time = timestamp
+        if self._pending == len(self._block):
+            self.flush()
+
+    def flush(self) -> None:
+        """Process the samples added since the last block."""
+        block = self._block[: self._pending]
+        self.adev.update(block)
+        self.psd.update(block)
+        self._pending = 0
+
+    def sample_rate(self) -> Optional[float]:
+        """Get the mean rate of the samples, in Hz, None before two samples
+        with different times."""
+        if self.samples < 2 or self._last_time == self._first_time:
+            return None
+        return (self.samples - 1) / (self._last_time - self._first_time)
+
+    def report(self) -> dict:
+        """Get the current results.
+
+        :return: A dict with the number of ``samples``, the mean
+            ``sample_rate`` in Hz, an ``allan`` dict with the averaging times
+            ``tau`` in seconds, the deviations ``x`` and ``y`` of the
+            normalised centroid and the number of ``terms`` averaged, and a
+            ``psd`` dict with the ``frequency`` in Hz, the densities ``x``
+            and ``y`` in 1/Hz and the number of ``segments``. Times and
+            frequencies are empty until the sample rate is known.
+        :rtype: dict
+        """
+        self.flush()
+        rate = self.sample_rate()
+        allan = {"tau": [], "x": [], "y": [], "terms": []}
+        psd = {"frequency": [], "x": [], "y": [], "segments": self.psd.segments}
+        if rate is not None:
+            factors, deviation, terms = self.adev.result()
+            allan["tau"] = (factors / rate).tolist()
+            allan["x"], allan["y"] = deviation.T.tolist()
+            allan["terms"] = terms.tolist()
+            freqs, density = self.psd.result(rate)
+            psd["frequency"] = freqs.tolist()
+            psd["x"], psd["y"] = density.T.tolist()
+        return {
+            "samples": self.samples,
+            "sample_rate": rate,
+            "allan": allan,
+            "psd": psd,
+        }
@@ -0,0 +1,124 @@
+"""Latest-wins streaming of setpoints to a device.
+
+Applications such as joysticks and tracking loops produce setpoints faster
+than it is useful, or possible, to send them over the serial link. A
+:py:class:`SetpointStream` keeps only the latest setpoint and applies it at
+most at a given rate, so that a burst of updates costs a single write and
+the device always converges to the last requested value.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SetpointStream:
+    """Apply the latest of a stream of setpoints at a bounded rate.
+
+    :param apply: Coroutine function called with each setpoint to send it.
+    :param max_rate: Maximum number of setpoints applied per second.
+    :param timeout: If no setpoint is received for this many seconds,
+        ``on_timeout`` is awaited once, until the next setpoint. None
+        disables the timeout.
+    :param on_timeout: Coroutine function called on timeout, e.g. to stop a
+        motor when its client went away.
+    :param on_error: Coroutine function called once when ``apply`` raised,
+        before the stream ends, e.g. to stop a motor that was left running.
+    """
+
+    def __init__(
+        self,
+        apply: Callable[[object], Awaitable[None]],
+        max_rate: float,
+        timeout: Optional[float] = None,
+        on_timeout: Optional[Callable[[], Awaitable[None]]] = None,
+        on_error: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> None:
+        if max_rate <= 0:
+            raise ValueError("Maximum rate must be positive, got {}".format(max_rate))
+        self.apply = apply
+        self.period = 1.0 / max_rate
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+        self.on_error = on_error
+        self._pending = None
+        self._has_pending = False
+        self._event = asyncio.Event()
+        self._error: Optional[BaseException] = None
+        self._closing = False
+        self._flush = True
+        self.received = 0
+        self.applied = 0
+        self._task = asyncio.ensure_future(self._run())
+
+    def update(self, setpoint) -> None:
+        """Queue a setpoint, replacing any setpoint not yet applied.
+
+        Raises the error of a previous apply call, if any, after which the
+        stream is closed.
+        """
+        if self._error is not None:
+            raise self._error
+        if self._closing:
+            raise ValueError("Setpoint stream is closed")
+        self._pending = setpoint
+        self._has_pending = True
+        self.received += 1
+        self._event.set()
+
+    async def _wait_setpoint(self) -> bool:
+        try:
+            await asyncio.wait_for(self._event.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _run(self) -> None:
+        timed_out = False
+        last = None
+        try:
+            while True:
+                if not await self._wait_setpoint():
+                    if not timed_out and self.on_timeout is not None:
+                        logger.warning("setpoint stream timed out")
+                        await self.on_timeout()
+                    timed_out = True
+                    continue
+                timed_out = False
+                if self._closing:
+                    break
+                if last is not None:
+                    await asyncio.sleep(last + self.period - time.monotonic())
+                self._event.clear()
+                if self._closing:
+                    break
+                setpoint, self._has_pending = self._pending, False
+                last = time.monotonic()
+                await self.apply(setpoint)
+                self.applied += 1
+            if self._flush and self._has_pending:
+                self._has_pending = False
+                await self.apply(self._pending)
+                self.applied += 1
+        except Exception as e:
+            self._error = e
+            logger.error("setpoint stream failed", exc_info=True)
+            if self.on_error is not None:
+                try:
+                    await self.on_error()
+                except Exception:
+                    logger.error("setpoint stream error handler failed", exc_info=True)
+
+    async def close(self, flush: bool = True) -> None:
+        """Stop the stream.
+
+        :param flush: Apply the setpoint still pending, if any, before
+            returning.
+        """
+        self._closing = True
+        self._flush = flush
+        self._event.set()
+        await asyncio.shield(self._task)
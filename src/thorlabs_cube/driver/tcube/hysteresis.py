@@ -0,0 +1,168 @@
+"""Open loop hysteresis compensation of the piezo controllers.
+
+In open loop, the position of a piezo actuator depends on the history of the
+applied voltage. The position to voltage relation is modelled by a
+Prandtl-Ishlinskii operator, i.e. a weighted sum of play (backlash)
+operators of increasing widths. The model is fitted directly from a
+recorded sweep, as the voltage to apply given the positions the actuator
+went through, so that compensating a waveform is a single evaluation of
+the model over the desired positions.
+"""
+
+import hashlib
+from typing import Optional
+
+import numpy as np
+
+
+def play_operators(values, thresholds, initial=None) -> np.ndarray:
+    """Output of play operators driven by a sequence of values.
+
+    Each operator output follows its input with a backlash of twice its
+    threshold: it only changes when the input gets further than the
+    threshold away from it.
+
+    :param values: Input sequence.
+    :param thresholds: Half-width of each operator's backlash, non negative.
+    :param initial: Initial state of each operator, the first input value
+        by default.
+    :return: The operator outputs, one column per operator.
+    :rtype: numpy.ndarray
+    """
+    x = np.asarray(values, dtype=float)
+    r = np.asarray(thresholds, dtype=float)
+    out = np.empty((len(x), len(r)))
+    state = np.empty(len(r))
+    state[:] = x[0] if initial is None else initial
+    # each output depends on the previous one, only the operators are
+    # processed at once
+    for k, value in enumerate(x):
+        state = np.clip(state, value - r, value + r)
+        out[k] = state
+    return out
+
+
+class HysteresisModel:
+    """Voltage to apply to reach given positions, hysteresis included.
+
+    :param thresholds: Play operator thresholds, in position units.
+    :param weights: Weight of each play operator, in volts per position unit.
+    :param offset: Voltage offset, in volts.
+    """
+
+    def __init__(self, thresholds, weights, offset: float) -> None:
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        self.weights = np.asarray(weights, dtype=float)
+        if self.thresholds.shape != self.weights.shape:
+            raise ValueError("Expected one weight per threshold")
+        self.offset = float(offset)
+        digest = hashlib.sha1(self.thresholds.tobytes())
+        digest.update(self.weights.tobytes())
+        digest.update(np.float64(self.offset).tobytes())
+        self.version = digest.hexdigest()
+
+    @classmethod
+    def fit(cls, voltages, positions, num_operators: int = 8) -> "HysteresisModel":
+        """Fit the model to a recorded sweep.
+
+        The sweep should go back and forth over the whole range the model
+        is used in, as the hysteresis is only known within the sweep.
+
+        :param voltages: The voltages applied during the sweep, in volts.
+        :param positions: The positions measured at each voltage.
+        :param num_operators: Number of play operators, with thresholds
+            evenly spread from 0 to half the position range.
+        :return: The fitted model.
+        :rtype: HysteresisModel
+        """
+        v = np.asarray(voltages, dtype=float)
+        x = np.asarray(positions, dtype=float)
+        if v.ndim != 1 or v.shape != x.shape or len(v) < num_operators + 1:
+            raise ValueError(
+                "Expected matching voltage and position sweeps of at least {} "
+                "samples".format(num_operators + 1)
+            )
+        span = np.ptp(x)
+        if span == 0:
+            raise ValueError("Position sweep is constant")
+        thresholds = np.arange(num_operators) * span / (2 * num_operators)
+        features = play_operators(x, thresholds)
+        design = np.column_stack([features, np.ones(len(x))])
+        solution, _, _, _ = np.linalg.lstsq(design, v, rcond=None)
+        return cls(thresholds, solution[:-1], solution[-1])
+
+    def compensate(self, positions, periodic: bool = True) -> np.ndarray:
+        """Get the voltages that drive the actuator through positions.
+
+        :param positions: The desired positions.
+        :param periodic: True if the waveform is output in a loop, in which
+            case the result is the steady state one of the second and later
+            cycles. Otherwise the operators start from the first position.
+        :return: The voltages to output, not clipped to the voltage range.
+        :rtype: numpy.ndarray
+        """
+        x = np.asarray(positions, dtype=float)
+        initial = None
+        if periodic:
+            # run one cycle to reach the steady state of the loop
+            initial = play_operators(x, self.thresholds)[-1]
+        return play_operators(x, self.thresholds, initial) @ self.weights + self.offset
+
+    def residual(self, voltages, positions) -> float:
+        """RMS error of the model over a recorded sweep, in volts.
+
+        :param voltages: The voltages applied during the sweep.
+        :param positions: The positions measured at each voltage.
+        :rtype: float
+        """
+        predicted = self.compensate(positions, periodic=False)
+        return float(np.sqrt(np.mean((predicted - np.asarray(voltages)) ** 2)))
+
+    def to_dict(self) -> dict:
+        """Get the model parameters as plain lists, e.g. to store them.
+
+        :rtype: dict
+        """
+        return {
+            "thresholds": self.thresholds.tolist(),
+            "weights": self.weights.tolist(),
+            "offset": self.offset,
+            "version": self.version,
+        }
+
+    @classmethod
+    def from_dict(cls, params: dict) -> "HysteresisModel":
+        """Create a model from the output of :py:meth:`to_dict`.
+
+        :rtype: HysteresisModel
+        """
+        return cls(params["thresholds"], params["weights"], params["offset"])
+
+
+class CompensationCache:
+    """Compensated waveforms, by waveform and model version.
+
+    :param size: Maximum number of waveforms kept, the least recently used
+        ones are dropped first.
+    """
+
+    def __init__(self, size: int = 16) -> None:
+        self.size = size
+        self._entries: dict[tuple[str, str], np.ndarray] = {}
+
+    def get(self, model: HysteresisModel, positions) -> tuple[np.ndarray, bool]:
+        """Compensate a periodic waveform, reusing a previous result.
+
+        :return: The voltages, and whether they came from the cache.
+        """
+        positions = np.ascontiguousarray(positions, dtype=float)
+        key = (model.version, hashlib.sha1(positions.tobytes()).hexdigest())
+        voltages: Optional[np.ndarray] = self._entries.pop(key, None)
+        cached = voltages is not None
+        if voltages is None:
+            voltages = model.compensate(positions)
+        # dicts keep insertion order, the first entry is the oldest
+        self._entries[key] = voltages
+        while len(self._entries) > self.size:
+            del self._entries[next(iter(self._entries))]
+        return voltages, cached
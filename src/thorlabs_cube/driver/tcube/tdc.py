@@ -1,7 +1,46 @@
+import asyncio
+import itertools
 import struct as st
+import time
+from typing import Optional
+
+import numpy as np
 
 from thorlabs_cube.driver.base import _Cube
 from thorlabs_cube.driver.message import MGMSG, Message, MsgError
+from thorlabs_cube.driver.profile import distance_travelled, move_time
+from thorlabs_cube.driver.stream import SetpointStream
+
+# How a move ended, as reported by wait_move() and move_status()
+_MOVE_END = {
+    MGMSG.MOT_MOVE_COMPLETED: "completed",
+    MGMSG.MOT_MOVE_STOPPED: "stopped",
+    MGMSG.MOT_MOVE_HOMED: "homed",
+}
+_MOVE_END_MSGS = [MGMSG.MOT_MOVE_COMPLETED, MGMSG.MOT_MOVE_STOPPED]
+_HOME_END_MSGS = [MGMSG.MOT_MOVE_HOMED, MGMSG.MOT_MOVE_STOPPED]
+
+# Finished moves that were never waited for are forgotten past this count
+_MOVE_HISTORY = 32
+
+# Status bits set while the motor is moving, jogging or homing
+_MOVING_BITS = 0x2F0
+
+# Default move timeout, relative to the estimated move duration
+_MOVE_TIMEOUT_FACTOR = 2.0
+_MOVE_TIMEOUT_MARGIN = 2.0
+
+# Age in seconds below which the motion state of the last status update is
+# trusted without asking the device
+_STATUS_MAX_AGE = 0.5
+
+
+def _move_state(future):
+    if not future.done():
+        return "moving"
+    if future.cancelled() or future.exception() is not None:
+        return "failed"
+    return _MOVE_END[future.result().id]
 
 
 class Tdc(_Cube):
@@ -10,6 +49,29 @@ class Tdc(_Cube):
     def __init__(self, serial_dev: str):
         super().__init__(serial_dev)
         self.status_report_counter = 0
+        self._move_handles = itertools.count(1)
+        self._moves: dict[int, asyncio.Future] = {}
+        self._move_timeouts: dict[int, Optional[float]] = {}
+        self.position: Optional[int] = None
+        # Motion state from the status updates, None until the first one
+        self.status: Optional[int] = None
+        self.moving: Optional[bool] = None
+        self._stop_waiters: list[asyncio.Future] = []
+        # (receive time, position, velocity) of the last two status updates
+        self._status_samples: list[tuple[float, int, int]] = []
+        # target of the current move, when known
+        self.move_target: Optional[int] = None
+        # Last known parameters, to skip redundant writes and to estimate
+        # move durations
+        self.velocity_parameters: Optional[tuple[int, int]] = None
+        self.jog_parameters: Optional[tuple[int, int, int, int, int]] = None
+        self.home_velocity: Optional[int] = None
+        self.move_absolute_position: Optional[int] = None
+        self.move_relative_distance: Optional[int] = None
+        self._velocity_stream: Optional[SetpointStream] = None
+        # signed velocity last sent by the velocity stream, 0 when stopped
+        self._stream_velocity = 0
+        self._stream_stop_mode = 2
 
     async def handle_message(self, msg):
         msg_id = msg.id
@@ -31,20 +93,69 @@ class Tdc(_Cube):
             or msg_id == MGMSG.MOT_MOVE_STOPPED
             or msg_id == MGMSG.MOT_GET_DCSTATUSUPDATE
         ):
-            if self.status_report_counter == 25:
-                self.status_report_counter = 0
-                await self.send(Message(MGMSG.MOT_ACK_DCSTATUSUPDATE))
-            else:
-                self.status_report_counter += 1
-            # 'r' is a currently unused and reserved field
-            self.position, self.velocity, r, self.status = st.unpack(
-                "<LHHL",
-                data[2:],
-            )
+            await self._handle_status(data)
+        elif msg_id == MGMSG.MOT_MOVE_HOMED:
+            self._set_moving(False)
+
+    async def _handle_status(self, data):
+        """Update the motor state from the data of a DC status update."""
+        if self.status_report_counter == 25:
+            self.status_report_counter = 0
+            await self.send(Message(MGMSG.MOT_ACK_DCSTATUSUPDATE))
+        else:
+            self.status_report_counter += 1
+        # 'r' is a currently unused and reserved field
+        self.position, self.velocity, r, status = st.unpack(
+            "<lHHL",
+            data[2:],
+        )
+        self._status_samples = self._status_samples[-1:] + [
+            (time.monotonic(), self.position, self.velocity)
+        ]
+        self._update_status_bits(status)
+        self._record_position(self.position)
+
+    def _update_status_bits(self, status):
+        self.status = status
+        self._set_moving((status & _MOVING_BITS) != 0)
+
+    def _set_moving(self, moving):
+        self.moving = moving
+        if not moving:
+            self.move_target = None
+            for future in self._stop_waiters:
+                if not future.done():
+                    future.set_result(None)
+            self._stop_waiters = []
 
     async def is_moving(self):
         status_bits = await self.get_status_bits()
-        return (status_bits & 0x2F0) != 0
+        return (status_bits & _MOVING_BITS) != 0
+
+    async def wait_until_stopped(self, timeout: Optional[float] = None) -> int:
+        """Wait until the motor is not moving, jogging or homing.
+
+        The motion state is kept from the status updates, the end of move
+        messages and :py:meth:`get_status_bits()<Tdc.get_status_bits>`
+        replies, so this does not poll the device. The status bits are only
+        requested once if no status has been received yet. Use
+        :py:meth:`hardware_start_update_messages()
+        <thorlabs_cube.driver.base._Cube.hardware_start_update_messages>` to
+        follow moves started from the front panel.
+
+        :param timeout: Maximum time to wait in seconds, or None.
+        :return: The last status bits received.
+        :rtype: int
+        """
+        if self.moving is None:
+            await self.is_moving()
+        if self.moving:
+            # registered as a reply waiter so that a reader failure is
+            # propagated here too
+            future = self._expect([])
+            self._stop_waiters.append(future)
+            await asyncio.wait_for(future, timeout)
+        return self.status
 
     async def set_pot_parameters(
         self, zero_wnd, vel1, wnd1, vel2, wnd2, vel3, wnd3, vel4
@@ -111,7 +222,8 @@ class Tdc(_Cube):
         get_msg = await self.send_request(
             MGMSG.MOT_REQ_POSCOUNTER, [MGMSG.MOT_GET_POSCOUNTER], 1
         )
-        return st.unpack("<l", get_msg.data[2:])[0]
+        self.position = st.unpack("<l", get_msg.data[2:])[0]
+        return self.position
 
     async def set_encoder_counter(self, encoder_count):
         """Set encoder count in the controller.
@@ -144,6 +256,7 @@ class Tdc(_Cube):
         """
         payload = st.pack("<HLLL", 1, 0, acceleration, max_velocity)
         await self.send(Message(MGMSG.MOT_SET_VELPARAMS, data=payload))
+        self.velocity_parameters = (acceleration, max_velocity)
 
     async def get_velocity_parameters(self):
         """Get the trapezoidal velocity parameters.
@@ -154,7 +267,8 @@ class Tdc(_Cube):
         get_msg = await self.send_request(
             MGMSG.MOT_REQ_VELPARAMS, [MGMSG.MOT_GET_VELPARAMS], 1
         )
-        return st.unpack("<LL", get_msg.data[6:])
+        self.velocity_parameters = st.unpack("<LL", get_msg.data[6:])
+        return self.velocity_parameters
 
     async def set_jog_parameters(
         self, mode, step_size, acceleration, max_velocity, stop_mode
@@ -180,6 +294,7 @@ class Tdc(_Cube):
             stop_mode,
         )
         await self.send(Message(MGMSG.MOT_SET_JOGPARAMS, data=payload))
+        self.jog_parameters = (mode, step_size, acceleration, max_velocity, stop_mode)
 
     async def get_jog_parameters(self):
         """Get the velocity jog parameters.
@@ -191,10 +306,17 @@ class Tdc(_Cube):
         get_msg = await self.send_request(
             MGMSG.MOT_REQ_JOGPARAMS, [MGMSG.MOT_GET_JOGPARAMS], 1
         )
-        (jog_mode, step_size, _, acceleration, max_velocity, stop_mode) = st.unpack(
+        jog_mode, step_size, _, acceleration, max_velocity, stop_mode = st.unpack(
             "<HLLLLH", get_msg.data[2:]
         )
-        return jog_mode, step_size, acceleration, max_velocity, stop_mode
+        self.jog_parameters = (
+            jog_mode,
+            step_size,
+            acceleration,
+            max_velocity,
+            stop_mode,
+        )
+        return self.jog_parameters
 
     async def set_gen_move_parameters(self, backlash_distance):
         """Set the backlash distance.
@@ -225,6 +347,7 @@ class Tdc(_Cube):
         """
         payload = st.pack("<Hl", 1, relative_distance)
         await self.send(Message(MGMSG.MOT_SET_MOVERELPARAMS, data=payload))
+        self.move_relative_distance = relative_distance
 
     async def get_move_relative_parameters(self):
         """Get the relative distance move parameter.
@@ -235,7 +358,8 @@ class Tdc(_Cube):
         get_msg = await self.send_request(
             MGMSG.MOT_REQ_MOVERELPARAMS, [MGMSG.MOT_GET_MOVERELPARAMS], 1
         )
-        return st.unpack("<l", get_msg.data[2:])[0]
+        self.move_relative_distance = st.unpack("<l", get_msg.data[2:])[0]
+        return self.move_relative_distance
 
     async def set_move_absolute_parameters(self, absolute_position):
         """Set the following absolute move parameter: absolute_position.
@@ -246,6 +370,7 @@ class Tdc(_Cube):
         """
         payload = st.pack("<Hl", 1, absolute_position)
         await self.send(Message(MGMSG.MOT_SET_MOVEABSPARAMS, data=payload))
+        self.move_absolute_position = absolute_position
 
     async def get_move_absolute_parameters(self):
         """Get the absolute position move parameter.
@@ -256,7 +381,8 @@ class Tdc(_Cube):
         get_msg = await self.send_request(
             MGMSG.MOT_REQ_MOVEABSPARAMS, [MGMSG.MOT_GET_MOVEABSPARAMS], 1
         )
-        return st.unpack("<l", get_msg.data[2:])[0]
+        self.move_absolute_position = st.unpack("<l", get_msg.data[2:])[0]
+        return self.move_absolute_position
 
     async def set_home_parameters(self, home_velocity):
         """Set the homing velocity parameter.
@@ -265,6 +391,7 @@ class Tdc(_Cube):
         """
         payload = st.pack("<HHHLL", 1, 0, 0, home_velocity, 0)
         await self.send(Message(MGMSG.MOT_SET_HOMEPARAMS, data=payload))
+        self.home_velocity = home_velocity
 
     async def get_home_parameters(self):
         """Get the homing velocity parameter.
@@ -275,17 +402,27 @@ class Tdc(_Cube):
         get_msg = await self.send_request(
             MGMSG.MOT_REQ_HOMEPARAMS, [MGMSG.MOT_GET_HOMEPARAMS], 1
         )
-        return st.unpack("<L", get_msg.data[6:10])[0]
+        self.home_velocity = st.unpack("<L", get_msg.data[6:10])[0]
+        return self.home_velocity
 
     async def move_home(self):
         """Start a home move sequence.
 
         This call is blocking until device is homed or move is stopped.
         """
-        await self.send_request(
-            MGMSG.MOT_MOVE_HOME,
-            [MGMSG.MOT_MOVE_HOMED, MGMSG.MOT_MOVE_STOPPED],
-            1,
+        await self._wait_move(await self.start_move_home())
+
+    async def start_move_home(self) -> int:
+        """Start a home move sequence without waiting for it to end.
+
+        :return: A move handle for :py:meth:`wait_move()<Tdc.wait_move>` and
+            :py:meth:`move_status()<Tdc.move_status>`.
+        :rtype: int
+        """
+        # No default timeout: the position counter only tells the distance to
+        # the home switch once the stage was homed since power up.
+        return await self._start_move(
+            Message(MGMSG.MOT_MOVE_HOME, param1=1), _HOME_END_MSGS, None, 0
         )
 
     async def set_limit_switch_parameters(
@@ -371,10 +508,21 @@ class Tdc(_Cube):
         <Tdc.set_move_relative_parameters>`
         command.
         """
-        await self.send_request(
-            MGMSG.MOT_MOVE_RELATIVE,
-            [MGMSG.MOT_MOVE_COMPLETED, MGMSG.MOT_MOVE_STOPPED],
-            1,
+        await self._wait_move(await self.start_move_relative_memory())
+
+    async def start_move_relative_memory(self) -> int:
+        """Start a relative move of distance in the controller's memory
+        without waiting for it to end.
+
+        :return: A move handle for :py:meth:`wait_move()<Tdc.wait_move>` and
+            :py:meth:`move_status()<Tdc.move_status>`.
+        :rtype: int
+        """
+        return await self._start_move(
+            Message(MGMSG.MOT_MOVE_RELATIVE, param1=1),
+            _MOVE_END_MSGS,
+            self._estimate_move_time(self.move_relative_distance, relative=True),
+            self._relative_target(self.move_relative_distance),
         )
 
     async def move_relative(self, relative_distance):
@@ -383,11 +531,23 @@ class Tdc(_Cube):
         :param relative_distance: The distance to move in position encoder
             counts.
         """
+        await self._wait_move(await self.start_move_relative(relative_distance))
+
+    async def start_move_relative(self, relative_distance: int) -> int:
+        """Start a relative move without waiting for it to end.
+
+        :param relative_distance: The distance to move in position encoder
+            counts.
+        :return: A move handle for :py:meth:`wait_move()<Tdc.wait_move>` and
+            :py:meth:`move_status()<Tdc.move_status>`.
+        :rtype: int
+        """
         payload = st.pack("<Hl", 1, relative_distance)
-        await self.send_request(
-            MGMSG.MOT_MOVE_RELATIVE,
-            [MGMSG.MOT_MOVE_COMPLETED, MGMSG.MOT_MOVE_STOPPED],
-            data=payload,
+        return await self._start_move(
+            Message(MGMSG.MOT_MOVE_RELATIVE, data=payload),
+            _MOVE_END_MSGS,
+            self._estimate_move_time(relative_distance, relative=True),
+            self._relative_target(relative_distance),
         )
 
     async def move_absolute_memory(self):
@@ -398,10 +558,21 @@ class Tdc(_Cube):
         <Tdc.set_move_absolute_parameters>`
         command.
         """
-        await self.send_request(
-            MGMSG.MOT_MOVE_ABSOLUTE,
-            [MGMSG.MOT_MOVE_COMPLETED, MGMSG.MOT_MOVE_STOPPED],
-            param1=1,
+        await self._wait_move(await self.start_move_absolute_memory())
+
+    async def start_move_absolute_memory(self) -> int:
+        """Start an absolute move of distance in the controller's memory
+        without waiting for it to end.
+
+        :return: A move handle for :py:meth:`wait_move()<Tdc.wait_move>` and
+            :py:meth:`move_status()<Tdc.move_status>`.
+        :rtype: int
+        """
+        return await self._start_move(
+            Message(MGMSG.MOT_MOVE_ABSOLUTE, param1=1),
+            _MOVE_END_MSGS,
+            self._estimate_move_time(self.move_absolute_position),
+            self.move_absolute_position,
         )
 
     async def move_absolute(self, absolute_distance):
@@ -411,11 +582,23 @@ class Tdc(_Cube):
             integer that specifies the absolute distance in position encoder
             counts.
         """
+        await self._wait_move(await self.start_move_absolute(absolute_distance))
+
+    async def start_move_absolute(self, absolute_distance: int) -> int:
+        """Start an absolute move without waiting for it to end.
+
+        :param absolute_distance: The absolute position to move to, in
+            position encoder counts.
+        :return: A move handle for :py:meth:`wait_move()<Tdc.wait_move>` and
+            :py:meth:`move_status()<Tdc.move_status>`.
+        :rtype: int
+        """
         payload = st.pack("<Hl", 1, absolute_distance)
-        await self.send_request(
-            MGMSG.MOT_MOVE_ABSOLUTE,
-            [MGMSG.MOT_MOVE_COMPLETED, MGMSG.MOT_MOVE_STOPPED],
-            data=payload,
+        return await self._start_move(
+            Message(MGMSG.MOT_MOVE_ABSOLUTE, data=payload),
+            _MOVE_END_MSGS,
+            self._estimate_move_time(absolute_distance),
+            absolute_distance,
         )
 
     async def move_jog(self, direction):
@@ -423,13 +606,402 @@ class Tdc(_Cube):
 
         :param direction: The direction to jog. 1 is forward, 2 is backward.
         """
-        await self.send_request(
-            MGMSG.MOT_MOVE_JOG,
-            [MGMSG.MOT_MOVE_COMPLETED, MGMSG.MOT_MOVE_STOPPED],
-            param1=1,
-            param2=direction,
+        await self._wait_move(await self.start_move_jog(direction))
+
+    async def start_move_jog(self, direction: int) -> int:
+        """Start a jog move without waiting for it to end.
+
+        :param direction: The direction to jog. 1 is forward, 2 is backward.
+        :return: A move handle for :py:meth:`wait_move()<Tdc.wait_move>` and
+            :py:meth:`move_status()<Tdc.move_status>`.
+        :rtype: int
+        """
+        return await self._start_move(
+            Message(MGMSG.MOT_MOVE_JOG, param1=1, param2=direction),
+            _MOVE_END_MSGS,
+            self._estimate_jog_time(),
+            self._jog_target(direction),
         )
 
+    def _relative_target(self, distance):
+        if distance is None or self.position is None:
+            return None
+        return self.position + distance
+
+    def _jog_target(self, direction):
+        if self.jog_parameters is None or self.jog_parameters[0] != 2:
+            return None
+        step_size = self.jog_parameters[1]
+        return self._relative_target(step_size if direction == 1 else -step_size)
+
+    async def _start_move(self, message, wait_for_msgs, duration=None, target=None):
+        handle, _ = await self._send_move(message, wait_for_msgs, duration, target)
+        return handle
+
+    async def _send_move(self, message, wait_for_msgs, duration=None, target=None):
+        # Start a move and record its state, returns its handle and when the
+        # start message was written, e.g. for the skew of group moves.
+        # Moving until the next status update says otherwise.
+        self._set_moving(True)
+        self.move_target = target
+        future = await self._send_and_expect(message, wait_for_msgs)
+        sent = time.monotonic()
+        handle = next(self._move_handles)
+        self._moves[handle] = future
+        self._move_timeouts[handle] = (
+            None
+            if duration is None
+            else duration * _MOVE_TIMEOUT_FACTOR + _MOVE_TIMEOUT_MARGIN
+        )
+        for old in list(self._moves):
+            if len(self._moves) <= _MOVE_HISTORY:
+                break
+            if self._moves[old].done():
+                del self._moves[old]
+                del self._move_timeouts[old]
+        return handle, sent
+
+    def _move_future(self, handle):
+        try:
+            return self._moves[handle]
+        except KeyError:
+            raise ValueError("Unknown move handle: {}".format(handle)) from None
+
+    async def wait_move(self, handle: int, timeout: Optional[float] = None) -> str:
+        """Wait for a move started by one of the ``start_move_*`` methods to
+        end.
+
+        The end of the move is signalled by the unsolicited
+        MGMSG.MOT_MOVE_COMPLETED, MGMSG.MOT_MOVE_STOPPED or
+        MGMSG.MOT_MOVE_HOMED message. The handle is released once the move has
+        ended.
+
+        :param handle: The handle returned when the move was started.
+        :param timeout: Maximum time to wait in seconds. By default, twice
+            the :py:meth:`estimated duration<Tdc.estimate_move_time>` of the
+            move plus 2 seconds. There is no default timeout for home moves,
+            nor if the duration could not be estimated when the move was
+            started. Expiry raises ``asyncio.TimeoutError`` but does not
+            affect the move, which can be waited for again. The blocking
+            ``move_*`` methods wait without a timeout.
+        :return: How the move ended: "completed", "stopped" or "homed".
+        :rtype: str
+        """
+        if timeout is None:
+            timeout = self._move_timeouts.get(handle)
+        return await self._wait_move(handle, timeout)
+
+    async def _wait_move(self, handle, timeout=None):
+        # The blocking moves wait without the default timeout, as the
+        # position and velocity parameters the estimate relies on may be
+        # stale.
+        future = self._move_future(handle)
+        try:
+            msg = await asyncio.wait_for(asyncio.shield(future), timeout)
+        finally:
+            if future.done():
+                self._moves.pop(handle, None)
+                self._move_timeouts.pop(handle, None)
+        return _MOVE_END[msg.id]
+
+    def move_status(self, handle: int) -> str:
+        """Get the state of a move without waiting.
+
+        :param handle: The handle returned when the move was started.
+        :return: "moving" while the move is in progress, then how it ended:
+            "completed", "stopped" or "homed", or "failed" if the controller
+            reported an error.
+        :rtype: str
+        """
+        return _move_state(self._move_future(handle))
+
+    def _estimate_move_time(self, target, relative=False):
+        if target is None or self.velocity_parameters is None:
+            return None
+        if not relative:
+            if self.position is None:
+                return None
+            target = np.subtract(target, self.position)
+        return move_time(target, *self.velocity_parameters)
+
+    def _estimate_jog_time(self):
+        if self.jog_parameters is None:
+            return None
+        mode, step_size, acceleration, max_velocity, _ = self.jog_parameters
+        if mode != 2:
+            # continuous jogging lasts as long as the jog button is pressed
+            return None
+        return move_time(step_size, acceleration, max_velocity)
+
+    def _estimate_home_time(self):
+        if (
+            self.position is None
+            or self.home_velocity is None
+            or self.velocity_parameters is None
+        ):
+            return None
+        return move_time(self.position, self.velocity_parameters[0], self.home_velocity)
+
+    def get_position_estimate(self) -> dict:
+        """Estimate the current position without talking to the device.
+
+        The position of the last status update is extrapolated to now from
+        the velocity it reports, following the trapezoidal profile towards
+        the target of the current move when it is known. Status updates must
+        be turned on with :py:meth:`hardware_start_update_messages()
+        <thorlabs_cube.driver.base._Cube.hardware_start_update_messages>`
+        and the velocity parameters known, cf.
+        :py:meth:`estimate_move_time()<Tdc.estimate_move_time>`.
+
+        :return: A dict with the estimated ``position`` in encoder counts,
+            its ``uncertainty``, the largest error in encoder counts if the
+            motor accelerated or braked as hard as its velocity parameters
+            allow since the status update, and the ``age`` of that update in
+            seconds.
+        :rtype: dict
+        """
+        if not self._status_samples:
+            raise ValueError(
+                "No status update received, call "
+                "hardware_start_update_messages() first"
+            )
+        if self.velocity_parameters is None:
+            raise ValueError(
+                "Velocity parameters are unknown, "
+                "call get_velocity_parameters() first"
+            )
+        received, position, velocity = self._status_samples[-1]
+        age = time.monotonic() - received
+        if not self.moving:
+            return {"position": float(position), "uncertainty": 0.0, "age": age}
+
+        acceleration, max_velocity = self.velocity_parameters
+        # the status velocity has no sign, take the direction of the move
+        if self.move_target is not None:
+            direction = np.sign(self.move_target - position)
+            remaining = abs(self.move_target - position)
+        elif len(self._status_samples) > 1:
+            direction = np.sign(position - self._status_samples[0][1])
+            remaining = np.inf
+        else:
+            direction = 0
+            remaining = np.inf
+        velocity = min(velocity, max_velocity)
+        travelled = distance_travelled(
+            age, remaining, velocity, acceleration, max_velocity
+        )
+        # bounds from braking now or accelerating up to the maximum velocity
+        low = distance_travelled(
+            age, velocity**2 / (2 * acceleration), velocity, acceleration, max_velocity
+        )
+        high = distance_travelled(
+            age, remaining, velocity, acceleration, max_velocity, brake=False
+        )
+        if direction == 0:
+            uncertainty = high
+            travelled = 0.0
+        else:
+            uncertainty = max(travelled - low, high - travelled)
+        return {
+            "position": float(position + direction * travelled),
+            "uncertainty": float(uncertainty),
+            "age": age,
+        }
+
+    def estimate_move_time(self, targets, relative: bool = False):
+        """Estimate the duration of moves from the trapezoidal velocity
+        profile.
+
+        The estimate uses the velocity parameters last set or read with
+        :py:meth:`set_velocity_parameters()<Tdc.set_velocity_parameters>` /
+        :py:meth:`get_velocity_parameters()<Tdc.get_velocity_parameters>`,
+        and, for absolute moves, the position from the last status update or
+        :py:meth:`get_position_counter()<Tdc.get_position_counter>` call.
+        It does not talk to the device.
+
+        :param targets: An absolute position, or relative distance if
+            ``relative`` is set, in encoder counts; or a list of them to
+            estimate several moves from the current position at once.
+        :param relative: True if targets are relative distances.
+        :return: The estimated move duration in seconds, or a list of
+            durations if a list of targets was given.
+        :rtype: float or list of float
+        """
+        if self.velocity_parameters is None:
+            raise ValueError(
+                "Velocity parameters are unknown, "
+                "call get_velocity_parameters() first"
+            )
+        if not relative and self.position is None:
+            raise ValueError(
+                "Current position is unknown, call get_position_counter() first"
+            )
+        duration = self._estimate_move_time(targets, relative)
+        return duration.tolist() if isinstance(duration, np.ndarray) else duration
+
+    def estimate_jog_time(self) -> float:
+        """Estimate the duration of a single step jog.
+
+        :return: The estimated jog duration in seconds, from the jog
+            parameters last set or read with :py:meth:`set_jog_parameters()
+            <Tdc.set_jog_parameters>` / :py:meth:`get_jog_parameters()
+            <Tdc.get_jog_parameters>`.
+        :rtype: float
+        """
+        duration = self._estimate_jog_time()
+        if duration is None:
+            raise ValueError("Jog parameters are unknown or not single step")
+        return duration
+
+    def estimate_home_time(self) -> float:
+        """Estimate the duration of a home move.
+
+        Assumes the home switch is at position 0 and uses the home velocity
+        last set or read with :py:meth:`set_home_parameters()
+        <Tdc.set_home_parameters>` / :py:meth:`get_home_parameters()
+        <Tdc.get_home_parameters>`, so this is only meaningful if the stage
+        was homed since power up.
+
+        :return: The estimated home move duration in seconds.
+        :rtype: float
+        """
+        duration = self._estimate_home_time()
+        if duration is None:
+            raise ValueError(
+                "Position, home velocity or velocity parameters are unknown"
+            )
+        return duration
+
+    async def start_fly_scan(
+        self,
+        start: int,
+        stop: int,
+        velocity: Optional[int] = None,
+        update_rate: int = 10,
+    ) -> int:
+        """Start a continuous scan, recording the position as the stage moves.
+
+        The stage is moved to ``start``, then status update messages are
+        turned on (and left on) and the move to ``stop`` is started. Every
+        status update received until :py:meth:`stop_fly_scan()
+        <Tdc.stop_fly_scan>` is recorded with its receive time, so that
+        detector samples taken during the move can be assigned a position
+        with :py:func:`thorlabs_cube.driver.scan.interpolate_positions`.
+
+        :param start: Scan start position, in encoder counts. The stage is
+            moved there first.
+        :param stop: Scan end position, in encoder counts.
+        :param velocity: Scan velocity in encoder counts/sec, or None to keep
+            the current velocity parameters. The acceleration is kept.
+        :param update_rate: Rate of the status update messages.
+        :return: A move handle for :py:meth:`wait_move()<Tdc.wait_move>`.
+        :rtype: int
+        """
+        await self.move_absolute(start)
+        if velocity is not None:
+            if self.velocity_parameters is None:
+                await self.get_velocity_parameters()
+            await self.set_velocity_parameters(self.velocity_parameters[0], velocity)
+        await self.hardware_start_update_messages(update_rate)
+        self._start_recording()
+        return await self.start_move_absolute(stop)
+
+    def stop_fly_scan(self) -> dict:
+        """Stop recording the position samples of a fly scan.
+
+        :return: A dict of two lists of the same length: ``time`` (UNIX
+            timestamps of the status updates, in seconds) and ``position``
+            (in encoder counts).
+        :rtype: dict
+        """
+        return self._stop_recording()
+
+    async def fly_scan(
+        self,
+        start: int,
+        stop: int,
+        velocity: Optional[int] = None,
+        update_rate: int = 10,
+    ) -> dict:
+        """Make a continuous scan, recording the position as the stage moves.
+
+        This call is blocking until the scan move has ended. See
+        :py:meth:`start_fly_scan()<Tdc.start_fly_scan>`.
+
+        :return: The recorded samples, cf. :py:meth:`stop_fly_scan()
+            <Tdc.stop_fly_scan>`.
+        :rtype: dict
+        """
+        handle = await self.start_fly_scan(start, stop, velocity, update_rate)
+        try:
+            await self._wait_move(handle)
+        finally:
+            samples = self.stop_fly_scan()
+        return samples
+
+    async def _prepare_move_absolute(self, absolute_position):
+        """Load the target of an absolute move and return the message that
+        starts it."""
+        await self.set_move_absolute_parameters(absolute_position)
+        return Message(MGMSG.MOT_MOVE_ABSOLUTE, param1=1)
+
+    async def run_move_queue(
+        self, positions: list[int], dwell_times: Optional[list[float]] = None
+    ) -> list[dict]:
+        """Move through a sequence of absolute positions.
+
+        The next target is loaded with :py:meth:`set_move_absolute_parameters()
+        <Tdc.set_move_absolute_parameters>` while the current move is running,
+        so that only the MGMSG.MOT_MOVE_ABSOLUTE start message has to be sent
+        once the end of move is reported. The queue is aborted if a move is
+        stopped instead of completing.
+
+        :param positions: The absolute positions to visit, in encoder counts.
+        :param dwell_times: Optional time to wait at each position in seconds,
+            one per position.
+        :return: One dict per executed step with the keys ``position``,
+            ``end`` (how the move ended, cf. :py:meth:`wait_move()
+            <Tdc.wait_move>`), ``start`` and ``completed`` (times in seconds
+            since the queue started), ``move_time`` and ``dead_time`` (time
+            between the end of the previous move, dwell excluded, and the
+            start of this one).
+        :rtype: list of dict
+        """
+        if dwell_times is None:
+            dwell_times = [0.0] * len(positions)
+        if len(dwell_times) != len(positions):
+            raise ValueError("dwell_times must have one entry per position")
+        steps: list[dict] = []
+        if not positions:
+            return steps
+
+        t0 = time.monotonic()
+        await self.set_move_absolute_parameters(positions[0])
+        ready = time.monotonic()
+        for i, position in enumerate(positions):
+            start = time.monotonic()
+            handle = await self.start_move_absolute_memory()
+            if i + 1 < len(positions):
+                await self.set_move_absolute_parameters(positions[i + 1])
+            end = await self._wait_move(handle)
+            completed = time.monotonic()
+            steps.append(
+                {
+                    "position": position,
+                    "end": end,
+                    "start": start - t0,
+                    "completed": completed - t0,
+                    "move_time": completed - start,
+                    "dead_time": start - ready,
+                }
+            )
+            if end != "completed":
+                break
+            if dwell_times[i] > 0:
+                await asyncio.sleep(dwell_times[i])
+            ready = time.monotonic()
+        return steps
+
     async def move_velocity(self, direction):
         """Start a move.
 
@@ -443,8 +1015,109 @@ class Tdc(_Cube):
         :param direction: The direction to jog: 1 to move forward, 2 to move
             backward.
         """
+        # until the next status update says otherwise
+        self._set_moving(True)
+        self.move_target = None
         await self.send(Message(MGMSG.MOT_MOVE_VELOCITY, param1=1, param2=direction))
 
+    async def _apply_velocity(self, velocity):
+        speed = abs(int(velocity))
+        if speed == 0:
+            if self._stream_velocity != 0:
+                await self.send(
+                    Message(
+                        MGMSG.MOT_MOVE_STOP, param1=1, param2=self._stream_stop_mode
+                    )
+                )
+            self._stream_velocity = 0
+            return
+        changed = speed != abs(self._stream_velocity)
+        if self.velocity_parameters[1] != speed:
+            await self.set_velocity_parameters(self.velocity_parameters[0], speed)
+        if changed or (velocity > 0) != (self._stream_velocity > 0):
+            # the velocity parameters are taken into account at the move
+            # command
+            self._set_moving(True)
+            self.move_target = None
+            direction = 1 if velocity > 0 else 2
+            await self.send(
+                Message(MGMSG.MOT_MOVE_VELOCITY, param1=1, param2=direction)
+            )
+        self._stream_velocity = velocity
+
+    async def _stop_failed_stream(self):
+        # the velocity reached by a failed stream is unknown
+        self._stream_velocity = 0
+        await self.send(
+            Message(MGMSG.MOT_MOVE_STOP, param1=1, param2=self._stream_stop_mode)
+        )
+
+    async def start_velocity_stream(
+        self,
+        max_rate: float = 20.0,
+        timeout: Optional[float] = 0.5,
+        stop_mode: int = 2,
+    ) -> None:
+        """Start a velocity streaming session.
+
+        Signed velocity setpoints sent with
+        :py:meth:`set_velocity_setpoint()<Tdc.set_velocity_setpoint>` are
+        coalesced: only the latest one is sent, at most ``max_rate`` times
+        per second, and only the frames that change the motion are written
+        (the velocity parameters when the speed changes, a move at velocity
+        when the speed or the direction changes, a stop for a zero setpoint).
+        The acceleration of the current velocity parameters is kept.
+
+        :param max_rate: Maximum number of setpoints sent per second.
+        :param timeout: The motor is stopped if no setpoint is received for
+            this many seconds, e.g. when the client went away. None disables
+            the timeout. The motor is also stopped if sending a setpoint
+            fails, which ends the session.
+        :param stop_mode: How to stop on zero setpoints, timeout, failure and
+            at the end of the session: 1 to stop immediately, 2 for a
+            profiled stop.
+        """
+        if self._velocity_stream is not None:
+            raise ValueError("A velocity stream is already running")
+        if self.velocity_parameters is None:
+            await self.get_velocity_parameters()
+        self._stream_velocity = 0
+        self._stream_stop_mode = stop_mode
+        self._velocity_stream = SetpointStream(
+            self._apply_velocity,
+            max_rate,
+            timeout,
+            lambda: self._apply_velocity(0),
+            self._stop_failed_stream,
+        )
+
+    def set_velocity_setpoint(self, velocity: int) -> None:
+        """Request a new velocity during a velocity streaming session.
+
+        This call does not wait for the device, see
+        :py:meth:`start_velocity_stream()<Tdc.start_velocity_stream>`.
+
+        :param velocity: The velocity in encoder counts/sec, positive to move
+            forward, negative to move backward, 0 to stop.
+        """
+        if self._velocity_stream is None:
+            raise ValueError("No velocity stream, call start_velocity_stream() first")
+        self._velocity_stream.update(velocity)
+
+    async def stop_velocity_stream(self) -> dict:
+        """End the velocity streaming session and stop the motor.
+
+        :return: A dict with the number of setpoints ``received`` and
+            ``applied`` during the session.
+        :rtype: dict
+        """
+        if self._velocity_stream is None:
+            raise ValueError("No velocity stream running")
+        stream, self._velocity_stream = self._velocity_stream, None
+        await stream.close(flush=False)
+        await self._apply_velocity(0)
+        return {"received": stream.received, "applied": stream.applied}
+
     async def move_stop(self, stop_mode):
         """Stop any type of motor move.
 
@@ -455,13 +1128,25 @@ class Tdc(_Cube):
             or profiled stop. Set this byte to 1 to stop immediately, or to 2
             to stop in a controlled (profiled) manner.
         """
-        if await self.is_moving():
-            await self.send_request(
-                MGMSG.MOT_MOVE_STOP,
-                [MGMSG.MOT_MOVE_STOPPED, MGMSG.MOT_MOVE_COMPLETED],
-                1,
-                stop_mode,
-            )
+        # The stop is always sent first, as moves may have been started from
+        # the front panel. The motion state only tells whether to wait for the
+        # end of move message, the device is asked unless a status update was
+        # received recently.
+        future = await self._send_and_expect(
+            Message(MGMSG.MOT_MOVE_STOP, param1=1, param2=stop_mode),
+            [MGMSG.MOT_MOVE_STOPPED, MGMSG.MOT_MOVE_COMPLETED],
+        )
+        if (
+            not self._status_samples
+            or time.monotonic() - self._status_samples[-1][0] > _STATUS_MAX_AGE
+        ):
+            moving = await self.is_moving()
+        else:
+            moving = self.moving
+        if moving or future.done():
+            await future
+        else:
+            future.cancel()
 
     async def set_dc_pid_parameters(
         self,
@@ -607,7 +1292,9 @@ class Tdc(_Cube):
         get_msg = await self.send_request(
             MGMSG.MOT_REQ_STATUSBITS, [MGMSG.MOT_GET_STATUSBITS], 1
         )
-        return st.unpack("<L", get_msg.data[2:])[0]
+        status = st.unpack("<L", get_msg.data[2:])[0]
+        self._update_status_bits(status)
+        return status
 
     async def suspend_end_of_move_messages(self):
         """Disable all unsolicited "end of move" messages and error messages
@@ -634,6 +1321,15 @@ class Tdc(_Cube):
 
 
 class TdcSim:
+    def __init__(self):
+        self.moves = {}
+        self.position = 0
+        # motion parameters used by the estimate_* methods until they are set
+        self.acceleration = 1000
+        self.max_velocity = 1000
+        self.step_size = 0
+        self.home_velocity = 1000
+
     def close(self):
         pass
 
@@ -739,6 +1435,9 @@ class TdcSim:
     def move_home(self):
         pass
 
+    def start_move_home(self):
+        return self._start_move("homed")
+
     def set_limit_switch_parameters(
         self,
         cw_hw_limit,
@@ -765,24 +1464,108 @@ class TdcSim:
     def move_relative_memory(self):
         pass
 
+    def start_move_relative_memory(self):
+        return self._start_move()
+
     def move_relative(self, relative_distance):
         pass
 
+    def start_move_relative(self, relative_distance):
+        return self._start_move()
+
     def move_absolute_memory(self):
         pass
 
+    def start_move_absolute_memory(self):
+        return self._start_move()
+
     def move_absolute(self, absolute_distance):
         pass
 
+    def start_move_absolute(self, absolute_distance):
+        return self._start_move()
+
     def move_jog(self, direction):
         pass
 
+    def start_move_jog(self, direction):
+        return self._start_move()
+
+    def _start_move(self, end="completed"):
+        # simulated moves end immediately
+        handle = len(self.moves) + 1
+        self.moves[handle] = end
+        return handle
+
+    def wait_move(self, handle, timeout=None):
+        return self.move_status(handle)
+
+    def move_status(self, handle):
+        if handle not in self.moves:
+            raise ValueError("Unknown move handle: {}".format(handle))
+        return self.moves[handle]
+
+    def estimate_move_time(self, targets, relative=False):
+        if not relative:
+            targets = np.subtract(targets, self.position)
+        duration = move_time(targets, self.acceleration, self.max_velocity)
+        return duration.tolist() if isinstance(duration, np.ndarray) else duration
+
+    def estimate_jog_time(self):
+        return move_time(self.step_size, self.acceleration, self.max_velocity)
+
+    def estimate_home_time(self):
+        return move_time(self.position, self.acceleration, self.home_velocity)
+
+    def get_position_estimate(self):
+        return {"position": float(self.position), "uncertainty": 0.0, "age": 0.0}
+
+    def start_fly_scan(self, start, stop, velocity=None, update_rate=10):
+        now = time.time()
+        self.fly_scan_samples = {"time": [now, now + 1.0], "position": [start, stop]}
+        return self.start_move_absolute(stop)
+
+    def stop_fly_scan(self):
+        return self.fly_scan_samples
+
+    def fly_scan(self, start, stop, velocity=None, update_rate=10):
+        self.wait_move(self.start_fly_scan(start, stop, velocity, update_rate))
+        return self.stop_fly_scan()
+
+    def run_move_queue(self, positions, dwell_times=None):
+        if dwell_times is not None and len(dwell_times) != len(positions):
+            raise ValueError("dwell_times must have one entry per position")
+        steps = []
+        for position in positions:
+            self.absolute_position = position
+            steps.append(
+                {
+                    "position": position,
+                    "end": "completed",
+                    "start": 0.0,
+                    "completed": 0.0,
+                    "move_time": 0.0,
+                    "dead_time": 0.0,
+                }
+            )
+        return steps
+
     def move_velocity(self, direction):
         pass
 
     def move_stop(self, stop_mode):
         pass
 
+    def start_velocity_stream(self, max_rate=20.0, timeout=0.5, stop_mode=2):
+        self.velocity_setpoints = []
+
+    def set_velocity_setpoint(self, velocity):
+        self.velocity_setpoints.append(velocity)
+
+    def stop_velocity_stream(self):
+        received = len(self.velocity_setpoints)
+        return {"received": received, "applied": received}
+
     def set_dc_pid_parameters(
         self,
         proportional,
@@ -829,6 +1612,9 @@ class TdcSim:
     def get_status_bits(self):
         return 0x80000400  # FIXME: not implemented yet for simulation
 
+    def wait_until_stopped(self, timeout=None):
+        return self.get_status_bits()
+
     def suspend_end_of_move_messages(self):
         pass
 
@@ -1,7 +1,67 @@
+import asyncio
+import logging
 import struct as st
+import time
+from typing import Callable, Optional
+
+import numpy as np
 
 from thorlabs_cube.driver.base import _Cube
+from thorlabs_cube.driver.filters import FilterBank, FilterChain, make_stage
 from thorlabs_cube.driver.message import MGMSG, QUADMSG, Message, MsgError
+from thorlabs_cube.driver.quad import ReadingBuffer, beam_statistics
+from thorlabs_cube.driver.stability import StabilityAnalysis
+
+logger = logging.getLogger(__name__)
+
+_POSITION_OUTPUTS_FRAME = np.dtype(
+    [
+        ("id", "<u2"),
+        ("length", "<u2"),
+        ("dest", "u1"),
+        ("src", "u1"),
+        ("sub_id", "<u2"),
+        ("x_pos", "<i2"),
+        ("y_pos", "<i2"),
+    ]
+)
+
+
+def _pack_position_outputs(x_pos, y_pos) -> list[bytes]:
+    """Pack one QUAD_SET_PARAMS position outputs message per point."""
+    frames = np.empty(len(x_pos), dtype=_POSITION_OUTPUTS_FRAME)
+    frames["id"] = MGMSG.QUAD_SET_PARAMS.value
+    frames["length"] = 6
+    frames["dest"] = 0x50 | 0x80
+    frames["src"] = 0x01
+    frames["sub_id"] = QUADMSG.QUAD_POSITION_OUTPUTS_SUB_ID.value
+    frames["x_pos"] = x_pos
+    frames["y_pos"] = y_pos
+    return [frame.tobytes() for frame in frames]
+
+
+def _trajectory_points(x_positions, y_positions) -> tuple[np.ndarray, np.ndarray]:
+    x = np.rint(np.asarray(x_positions, dtype=float))
+    y = np.rint(np.asarray(y_positions, dtype=float))
+    if x.ndim != 1 or x.shape != y.shape or not len(x):
+        raise ValueError("Expected as many X and Y positions, at least one")
+    points = np.concatenate((x, y))
+    if np.any((points < -32768) | (points > 32767)):
+        raise ValueError("Positions must be in range [-32768;32767]")
+    return x.astype(np.int16), y.astype(np.int16)
+
+
+def _trajectory_stats() -> dict:
+    return {
+        "sent": 0,
+        "duration": 0.0,
+        "mean_lateness": None,
+        "rms_jitter": None,
+        "max_lateness": None,
+        "late": 0,
+        "running": False,
+        "failure": None,
+    }
 
 
 class Tpa(_Cube):
@@ -15,6 +75,19 @@ class Tpa(_Cube):
         super().__init__(serial_dev)
         self.loop_params = None
         self.status_report_counter = 0
+        self._status_listeners: list[Callable[[tuple, float], None]] = []
+        self.readings = ReadingBuffer()
+        self._stability: Optional[StabilityAnalysis] = None
+        self.filters = FilterBank()
+        self._trajectory: Optional[asyncio.Task] = None
+        self._trajectory_repeats = False
+        self._trajectory_stats = _trajectory_stats()
+
+    def close(self) -> None:
+        """Close the device, stopping a running trajectory."""
+        if self._trajectory is not None:
+            self._trajectory.cancel()
+        super().close()
 
     async def handle_message(self, msg: Message) -> None:
         """Handle incoming messages from the TPA101 device.
@@ -31,23 +104,191 @@ class Tpa(_Cube):
             raise MsgError("Hardware error, please disconnect and reconnect the TPA101")
 
         elif msg_id == MGMSG.QUAD_GET_STATUSUPDATE:
-            x_diff, y_diff, sum_val, x_pos, y_pos, status_bits = st.unpack(
-                "<hhIhhI", data[6:20]
-            )
+            await self._handle_status(data)
+
+    async def _handle_status(self, data: bytes) -> None:
+        reading = st.unpack("<hhIhhI", data[6:22])
+        x_diff, y_diff, sum_val, x_pos, y_pos, status_bits = reading
+
+        # Update internal state variables with the extracted values
+        self.x_diff = x_diff
+        self.y_diff = y_diff
+        self.sum_val = sum_val
+        self.x_pos = x_pos
+        self.y_pos = y_pos
+        self.status_bits = status_bits
+
+        timestamp = time.monotonic()
+        self.readings.append(reading, timestamp)
+        for listener in self._status_listeners:
+            listener(reading, timestamp)
+
+        if self.status_report_counter == 25:
+            self.status_report_counter = 0
+            await self.send(Message(MGMSG.QUAD_ACK_STATUSUPDATE))
+        else:
+            self.status_report_counter += 1
+
+    def add_status_listener(self, listener: Callable[[tuple, float], None]) -> None:
+        """Call a function on each status update, from the message reader.
+
+        The listener must not block. It is called with the decoded
+        (x_diff, y_diff, sum_val, x_pos, y_pos, status_bits) tuple and the
+        ``time.monotonic()`` reception time.
+
+        :param listener: The function to call.
+        """
+        self._status_listeners.append(listener)
+        self._start_reader()
+
+    def remove_status_listener(self, listener: Callable[[tuple, float], None]) -> None:
+        """Stop calling a function added with :py:meth:`add_status_listener`.
+
+        :param listener: The function to remove.
+        """
+        self._status_listeners.remove(listener)
+
+    def set_reading_buffer_size(self, size: int) -> None:
+        """Set how many status updates are kept for statistics.
+
+        The readings already recorded are discarded.
+
+        :param size: Number of status updates kept.
+        """
+        self.readings = ReadingBuffer(size)
+
+    def clear_readings(self) -> None:
+        """Discard the recorded status updates."""
+        self.readings.clear()
+
+    def get_beam_statistics(
+        self, num_samples: Optional[int] = None, duration: Optional[float] = None
+    ) -> dict:
+        """Get the beam statistics over the latest status updates.
+
+        Status updates are recorded once they are enabled with
+        :py:meth:`hardware_start_update_messages()
+        <thorlabs_cube.driver.base._Cube.hardware_start_update_messages>`.
+
+        :param num_samples: Use at most this many status updates, by default
+            all the recorded ones.
+        :param duration: Only use the status updates received within this
+            many seconds of the last one.
+        :return: The mean, RMS deviation and peak-to-peak range of the
+            readings and of the normalised beam centroid, see
+            :py:func:`beam_statistics()
+            <thorlabs_cube.driver.quad.beam_statistics>`.
+        :rtype: dict
+        """
+        return beam_statistics(self.readings.latest(num_samples, duration))
+
+    def start_stability_analysis(
+        self, num_octaves: int = 16, segment_length: int = 256
+    ) -> None:
+        """Start the online pointing stability analysis.
+
+        The overlapping Allan deviation and the Welch power spectral density
+        of the normalised beam centroid are updated with each following
+        status update, see :py:class:`StabilityAnalysis
+        <thorlabs_cube.driver.stability.StabilityAnalysis>`. A running
+        analysis is restarted.
+
+        :param num_octaves: Number of Allan deviation averaging times, from
+            one status update period doubling up to ``2**(num_octaves - 1)``
+            periods.
+        :param segment_length: Number of samples per PSD segment, which sets
+            the frequency resolution.
+        """
+        if self._stability is not None:
+            self.remove_status_listener(self._stability.append)
+        self._stability = StabilityAnalysis(num_octaves, segment_length)
+        self.add_status_listener(self._stability.append)
+
+    def get_stability(self) -> dict:
+        """Get the current results of the stability analysis.
+
+        :return: See :py:meth:`StabilityAnalysis.report()
+            <thorlabs_cube.driver.stability.StabilityAnalysis.report>`.
+        :rtype: dict
+        """
+        if self._stability is None:
+            raise ValueError("No stability analysis, call start_stability_analysis()")
+        return self._stability.report()
 
-            # Update internal state variables with the extracted values
-            self.x_diff = x_diff
-            self.y_diff = y_diff
-            self.sum_val = sum_val
-            self.x_pos = x_pos
-            self.y_pos = y_pos
-            self.status_bits = status_bits
+    def stop_stability_analysis(self) -> dict:
+        """Stop the stability analysis.
+
+        :return: The final results, see :py:meth:`get_stability`.
+        :rtype: dict
+        """
+        report = self.get_stability()
+        self.remove_status_listener(self._stability.append)
+        self._stability = None
+        return report
+
+    def add_filter_chain(
+        self, name: str, stages: list[dict], buffer_size: int = 1000
+    ) -> int:
+        """Add a filter chain of the status updates, with its own output rate.
+
+        Each following status update is filtered by the stages in sequence,
+        and the outputs are kept for :py:meth:`get_filtered`. All the chains
+        share the decoded status updates. A chain of the same name is
+        replaced.
+
+        :param name: Name of the chain.
+        :param stages: Description of each stage, e.g.
+            ``[{"type": "cic", "factor": 10, "order": 2},
+            {"type": "iir", "alpha": 0.1}]``, see :py:func:`make_stage()
+            <thorlabs_cube.driver.filters.make_stage>`.
+        :param buffer_size: Number of outputs kept.
+        :return: The decimation factor of the chain, i.e. the number of
+            status updates per output.
+        :rtype: int
+        """
+        chain = FilterChain([make_stage(spec) for spec in stages], buffer_size)
+        if not self.filters.chains:
+            self.add_status_listener(self.filters.append)
+        self.filters.add(name, chain)
+        return chain.factor
 
-            if self.status_report_counter == 25:
-                self.status_report_counter = 0
-                await self.send(Message(MGMSG.QUAD_ACK_STATUSUPDATE))
-            else:
-                self.status_report_counter += 1
+    def remove_filter_chain(self, name: str) -> None:
+        """Remove a filter chain added with :py:meth:`add_filter_chain`.
+
+        :param name: Name of the chain.
+        """
+        self.filters.remove(name)
+        if not self.filters.chains:
+            self.remove_status_listener(self.filters.append)
+
+    def get_filter_chains(self) -> dict:
+        """Get the filter chains.
+
+        :return: The description of each chain by name, see
+            :py:meth:`FilterChain.to_dict()
+            <thorlabs_cube.driver.filters.FilterChain.to_dict>`.
+        :rtype: dict
+        """
+        return {name: chain.to_dict() for name, chain in self.filters.chains.items()}
+
+    def get_filtered(
+        self,
+        name: str,
+        num_samples: Optional[int] = None,
+        duration: Optional[float] = None,
+    ) -> dict:
+        """Get the latest outputs of a filter chain.
+
+        :param name: Name of the chain.
+        :param num_samples: Maximum number of outputs, all the kept ones by
+            default.
+        :param duration: Only get the outputs within this many seconds of
+            the last one.
+        :return: A list of values, oldest first, for ``time`` and each of
+            ``x_diff``, ``y_diff``, ``sum_val``, ``x_pos`` and ``y_pos``.
+        :rtype: dict
+        """
+        return self.filters.latest(name, num_samples, duration)
 
     async def set_loop_params(self, p_gain: int, i_gain: int, d_gain: int) -> None:
         """Set proportional, integral, and differential feedback loop constants.
@@ -209,6 +450,129 @@ class Tpa(_Cube):
         )
         await self.send(Message(MGMSG.QUAD_SET_PARAMS, data=payload))
 
+    def start_trajectory(
+        self, x_positions, y_positions, sample_rate: float, cycles: int = 1
+    ) -> float:
+        """Start streaming a trajectory of the X and Y position outputs.
+
+        The points are output as with :py:meth:`set_quad_position_outputs`,
+        in open loop mode, by a task of the driver that sends one message
+        per point at ``sample_rate``. The messages are packed beforehand,
+        and sent on a schedule fixed from the start time so that timing
+        errors do not accumulate: a late point is sent at once and the next
+        ones keep their times. The lateness of each message is measured,
+        see :py:meth:`get_trajectory_stats`.
+
+        :param x_positions: X-axis position output of each point (-32768 to
+            32767).
+        :param y_positions: Y-axis position output of each point.
+        :param sample_rate: Number of points output per second, at most the
+            960 messages per second of the serial line.
+        :param cycles: Number of times the trajectory is output, 0 to repeat
+            it until :py:meth:`stop_trajectory` is called.
+        :return: The duration of the trajectory in seconds, 0 if it repeats
+            until stopped.
+        :rtype: float
+        """
+        if self._trajectory is not None and not self._trajectory.done():
+            raise ValueError("A trajectory is already running")
+        x, y = _trajectory_points(x_positions, y_positions)
+        # 10 bits per byte on the line, with the start and stop bits
+        max_rate = self._BAUDRATE / (10 * _POSITION_OUTPUTS_FRAME.itemsize)
+        if not 0 < sample_rate <= max_rate:
+            raise ValueError(
+                "Sample rate must be in range (0;{}], got {}".format(
+                    max_rate, sample_rate
+                )
+            )
+        if cycles < 0:
+            raise ValueError("Cycles must not be negative, got {}".format(cycles))
+        frames = _pack_position_outputs(x, y)
+        self._trajectory_stats = _trajectory_stats()
+        self._trajectory_repeats = cycles == 0
+        self._trajectory = asyncio.ensure_future(
+            self._run_trajectory(frames, 1 / sample_rate, cycles)
+        )
+        return len(frames) * cycles / sample_rate
+
+    async def _run_trajectory(
+        self, frames: list[bytes], period: float, cycles: int
+    ) -> None:
+        stats = self._trajectory_stats
+        stats["running"] = True
+        total = len(frames) * cycles
+        lateness_sum = 0.0
+        lateness_sum2 = 0.0
+        t0 = time.monotonic()
+        try:
+            k = 0
+            while cycles == 0 or k < total:
+                deadline = t0 + k * period
+                await asyncio.sleep(deadline - time.monotonic())
+                lateness = time.monotonic() - deadline
+                await self._send_frames(frames[k % len(frames)])
+                k += 1
+                lateness_sum += lateness
+                lateness_sum2 += lateness * lateness
+                mean = lateness_sum / k
+                stats["sent"] = k
+                stats["duration"] = time.monotonic() - t0
+                stats["mean_lateness"] = mean
+                stats["rms_jitter"] = max(lateness_sum2 / k - mean * mean, 0.0) ** 0.5
+                stats["max_lateness"] = max(stats["max_lateness"] or 0.0, lateness)
+                stats["late"] += lateness > period
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats["failure"] = str(e)
+            logger.error("trajectory streaming failed", exc_info=True)
+        finally:
+            stats["running"] = False
+
+    def get_trajectory_stats(self) -> dict:
+        """Get the timing statistics of the last trajectory.
+
+        :return: A dict with the number of points ``sent``, the ``duration``
+            in seconds from the start to the last point, the
+            ``mean_lateness`` of the messages behind their schedule, the
+            ``rms_jitter`` of the lateness and the ``max_lateness``, in
+            seconds (None before the first point), the number of messages
+            ``late`` by more than a sample period, whether the trajectory is
+            ``running``, and the error message that stopped it as
+            ``failure``.
+        :rtype: dict
+        """
+        return dict(self._trajectory_stats)
+
+    async def wait_trajectory(self) -> dict:
+        """Wait for the end of the trajectory.
+
+        :return: The timing statistics, see :py:meth:`get_trajectory_stats`.
+        :rtype: dict
+        """
+        if self._trajectory is None:
+            raise ValueError("No trajectory started")
+        if self._trajectory_repeats and not self._trajectory.done():
+            raise ValueError("The trajectory repeats until stopped")
+        await asyncio.shield(self._trajectory)
+        return self.get_trajectory_stats()
+
+    async def stop_trajectory(self) -> dict:
+        """Stop the trajectory, leaving the outputs at the last point sent.
+
+        :return: The timing statistics, see :py:meth:`get_trajectory_stats`.
+        :rtype: dict
+        """
+        if self._trajectory is None:
+            raise ValueError("No trajectory started")
+        task = self._trajectory
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return self.get_trajectory_stats()
+
     async def get_quad_position_outputs(self) -> tuple[int, int]:
         """Get the X and Y position outputs.
 
@@ -295,10 +659,66 @@ class TpaSim:
         self.position_outputs = (0, 0)
         self.loop_params2 = (0, 0, 0, 0, 0, 0.1, 2, 2)
         self.eeprom_params = 0x00
+        self.readings = ReadingBuffer()
+        self.filters = FilterBank()
+        self.trajectory_stats = _trajectory_stats()
 
     def close(self):
         pass
 
+    def set_reading_buffer_size(self, size: int) -> None:
+        self.readings = ReadingBuffer(size)
+
+    def clear_readings(self) -> None:
+        self.readings.clear()
+
+    def get_beam_statistics(
+        self, num_samples: Optional[int] = None, duration: Optional[float] = None
+    ) -> dict:
+        # one reading of the simulated state per call
+        self.readings.append((*self.quad_readings, self.status_bits), time.monotonic())
+        return beam_statistics(self.readings.latest(num_samples, duration))
+
+    def start_stability_analysis(
+        self, num_octaves: int = 16, segment_length: int = 256
+    ) -> None:
+        self.stability = StabilityAnalysis(num_octaves, segment_length)
+
+    def get_stability(self) -> dict:
+        if getattr(self, "stability", None) is None:
+            raise ValueError("No stability analysis, call start_stability_analysis()")
+        # one reading of the simulated state per call
+        self.stability.append((*self.quad_readings, self.status_bits), time.monotonic())
+        return self.stability.report()
+
+    def stop_stability_analysis(self) -> dict:
+        report = self.get_stability()
+        self.stability = None
+        return report
+
+    def add_filter_chain(
+        self, name: str, stages: list[dict], buffer_size: int = 1000
+    ) -> int:
+        chain = FilterChain([make_stage(spec) for spec in stages], buffer_size)
+        self.filters.add(name, chain)
+        return chain.factor
+
+    def remove_filter_chain(self, name: str) -> None:
+        self.filters.remove(name)
+
+    def get_filter_chains(self) -> dict:
+        return {name: chain.to_dict() for name, chain in self.filters.chains.items()}
+
+    def get_filtered(
+        self,
+        name: str,
+        num_samples: Optional[int] = None,
+        duration: Optional[float] = None,
+    ) -> dict:
+        # one reading of the simulated state per call
+        self.filters.append((*self.quad_readings, self.status_bits), time.monotonic())
+        return self.filters.latest(name, num_samples, duration)
+
     def set_loop_params(self, p_gain: int, i_gain: int, d_gain: int) -> None:
         self.loop_params = (p_gain, i_gain, d_gain)
 
@@ -360,6 +780,42 @@ class TpaSim:
     def get_quad_position_outputs(self) -> tuple[int, int]:
         return self.position_outputs
 
+    def start_trajectory(
+        self, x_positions, y_positions, sample_rate: float, cycles: int = 1
+    ) -> float:
+        if self.trajectory_stats["running"]:
+            raise ValueError("A trajectory is already running")
+        x, y = _trajectory_points(x_positions, y_positions)
+        if not 0 < sample_rate <= 960:
+            raise ValueError(
+                "Sample rate must be in range (0;960], got {}".format(sample_rate)
+            )
+        if cycles < 0:
+            raise ValueError("Cycles must not be negative, got {}".format(cycles))
+        # the simulated trajectory is output at once, unless it repeats
+        self.position_outputs = (int(x[-1]), int(y[-1]))
+        self.trajectory_stats = _trajectory_stats()
+        self.trajectory_stats.update(
+            sent=len(x) * cycles,
+            mean_lateness=0.0,
+            rms_jitter=0.0,
+            max_lateness=0.0,
+            running=cycles == 0,
+        )
+        return len(x) * cycles / sample_rate
+
+    def get_trajectory_stats(self) -> dict:
+        return dict(self.trajectory_stats)
+
+    def wait_trajectory(self) -> dict:
+        if self.trajectory_stats["running"]:
+            raise ValueError("The trajectory repeats until stopped")
+        return self.get_trajectory_stats()
+
+    def stop_trajectory(self) -> dict:
+        self.trajectory_stats["running"] = False
+        return self.get_trajectory_stats()
+
     def set_quad_loop_params2(
         self,
         p_gain: float,
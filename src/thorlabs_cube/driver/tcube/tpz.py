@@ -1,8 +1,66 @@
+import asyncio
+import hashlib
 import struct as st
+import time
 from typing import Optional
 
+import numpy as np
+
 from thorlabs_cube.driver.base import _Cube
 from thorlabs_cube.driver.message import MGMSG, Message, MsgError
+from thorlabs_cube.driver.stream import SetpointStream
+from thorlabs_cube.driver.tcube.hysteresis import CompensationCache, HysteresisModel
+
+# Number of samples of the output LUT
+LUT_SIZE = 513
+
+# Rate of the LUT sample clock, in Hz. This is the 7 kHz maximum output
+# bandwidth of the MGMSG_PZ_SET_OUTPUTLUT description in the Thorlabs APT
+# communications protocol, cf. set_output_lut(). The 4 kHz figure of its
+# MGMSG_PZ_SET_OUTPUTLUTPARAMS description is not used.
+LUT_CLOCK = 7000.0
+
+# Half of the LUT, refilled while the other half plays when streaming
+_LUT_HALF = LUT_SIZE // 2
+
+# Polling interval bounds while waiting for the output to settle, in seconds
+_SETTLE_POLL_MIN = 0.001
+_SETTLE_POLL_MAX = 0.05
+
+# Size of the PZ_SET_OUTPUTVOLTS and PZ_SET_OUTPUTPOS messages, in bytes
+_OUTPUT_FRAME_SIZE = 10
+
+# Default share of the serial line used by output streams, the rest is left
+# for requests and status messages
+_OUTPUT_STREAM_LINE_SHARE = 0.5
+
+# PZ_SET_OUTPUTLUT frames written per port write during bulk uploads
+_LUT_BURST = 64
+
+_OUTPUT_LUT_FRAME = np.dtype(
+    [
+        ("id", "<u2"),
+        ("length", "<u2"),
+        ("dest", "u1"),
+        ("src", "u1"),
+        ("channel", "<u2"),
+        ("index", "<u2"),
+        ("output", "<i2"),
+    ]
+)
+
+
+def _pack_output_lut(indices, counts) -> bytes:
+    """Pack one PZ_SET_OUTPUTLUT message per LUT sample."""
+    frames = np.empty(len(indices), dtype=_OUTPUT_LUT_FRAME)
+    frames["id"] = MGMSG.PZ_SET_OUTPUTLUT.value
+    frames["length"] = 6
+    frames["dest"] = 0x50 | 0x80
+    frames["src"] = 0x01
+    frames["channel"] = _Cube._CHANNEL
+    frames["index"] = indices
+    frames["output"] = counts
+    return frames.tobytes()
 
 
 class Tpz(_Cube):
@@ -14,14 +72,31 @@ class Tpz(_Cube):
     def __init__(self, serial_dev) -> None:
         super().__init__(serial_dev)
         self.voltage_limit: Optional[int] = None
+        # LUT contents believed to be loaded in the device, in DAC counts
+        self._lut = np.zeros(LUT_SIZE, dtype=np.int16)
+        self._lut_known = np.zeros(LUT_SIZE, dtype=bool)
+        self.lut_hash: Optional[str] = None
+        self.lut_parameters: Optional[tuple[int, int, int, int, int, int]] = None
+        self.hysteresis_model: Optional[HysteresisModel] = None
+        self._compensated = CompensationCache()
+        self._output_stream: Optional[SetpointStream] = None
+        # PZ_SET_OUTPUTVOLTS/POS message reused for each streamed setpoint
+        self._output_frame = bytearray(_OUTPUT_FRAME_SIZE)
+        self._output_scale = 1.0
+        self._output_limit = 0.0
+        self._output_counts: Optional[int] = None
+        self._output_sent = 0
+        self._output_dropped = 0
 
     async def handle_message(self, msg) -> None:
         msg_id = msg.id
         data = msg.data
 
         if msg_id == MGMSG.HW_DISCONNECT:
+            self.invalidate_lut_cache()
             raise MsgError("Error: Please disconnect the TPZ001")
         elif msg_id == MGMSG.HW_RESPONSE:
+            self.invalidate_lut_cache()
             raise MsgError(
                 "Hardware error, please disconnect " "and reconnect the TPZ001"
             )
@@ -128,6 +203,167 @@ class Tpz(_Cube):
         )
         return st.unpack("<H", get_msg.data[2:])[0]
 
+    async def _settle(self, get, target: float, tolerance: float, timeout) -> dict:
+        t0 = time.monotonic()
+        interval = _SETTLE_POLL_MIN
+        polls = 0
+        while True:
+            value = await get()
+            polls += 1
+            elapsed = time.monotonic() - t0
+            if abs(value - target) <= tolerance:
+                return {"value": value, "settle_time": elapsed, "polls": polls}
+            if elapsed >= timeout:
+                raise asyncio.TimeoutError(
+                    "Output did not settle to {} within {} s, last read {}".format(
+                        target, timeout, value
+                    )
+                )
+            # most setpoints settle within a few polls, back off for the others
+            await asyncio.sleep(min(interval, timeout - elapsed))
+            interval = min(2 * interval, _SETTLE_POLL_MAX)
+
+    async def set_output_volts_and_settle(
+        self, voltage: float, tolerance: float = 0.03, timeout: float = 1.0
+    ) -> dict:
+        """Set the output voltage and wait until the output reaches it.
+
+        The output voltage is polled, at intervals growing from 1 ms to
+        50 ms, until it is within ``tolerance`` of ``voltage``.
+
+        :param voltage: The output voltage, see :py:meth:`set_output_volts`.
+        :param tolerance: The maximum difference to the requested voltage,
+            in volts.
+        :param timeout: Maximum time to wait in seconds, after which
+            ``asyncio.TimeoutError`` is raised.
+        :return: A dict with the last ``value`` read, the ``settle_time`` in
+            seconds since the voltage was set and the number of ``polls``.
+        :rtype: dict
+        """
+        await self.set_output_volts(voltage)
+        return await self._settle(self.get_output_volts, voltage, tolerance, timeout)
+
+    async def set_output_position_and_settle(
+        self, position_sw: int, tolerance: int = 10, timeout: float = 1.0
+    ) -> dict:
+        """Set the output position and wait until the output reaches it.
+
+        The output position is polled, at intervals growing from 1 ms to
+        50 ms, until it is within ``tolerance`` of ``position_sw``.
+
+        :param position_sw: The output position, see
+            :py:meth:`set_output_position`.
+        :param tolerance: The maximum difference to the requested position.
+        :param timeout: Maximum time to wait in seconds, after which
+            ``asyncio.TimeoutError`` is raised.
+        :return: A dict with the last ``value`` read, the ``settle_time`` in
+            seconds since the position was set and the number of ``polls``.
+        :rtype: dict
+        """
+        await self.set_output_position(position_sw)
+        return await self._settle(
+            self.get_output_position, position_sw, tolerance, timeout
+        )
+
+    async def _apply_output(self, setpoint: float) -> None:
+        counts = int(setpoint * self._output_scale)
+        if counts == self._output_counts:
+            self._output_dropped += 1
+            return
+        st.pack_into("<H", self._output_frame, 8, counts)
+        await self._send_frames(self._output_frame)
+        self._output_counts = counts
+        self._output_sent += 1
+
+    async def start_output_stream(
+        self, output: str = "volts", max_rate: Optional[float] = None
+    ) -> float:
+        """Start an output setpoint streaming session.
+
+        Setpoints sent with :py:meth:`set_output_setpoint()
+        <Tpz.set_output_setpoint>` are coalesced: only the latest one is
+        sent, at most ``max_rate`` times per second, so that a feedback loop
+        faster than the serial link does not build up a backlog of commands.
+        Setpoints equal to the last one sent, once converted to DAC counts,
+        are not written.
+
+        :param output: ``"volts"`` to stream output voltages as with
+            :py:meth:`set_output_volts`, in open loop mode, or ``"position"``
+            to stream output positions as with :py:meth:`set_output_position`,
+            in closed loop mode.
+        :param max_rate: Maximum number of setpoints sent per second. By
+            default, half of the serial line capacity, i.e. 576 setpoints per
+            second.
+        :return: The maximum setpoint rate in use.
+        :rtype: float
+        """
+        if self._output_stream is not None:
+            raise ValueError("An output stream is already running")
+        if output == "volts":
+            if self.voltage_limit is None:
+                raise ValueError("Voltage limit is not set")
+            msg_id = MGMSG.PZ_SET_OUTPUTVOLTS
+            self._output_scale = 32767 / self.voltage_limit
+        elif output == "position":
+            msg_id = MGMSG.PZ_SET_OUTPUTPOS
+            self._output_scale = 1.0
+        else:
+            raise ValueError(
+                "Output must be 'volts' or 'position', got {}".format(output)
+            )
+        if max_rate is None:
+            # 10 bits per byte on the line, with the start and stop bits
+            frame_rate = self._BAUDRATE / (10 * _OUTPUT_FRAME_SIZE)
+            max_rate = _OUTPUT_STREAM_LINE_SHARE * frame_rate
+        self._output_frame[:] = Message(
+            msg_id, data=st.pack("<HH", Tpz._CHANNEL, 0)
+        ).pack()
+        self._output_limit = self.voltage_limit if output == "volts" else 65535
+        self._output_counts = None
+        self._output_sent = 0
+        self._output_dropped = 0
+        self._output_stream = SetpointStream(self._apply_output, max_rate)
+        return max_rate
+
+    def set_output_setpoint(self, setpoint: float) -> None:
+        """Request a new output during an output streaming session.
+
+        This call does not wait for the device, see
+        :py:meth:`start_output_stream()<Tpz.start_output_stream>`.
+
+        :param setpoint: The output voltage in volts, or the output position,
+            depending on the streamed output.
+        """
+        if self._output_stream is None:
+            raise ValueError("No output stream, call start_output_stream() first")
+        if not 0 <= setpoint <= self._output_limit:
+            raise ValueError(
+                "Setpoint must be in range [0;{}]".format(self._output_limit)
+            )
+        self._output_stream.update(setpoint)
+
+    async def stop_output_stream(self) -> dict:
+        """End the output streaming session.
+
+        The latest setpoint is sent if it is still pending.
+
+        :return: A dict with the number of setpoints ``received``, ``sent``,
+            ``coalesced`` (replaced by a newer setpoint before they could be
+            sent) and ``dropped`` (not sent as the output already had their
+            value).
+        :rtype: dict
+        """
+        if self._output_stream is None:
+            raise ValueError("No output stream running")
+        stream, self._output_stream = self._output_stream, None
+        await stream.close()
+        return {
+            "received": stream.received,
+            "sent": self._output_sent,
+            "coalesced": stream.received - stream.applied,
+            "dropped": self._output_dropped,
+        }
+
     async def set_input_volts_source(self, volt_src: int) -> None:
         """Set the input source(s) which controls the output from the HV
         amplifier circuit (i.e. the drive to the piezo actuators).
@@ -226,7 +462,7 @@ class Tpz(_Cube):
         function), then only the first cyclelength values need to be set. In
         this manner, any arbitrary voltage waveform can be programmed into the
         LUT. Note. The LUT values are output by the system at a maximum
-        bandwidth of 7 KHz, e.g. 500 LUT values will take approximately 71 ms
+        bandwidth of 7 kHz, e.g. 500 LUT values will take approximately 71 ms
         to be clocked out.
 
         :param lut_index: The position in the array of the value to be set (0
@@ -242,6 +478,273 @@ class Tpz(_Cube):
         volt = round(output * 32767 / self.voltage_limit)
         payload = st.pack("<HHH", Tpz._CHANNEL, lut_index, volt)
         await self.send(Message(MGMSG.PZ_SET_OUTPUTLUT, data=payload))
+        if 0 <= lut_index < LUT_SIZE:
+            self._lut[lut_index] = volt
+            self._lut_known[lut_index] = True
+        self.lut_hash = None
+
+    def invalidate_lut_cache(self) -> None:
+        """Forget the LUT contents and parameters believed to be loaded.
+
+        The next :py:meth:`set_output_lut_array()<Tpz.set_output_lut_array>`
+        call then uploads the whole waveform. This is done automatically when
+        the device reports a disconnection or a hardware error, call it after
+        power cycling the device without restarting the driver.
+        """
+        self._lut_known[:] = False
+        self.lut_hash = None
+        self.lut_parameters = None
+
+    def _lut_counts(self, values, max_length=LUT_SIZE) -> np.ndarray:
+        if self.voltage_limit is None:
+            raise ValueError("Voltage limit is not set")
+        values = np.asarray(values, dtype=float)
+        if values.ndim != 1 or not 0 < len(values) <= max_length:
+            raise ValueError(
+                "Expected between 1 and {} LUT values, got {}".format(
+                    max_length, values.shape
+                )
+            )
+        if np.any(values < 0) or np.any(values > self.voltage_limit):
+            raise ValueError(
+                "LUT values must be in range [0;{}]".format(self.voltage_limit)
+            )
+        return np.rint(values * 32767 / self.voltage_limit).astype(np.int16)
+
+    async def _upload_lut(self, indices, counts) -> None:
+        frames = _pack_output_lut(indices, counts)
+        burst = _LUT_BURST * _OUTPUT_LUT_FRAME.itemsize
+        # the serial flow control paces the controller, writing in bursts
+        # lets the reader run in between
+        for start in range(0, len(frames), burst):
+            await self._send_frames(frames[start : start + burst])
+
+    async def _load_lut(self, offset: int, counts: np.ndarray) -> int:
+        """Upload the samples of ``counts`` at ``offset`` that differ from the
+        LUT contents believed to be loaded, and return how many were sent."""
+        cached = slice(offset, offset + len(counts))
+        loaded = self._lut_known[cached] & (self._lut[cached] == counts)
+        indices = np.flatnonzero(~loaded)
+        if len(indices):
+            # forget the cache first, in case the upload is interrupted
+            self.lut_hash = None
+            self._lut_known[offset + indices] = False
+            await self._upload_lut(offset + indices, counts[indices])
+            self._lut[offset + indices] = counts[indices]
+            self._lut_known[offset + indices] = True
+        return len(indices)
+
+    async def set_output_lut_array(
+        self,
+        values,
+        mode: int = 1,
+        num_cycles: int = 1,
+        delay_time: int = 1,
+        precycle_rest: int = 0,
+        postcycle_rest: int = 0,
+    ) -> dict:
+        """Load a whole waveform in the LUT and set its output parameters.
+
+        This is the bulk version of :py:meth:`set_output_lut()
+        <Tpz.set_output_lut>` followed by
+        :py:meth:`set_output_lut_parameters()<Tpz.set_output_lut_parameters>`
+        with the cycle length set to the number of values: the samples are
+        converted to DAC counts at once and all the LUT messages are packed in
+        a single buffer, written in a few bursts.
+
+        The driver keeps track of the LUT contents it loaded: only the samples
+        that differ from them are uploaded, nothing at all if the waveform is
+        the one last loaded, and the parameters are only sent if they changed.
+
+        :param values: The voltage (or position, in closed loop) samples, at
+            most 513, in range [0; voltage_limit].
+        :param mode: 1 to output continuously, 2 for a fixed number of
+            cycles.
+        :param num_cycles: Number of cycles to output in fixed mode.
+        :param delay_time: Delay between samples, in sample intervals.
+        :param precycle_rest: Delay before the first sample, in sample
+            intervals.
+        :param postcycle_rest: Delay after the last sample, in sample
+            intervals.
+        :return: A dict with the upload statistics: ``samples`` in the
+            waveform, ``uploaded`` samples, ``bytes`` written for them,
+            ``duration`` in seconds and ``throughput`` in uploaded samples per
+            second.
+        :rtype: dict
+        """
+        counts = self._lut_counts(values)
+        digest = hashlib.sha1(counts.tobytes()).hexdigest()
+        t0 = time.monotonic()
+        uploaded = 0
+        if digest != self.lut_hash:
+            uploaded = await self._load_lut(0, counts)
+        self.lut_hash = digest
+        parameters = (
+            mode,
+            len(counts),
+            num_cycles,
+            delay_time,
+            precycle_rest,
+            postcycle_rest,
+        )
+        if parameters != self.lut_parameters:
+            await self.set_output_lut_parameters(*parameters)
+        duration = time.monotonic() - t0
+        return {
+            "samples": len(counts),
+            "uploaded": uploaded,
+            "bytes": uploaded * _OUTPUT_LUT_FRAME.itemsize,
+            "duration": duration,
+            "throughput": uploaded / duration if duration > 0 else 0.0,
+        }
+
+    async def stream_output_lut(self, values, delay_time: int = 8) -> dict:
+        """Output a waveform longer than the LUT, with hardware-timed samples.
+
+        The waveform is split in segments of half the LUT (256 samples). The
+        LUT is played in fixed mode over its first 512 samples, for as many
+        cycles as needed, and each half is refilled with the next segment
+        while the other half plays. The last segment is padded with the last
+        sample. The host follows the playback with its own clock from the
+        7 kHz LUT clock, so refilling a half must be faster than playing one:
+        with the 115200 baud link this takes a ``delay_time`` of about 8 or
+        more. This call is blocking until the waveform has been output.
+
+        :param values: The voltage (or position, in closed loop) samples, in
+            range [0; voltage_limit].
+        :param delay_time: Interval between samples, in LUT clock periods.
+        :return: A dict with the streaming statistics: ``samples`` in the
+            waveform, ``segments``, ``uploaded`` samples, ``duration`` of the
+            output in seconds, ``underruns`` (refills that ended after their
+            half started playing) and ``min_slack`` (smallest time left
+            between the end of a refill and the playback of its half, in
+            seconds, negative on underrun; None with 2 segments or less).
+        :rtype: dict
+        """
+        counts = self._lut_counts(values, max_length=np.iinfo(np.int64).max)
+        n_segments = -(-len(counts) // _LUT_HALF)
+        # the table is played in whole cycles of two halves
+        n_segments += n_segments % 2
+        padded = np.full(n_segments * _LUT_HALF, counts[-1], dtype=np.int16)
+        padded[: len(counts)] = counts
+        segments = padded.reshape(n_segments, _LUT_HALF)
+        half_time = _LUT_HALF * max(delay_time, 1) / LUT_CLOCK
+        # stay a little behind the playback, the clocks drift apart
+        guard = 0.02 * half_time
+
+        await self.stop_lut_output()
+        uploaded = await self._load_lut(0, segments[0])
+        uploaded += await self._load_lut(_LUT_HALF, segments[1])
+        await self.set_output_lut_parameters(
+            2, 2 * _LUT_HALF, n_segments // 2, delay_time, 0, 0
+        )
+        await self.start_lut_output()
+        t0 = time.monotonic()
+
+        slack = []
+        for k in range(2, n_segments):
+            # the half of segment k - 2 is free once segment k - 1 plays
+            await asyncio.sleep(t0 + (k - 1) * half_time + guard - time.monotonic())
+            uploaded += await self._load_lut((k % 2) * _LUT_HALF, segments[k])
+            slack.append(t0 + k * half_time - time.monotonic())
+        await asyncio.sleep(t0 + n_segments * half_time - time.monotonic())
+        return {
+            "samples": len(counts),
+            "segments": n_segments,
+            "uploaded": uploaded,
+            "duration": time.monotonic() - t0,
+            "underruns": sum(s < 0 for s in slack),
+            "min_slack": min(slack) if slack else None,
+        }
+
+    def fit_hysteresis_model(self, voltages, positions, num_operators: int = 8) -> dict:
+        """Fit the open loop hysteresis model from a recorded sweep.
+
+        The sweep should go back and forth over the whole output range used
+        afterwards, with positions measured e.g. by an external sensor.
+
+        :param voltages: The output voltages applied during the sweep.
+        :param positions: The positions measured at each voltage, in the
+            units of the waveforms to compensate.
+        :param num_operators: Number of play operators of the model.
+        :return: The model parameters, see :py:meth:`get_hysteresis_model`,
+            with the RMS fit error in volts as ``residual``.
+        :rtype: dict
+        """
+        model = HysteresisModel.fit(voltages, positions, num_operators)
+        self.hysteresis_model = model
+        params = model.to_dict()
+        params["residual"] = model.residual(voltages, positions)
+        return params
+
+    def get_hysteresis_model(self) -> Optional[dict]:
+        """Get the hysteresis model in use.
+
+        :return: None if no model is set, else a dict with the ``thresholds``
+            and ``weights`` of the play operators, the voltage ``offset`` and
+            the model ``version`` string.
+        :rtype: dict
+        """
+        if self.hysteresis_model is None:
+            return None
+        return self.hysteresis_model.to_dict()
+
+    def set_hysteresis_model(self, params: Optional[dict]) -> str:
+        """Set a previously fitted hysteresis model.
+
+        :param params: The output of :py:meth:`get_hysteresis_model`, or None
+            to remove the model.
+        :return: The model version, or an empty string.
+        :rtype: str
+        """
+        if params is None:
+            self.hysteresis_model = None
+            return ""
+        self.hysteresis_model = HysteresisModel.from_dict(params)
+        return self.hysteresis_model.version
+
+    async def set_output_lut_compensated(
+        self,
+        positions,
+        mode: int = 1,
+        num_cycles: int = 1,
+        delay_time: int = 1,
+        precycle_rest: int = 0,
+        postcycle_rest: int = 0,
+    ) -> dict:
+        """Load a position waveform in the LUT, compensating the hysteresis.
+
+        The waveform is converted to output voltages with the hysteresis
+        model, for the steady state of a waveform output in a loop, then
+        loaded as with :py:meth:`set_output_lut_array`. The voltages are
+        kept for each waveform and model version, so that outputting a
+        waveform again costs neither the computation nor the upload.
+
+        :param positions: The positions to go through, in the units of the
+            sweep the model was fitted on.
+        :return: The report of :py:meth:`set_output_lut_array`, with the
+            model ``version``, whether the voltages were ``cached`` and the
+            number of samples ``clipped`` to the voltage range.
+        :rtype: dict
+        """
+        if self.hysteresis_model is None:
+            raise ValueError("Hysteresis model is not set")
+        if self.voltage_limit is None:
+            raise ValueError("Voltage limit is not set")
+        voltages, cached = self._compensated.get(self.hysteresis_model, positions)
+        clipped = np.count_nonzero((voltages < 0) | (voltages > self.voltage_limit))
+        report = await self.set_output_lut_array(
+            np.clip(voltages, 0, self.voltage_limit),
+            mode,
+            num_cycles,
+            delay_time,
+            precycle_rest,
+            postcycle_rest,
+        )
+        report["version"] = self.hysteresis_model.version
+        report["cached"] = cached
+        report["clipped"] = int(clipped)
+        return report
 
     async def get_output_lut(self) -> tuple[int, float]:
         """Get the ouput LUT values for WGM (Waveform Generator Mode).
@@ -296,13 +799,14 @@ class Tpz(_Cube):
         :param delay_time: Specifies the delay (in sample intervals) that the
             system waits after setting each LUT output value. By default, the
             time the system takes to output LUT values (sampling interval) is
-            set at the maximum bandwidth possible, i.e. 4 kHz (0.25 ms) for TPZ
-            units. The delay_time parameter specifies the time interval between
-            neighbouring samples, i.e. for how long the sample will remain at
-            its present value. To increase the time between samples, set the
-            delay_time parameter to the required additional delay (1 to
-            2147483648 sample intervals). In this way, the user can stretch or
-            shrink the waveform without affecting its overall shape.
+            set at the maximum bandwidth possible, i.e. 7 kHz (about 0.14 ms)
+            for TPZ units, see :py:data:`LUT_CLOCK`. The delay_time parameter
+            specifies the time interval between neighbouring samples, i.e. for
+            how long the sample will remain at its present value. To increase
+            the time between samples, set the delay_time parameter to the
+            required additional delay (1 to 2147483648 sample intervals). In
+            this way, the user can stretch or shrink the waveform without
+            affecting its overall shape.
         :param precycle_rest: In some applications, during waveform generation
             the first and the last samples may need to be handled differently
             from the rest of the waveform. For example, in a positioning system
@@ -338,6 +842,14 @@ class Tpz(_Cube):
             0,
         )
         await self.send(Message(MGMSG.PZ_SET_OUTPUTLUTPARAMS, data=payload))
+        self.lut_parameters = (
+            mode,
+            cycle_length,
+            num_cycles,
+            delay_time,
+            precycle_rest,
+            postcycle_rest,
+        )
 
     async def get_output_lut_parameters(self) -> tuple[int, int, int, int, int, int]:
         """Get Waveform Generator Mode parameters.
@@ -351,7 +863,8 @@ class Tpz(_Cube):
             [MGMSG.PZ_GET_OUTPUTLUTPARAMS],
             Tpz._CHANNEL,
         )
-        return st.unpack("<HHLLLL", get_msg.data[2:22])
+        self.lut_parameters = st.unpack("<HHLLLL", get_msg.data[2:22])
+        return self.lut_parameters
 
     async def start_lut_output(self) -> None:
         """Start the voltage waveform (LUT) outputs."""
@@ -497,6 +1010,39 @@ class TpzSim:
     def get_output_position(self) -> int:
         return self.position_sw
 
+    def set_output_volts_and_settle(
+        self, voltage: float, tolerance: float = 0.03, timeout: float = 1.0
+    ) -> dict:
+        self.set_output_volts(voltage)
+        return {"value": self.voltage, "settle_time": 0.0, "polls": 1}
+
+    def set_output_position_and_settle(
+        self, position_sw: int, tolerance: int = 10, timeout: float = 1.0
+    ) -> dict:
+        self.set_output_position(position_sw)
+        return {"value": self.position_sw, "settle_time": 0.0, "polls": 1}
+
+    def start_output_stream(
+        self, output: str = "volts", max_rate: Optional[float] = None
+    ) -> float:
+        self.output_stream = output
+        self.output_setpoints = []
+        return 576.0 if max_rate is None else max_rate
+
+    def set_output_setpoint(self, setpoint: float) -> None:
+        limit = self.voltage_limit if self.output_stream == "volts" else 65535
+        if not 0 <= setpoint <= limit:
+            raise ValueError("Setpoint must be in range [0;{}]".format(limit))
+        self.output_setpoints.append(setpoint)
+        if self.output_stream == "volts":
+            self.set_output_volts(setpoint)
+        else:
+            self.set_output_position(setpoint)
+
+    def stop_output_stream(self) -> dict:
+        received = len(self.output_setpoints)
+        return {"received": received, "sent": received, "coalesced": 0, "dropped": 0}
+
     def set_input_volts_source(self, volt_src: int) -> None:
         self.volt_src: int = volt_src
 
@@ -521,6 +1067,32 @@ class TpzSim:
     def get_output_lut(self) -> tuple[int, float]:
         return 0, 0.0  # FIXME: the API description here doesn't make any sense
 
+    def set_output_lut_array(
+        self,
+        values,
+        mode: int = 1,
+        num_cycles: int = 1,
+        delay_time: int = 1,
+        precycle_rest: int = 0,
+        postcycle_rest: int = 0,
+    ) -> dict:
+        if not 0 < len(values) <= LUT_SIZE:
+            raise ValueError("Expected between 1 and {} LUT values".format(LUT_SIZE))
+        lut = getattr(self, "lut_array", None) or [None] * LUT_SIZE
+        uploaded = sum(lut[i] != float(value) for i, value in enumerate(values))
+        lut[: len(values)] = [float(value) for value in values]
+        self.lut_array = lut
+        self.set_output_lut_parameters(
+            mode, len(values), num_cycles, delay_time, precycle_rest, postcycle_rest
+        )
+        return {
+            "samples": len(values),
+            "uploaded": uploaded,
+            "bytes": uploaded * _OUTPUT_LUT_FRAME.itemsize,
+            "duration": 0.0,
+            "throughput": 0.0,
+        }
+
     def set_output_lut_parameters(
         self,
         mode: int,
@@ -547,6 +1119,68 @@ class TpzSim:
             self.postcycle_rest,
         )
 
+    def invalidate_lut_cache(self) -> None:
+        self.lut_array = None
+
+    def stream_output_lut(self, values, delay_time: int = 8) -> dict:
+        n_segments = -(-len(values) // _LUT_HALF)
+        n_segments += n_segments % 2
+        self.set_output_lut_parameters(
+            2, 2 * _LUT_HALF, n_segments // 2, delay_time, 0, 0
+        )
+        return {
+            "samples": len(values),
+            "segments": n_segments,
+            "uploaded": len(values),
+            "duration": n_segments * _LUT_HALF * max(delay_time, 1) / LUT_CLOCK,
+            "underruns": 0,
+            "min_slack": None,
+        }
+
+    def fit_hysteresis_model(self, voltages, positions, num_operators: int = 8) -> dict:
+        self.hysteresis_model = HysteresisModel.fit(voltages, positions, num_operators)
+        params = self.hysteresis_model.to_dict()
+        params["residual"] = self.hysteresis_model.residual(voltages, positions)
+        return params
+
+    def get_hysteresis_model(self) -> Optional[dict]:
+        model = getattr(self, "hysteresis_model", None)
+        return None if model is None else model.to_dict()
+
+    def set_hysteresis_model(self, params: Optional[dict]) -> str:
+        if params is None:
+            self.hysteresis_model = None
+            return ""
+        self.hysteresis_model = HysteresisModel.from_dict(params)
+        return self.hysteresis_model.version
+
+    def set_output_lut_compensated(
+        self,
+        positions,
+        mode: int = 1,
+        num_cycles: int = 1,
+        delay_time: int = 1,
+        precycle_rest: int = 0,
+        postcycle_rest: int = 0,
+    ) -> dict:
+        model = self.get_hysteresis_model()
+        if model is None:
+            raise ValueError("Hysteresis model is not set")
+        voltages = self.hysteresis_model.compensate(positions)
+        clipped = np.count_nonzero((voltages < 0) | (voltages > self.voltage_limit))
+        report = self.set_output_lut_array(
+            np.clip(voltages, 0, self.voltage_limit).tolist(),
+            mode,
+            num_cycles,
+            delay_time,
+            precycle_rest,
+            postcycle_rest,
+        )
+        report["version"] = model["version"]
+        report["cached"] = False
+        report["clipped"] = int(clipped)
+        return report
+
     def start_lut_output(self) -> None:
         pass
 
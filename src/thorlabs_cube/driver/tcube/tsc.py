@@ -46,6 +46,7 @@ class Tsc(_Cube):
                 "<LLLHLLL",
                 data[2:],
             )
+            self._record_position(self.position)
 
     async def get_bay_used(self) -> int:
         """Identify which bay is being used by the controller on Thorlabs Hub
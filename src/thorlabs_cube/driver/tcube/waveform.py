@@ -0,0 +1,261 @@
+"""Waveform synthesis for the piezo controller output LUT.
+
+Waveforms are sampled over one period, without the endpoint, so that they
+loop seamlessly when the LUT is output continuously. Amplitudes are given by
+the ``low`` and ``high`` output values, in volts (or in position units in
+closed loop mode). A waveform is loaded with
+:py:meth:`Tpz.set_output_lut_array()
+<thorlabs_cube.driver.tcube.tpz.Tpz.set_output_lut_array>` after
+:py:func:`quantize`, and played at the rate given by :py:func:`delay_time`.
+"""
+
+import numpy as np
+
+from thorlabs_cube.driver.tcube.tpz import LUT_CLOCK, LUT_SIZE
+
+
+def _phase(cycle_length: int) -> np.ndarray:
+    if not 0 < cycle_length:
+        raise ValueError("Cycle length must be positive, got {}".format(cycle_length))
+    return np.arange(cycle_length) / cycle_length
+
+
+def _scale(unit, low: float, high: float) -> np.ndarray:
+    # map [0; 1] to [low; high]
+    return low + (high - low) * unit
+
+
+def sine(cycle_length: int, low: float, high: float, phase: float = 0.0) -> np.ndarray:
+    """A sine wave, starting from its middle value and rising.
+
+    :param cycle_length: Number of samples in the period.
+    :param low: Minimum output value.
+    :param high: Maximum output value.
+    :param phase: Phase offset, in fractions of the period.
+    :return: The waveform samples.
+    :rtype: numpy.ndarray
+    """
+    t = _phase(cycle_length) + phase
+    return _scale((1 + np.sin(2 * np.pi * t)) / 2, low, high)
+
+
+def triangle(
+    cycle_length: int, low: float, high: float, symmetry: float = 0.5
+) -> np.ndarray:
+    """A triangle wave, starting from ``low``.
+
+    :param cycle_length: Number of samples in the period.
+    :param low: Minimum output value.
+    :param high: Maximum output value.
+    :param symmetry: Fraction of the period spent rising, in range [0; 1].
+        0.5 gives a symmetric triangle and 1 a sawtooth.
+    :return: The waveform samples.
+    :rtype: numpy.ndarray
+    """
+    if not 0 <= symmetry <= 1:
+        raise ValueError("Symmetry must be in range [0;1], got {}".format(symmetry))
+    t = _phase(cycle_length)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        unit = np.where(t < symmetry, t / symmetry, (1 - t) / (1 - symmetry))
+    return _scale(unit, low, high)
+
+
+def sawtooth(cycle_length: int, low: float, high: float) -> np.ndarray:
+    """A ramp from ``low`` to ``high``, then back to ``low`` in one sample.
+
+    :param cycle_length: Number of samples in the period.
+    :param low: Output value at the start of the ramp.
+    :param high: Output value at the end of the ramp.
+    :return: The waveform samples.
+    :rtype: numpy.ndarray
+    """
+    if cycle_length == 1:
+        return np.array([float(low)])
+    return _scale(np.arange(cycle_length) / (cycle_length - 1), low, high)
+
+
+def raster(
+    lines: int,
+    points_per_line: int,
+    low: float,
+    high: float,
+    axis: str = "fast",
+    bidirectional: bool = True,
+) -> np.ndarray:
+    """One axis of a raster scan, ``lines * points_per_line`` samples long.
+
+    Each axis of a scanner is driven by its own controller, so a raster is
+    made of the ``fast`` axis waveform on one controller and the ``slow``
+    axis waveform on another, output with the same timing.
+
+    :param lines: Number of lines of the raster.
+    :param points_per_line: Number of samples per line.
+    :param low: Minimum output value of the axis.
+    :param high: Maximum output value of the axis.
+    :param axis: ``"fast"`` for the axis that sweeps along each line, or
+        ``"slow"`` for the axis that steps from one line to the next.
+    :param bidirectional: True to scan every other line backwards, False to
+        fly back to the start of each line.
+    :return: The waveform samples.
+    :rtype: numpy.ndarray
+    """
+    if lines <= 0 or points_per_line <= 0:
+        raise ValueError("Raster must have at least one line and one point")
+    if axis == "fast":
+        line = sawtooth(points_per_line, low, high)
+        scan = np.tile(line, (lines, 1))
+        if bidirectional:
+            scan[1::2] = line[::-1]
+    elif axis == "slow":
+        steps = sawtooth(lines, low, high)
+        scan = np.repeat(steps[:, np.newaxis], points_per_line, axis=1)
+    else:
+        raise ValueError("Raster axis must be 'fast' or 'slow', got {}".format(axis))
+    return scan.ravel()
+
+
+def chirp(
+    cycle_length: int,
+    low: float,
+    high: float,
+    start_cycles: float,
+    stop_cycles: float,
+    method: str = "linear",
+) -> np.ndarray:
+    """A sine wave whose frequency sweeps over the waveform.
+
+    Frequencies are given in cycles per waveform length, i.e. a waveform of
+    ``cycle_length`` samples at ``start_cycles`` would hold that many
+    periods.
+
+    :param cycle_length: Number of samples of the waveform.
+    :param low: Minimum output value.
+    :param high: Maximum output value.
+    :param start_cycles: Frequency at the start of the sweep.
+    :param stop_cycles: Frequency at the end of the sweep.
+    :param method: ``"linear"`` or ``"logarithmic"`` frequency sweep.
+    :return: The waveform samples.
+    :rtype: numpy.ndarray
+    """
+    t = _phase(cycle_length)
+    if method == "linear":
+        cycles = start_cycles * t + (stop_cycles - start_cycles) * t * t / 2
+    elif method == "logarithmic":
+        if start_cycles <= 0 or stop_cycles <= 0:
+            raise ValueError("Logarithmic chirp frequencies must be positive")
+        if start_cycles == stop_cycles:
+            cycles = start_cycles * t
+        else:
+            k = np.log(stop_cycles / start_cycles)
+            cycles = start_cycles * np.expm1(k * t) / k
+    else:
+        raise ValueError(
+            "Chirp method must be 'linear' or 'logarithmic', got {}".format(method)
+        )
+    return _scale((1 + np.sin(2 * np.pi * cycles)) / 2, low, high)
+
+
+def spline(values, cycle_length: int) -> np.ndarray:
+    """A smooth periodic waveform through evenly spaced control values.
+
+    The waveform is the periodic cubic spline interpolating ``values``, the
+    first of which is the output at the start of the period. It may
+    overshoot the control values between them.
+
+    :param values: Output values at evenly spaced times over the period.
+    :param cycle_length: Number of samples in the period.
+    :return: The waveform samples.
+    :rtype: numpy.ndarray
+    """
+    y = np.asarray(values, dtype=float)
+    n = len(y)
+    if y.ndim != 1 or n == 0:
+        raise ValueError("Expected a list of spline values, got {}".format(y.shape))
+    # The second derivatives m at the knots (unit spacing) solve the
+    # circulant system m[i-1] + 4 m[i] + m[i+1] = 6 (y[i-1] - 2 y[i] + y[i+1])
+    kernel = np.zeros(n)
+    kernel[0] = 4.0
+    kernel[1 % n] += 1.0
+    kernel[-1] += 1.0
+    rhs = 6 * (np.roll(y, 1) - 2 * y + np.roll(y, -1))
+    m = np.real(np.fft.ifft(np.fft.fft(rhs) / np.fft.fft(kernel)))
+    x = _phase(cycle_length) * n
+    i = np.floor(x).astype(int)
+    u = x - i
+    j = (i + 1) % n
+    return (
+        (1 - u) * y[i]
+        + u * y[j]
+        + ((1 - u) ** 3 - (1 - u)) * m[i] / 6
+        + (u**3 - u) * m[j] / 6
+    )
+
+
+def resample(values, cycle_length: int) -> np.ndarray:
+    """Resample a periodic waveform to another number of samples.
+
+    The waveform is linearly interpolated, wrapping around from its last
+    sample to its first.
+
+    :param values: The samples of one period of the waveform.
+    :param cycle_length: Number of samples of the result.
+    :return: The resampled waveform.
+    :rtype: numpy.ndarray
+    """
+    y = np.asarray(values, dtype=float)
+    if y.ndim != 1 or len(y) == 0:
+        raise ValueError("Expected a waveform, got {}".format(y.shape))
+    return np.interp(_phase(cycle_length) * len(y), np.arange(len(y)), y, period=len(y))
+
+
+def quantize(values, voltage_limit: float) -> np.ndarray:
+    """Clip a waveform to the output range and round it to the DAC steps.
+
+    The result is exactly what the controller outputs, e.g. to compare with
+    a recorded response.
+
+    :param values: The waveform samples.
+    :param voltage_limit: The output voltage limit of the controller, as set
+        by :py:meth:`Tpz.set_tpz_io_settings()
+        <thorlabs_cube.driver.tcube.tpz.Tpz.set_tpz_io_settings>`.
+    :return: The waveform, in range [0; voltage_limit].
+    :rtype: numpy.ndarray
+    """
+    counts = np.rint(np.clip(values, 0, voltage_limit) * 32767 / voltage_limit)
+    return counts * voltage_limit / 32767
+
+
+def delay_time(frequency: float, cycle_length: int) -> int:
+    """Get the LUT delay time that plays a waveform at a given frequency.
+
+    The delay time is rounded to the nearest achievable value, see
+    :py:func:`frequency` for the actual waveform frequency.
+
+    :param frequency: Target frequency of the waveform, in Hz.
+    :param cycle_length: Number of samples in the period, at most the LUT
+        size.
+    :return: The ``delay_time`` parameter of
+        :py:meth:`Tpz.set_output_lut_parameters()
+        <thorlabs_cube.driver.tcube.tpz.Tpz.set_output_lut_parameters>`.
+    :rtype: int
+    """
+    if frequency <= 0:
+        raise ValueError("Frequency must be positive, got {}".format(frequency))
+    if not 0 < cycle_length <= LUT_SIZE:
+        raise ValueError(
+            "Cycle length must be in range [1;{}], got {}".format(
+                LUT_SIZE, cycle_length
+            )
+        )
+    return max(int(round(LUT_CLOCK / (frequency * cycle_length))), 1)
+
+
+def frequency(cycle_length: int, delay_time: int) -> float:
+    """Get the frequency a waveform is played at.
+
+    :param cycle_length: Number of samples in the period.
+    :param delay_time: Interval between samples, in LUT clock periods.
+    :return: The waveform frequency, in Hz.
+    :rtype: float
+    """
+    return LUT_CLOCK / (cycle_length * max(delay_time, 1))
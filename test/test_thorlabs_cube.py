@@ -1,9 +1,48 @@
+import asyncio
+import json
+import os
+import struct as st
 import sys
-import time
+import tempfile
 import unittest
+from unittest import mock
 
+import numpy as np
 from sipyco.test.generic_rpc import GenericRPCCase
 
+from thorlabs_cube.driver import base
+from thorlabs_cube.driver.align import AlignmentLoop
+from thorlabs_cube.driver.capture import decode_status_frames, index_frames
+from thorlabs_cube.driver.filters import (
+    CICDecimator,
+    FilterBank,
+    FilterChain,
+    FirstOrderIIR,
+    MovingAverage,
+)
+from thorlabs_cube.driver.group import MotorGroup
+from thorlabs_cube.driver.message import MGMSG, Message
+from thorlabs_cube.driver.profile import distance_travelled, move_time, vector_profile
+from thorlabs_cube.driver.quad import (
+    READING_DTYPE,
+    ReadingBuffer,
+    beam_statistics,
+    trigger_thresholds,
+)
+from thorlabs_cube.driver.scan import PositionTriggerScan, interpolate_positions
+from thorlabs_cube.driver.stability import (
+    AllanDeviation,
+    StabilityAnalysis,
+    WelchPSD,
+)
+from thorlabs_cube.driver.stream import SetpointStream
+from thorlabs_cube.driver.tcube import waveform
+from thorlabs_cube.driver.tcube.hysteresis import HysteresisModel, play_operators
+from thorlabs_cube.driver.tcube.tdc import Tdc
+from thorlabs_cube.driver.tcube.tpa import Tpa
+from thorlabs_cube.driver.tcube.tpz import Tpz
+from thorlabs_cube.driver.tcube.tsc import Tsc
+
 _RESERVED: int = 0x0
 
 
@@ -79,6 +118,54 @@ class GenericTdcTest:
         self.cont.set_button_parameters(*test_vector)
         self.assertEqual(test_vector, self.cont.get_button_parameters())
 
+    def test_start_move(self):
+        handles = [
+            self.cont.start_move_absolute(1000),
+            self.cont.start_move_relative(-500),
+            self.cont.start_move_jog(1),
+        ]
+        for handle in handles:
+            self.assertEqual("completed", self.cont.move_status(handle))
+            self.assertEqual("completed", self.cont.wait_move(handle, 1.0))
+        self.assertEqual("homed", self.cont.wait_move(self.cont.start_move_home()))
+
+    def test_move_queue(self):
+        test_vector = [100, 200, -300]
+        steps = self.cont.run_move_queue(test_vector, [0.0, 0.1, 0.0])
+        self.assertEqual(test_vector, [step["position"] for step in steps])
+        self.assertEqual(-300, self.cont.get_move_absolute_parameters())
+
+    def test_fly_scan(self):
+        samples = self.cont.fly_scan(0, 1000)
+        self.assertEqual(len(samples["time"]), len(samples["position"]))
+        self.assertEqual(1000, samples["position"][-1])
+
+    def test_position_estimate(self):
+        self.cont.set_velocity_parameters(100, 1000)
+        self.cont.set_position_counter(42)
+        estimate = self.cont.get_position_estimate()
+        self.assertEqual(42.0, estimate["position"])
+        self.assertEqual(0.0, estimate["uncertainty"])
+
+    def test_velocity_stream(self):
+        self.cont.start_velocity_stream(20, 1.0)
+        for velocity in (100, -100, 0):
+            self.cont.set_velocity_setpoint(velocity)
+        self.assertEqual(3, self.cont.stop_velocity_stream()["received"])
+
+    def test_wait_until_stopped(self):
+        self.cont.move_absolute(100)
+        self.assertEqual(0, self.cont.wait_until_stopped(1.0) & 0x2F0)
+
+    def test_estimate_move_time(self):
+        self.cont.set_velocity_parameters(100, 1000)
+        self.cont.set_position_counter(50)
+        self.cont.get_position_counter()
+        self.assertAlmostEqual(2.0, self.cont.estimate_move_time(150))
+        self.assertEqual(
+            [0.0, 2.0], self.cont.estimate_move_time([0, 100], relative=True)
+        )
+
 class GenericKdcTest:
 
     def test_mmi_params(self):
@@ -96,6 +183,40 @@ class GenericKdcTest:
         self.cont.set_position_trigger_parameters(*test_vector)
         self.assertEqual(test_vector, self.cont.get_position_trigger_parameters())
 
+    def test_position_scan(self):
+        self.assertEqual([100, 80, 60], self.cont.position_scan(100, 50, 20, port=2))
+        self.assertEqual(
+            (0, 0, 0, 100, 20, 3, 100, 1), self.cont.get_position_trigger_parameters()
+        )
+        self.assertEqual(0x0E, self.cont.get_trigger_io_config()[2])
+
+
+class GenericMotorGroupTest:
+    def test_home(self):
+        for state in self.cont.home([[0, 1]]):
+            self.assertIn(state, ("homed", "skipped"))
+
+    def test_move_absolute(self):
+        test_vector = [1000, -2000]
+        report = self.cont.move_absolute(test_vector)
+        self.assertEqual(["completed", "completed"], report["end"])
+        self.assertGreaterEqual(report["skew"], 0.0)
+
+    def test_start_move_absolute(self):
+        handle = self.cont.start_move_absolute([10, 20])
+        self.assertEqual(self.cont.move_status(handle), self.cont.wait_move(handle))
+
+    def test_move_vector(self):
+        test_vector = [(1000, 500), (2000, 400)]
+        self.cont.set_velocity_limits(test_vector)
+        self.assertEqual(test_vector, self.cont.get_velocity_limits())
+        report = self.cont.move_vector([500, 100])
+        self.assertEqual(2, len(report["predicted"]))
+
+    def test_wrong_axis_count(self):
+        with self.assertRaises(Exception):
+            self.cont.move_absolute([1, 2, 3])
+
 
 class GenericTpzTest:
     def test_position_control_mode(self):
@@ -107,8 +228,7 @@ class GenericTpzTest:
         for voltage in 5.0, 10.0, 15.0, round(self.cont.get_tpz_io_settings()[0]):
             with self.subTest(voltage=voltage):
                 test_vector = voltage
-                self.cont.set_output_volts(test_vector)
-                time.sleep(1)  # Wait for the output voltage to converge
+                self.cont.set_output_volts_and_settle(test_vector, 0.03, 1.0)
                 self.assertAlmostEqual(
                     test_vector, self.cont.get_output_volts(), delta=0.03
                 )
@@ -118,6 +238,23 @@ class GenericTpzTest:
         self.cont.set_output_position(test_vector)
         self.assertEqual(test_vector, self.cont.get_output_position())
 
+    def test_output_stream(self):
+        self.cont.set_tpz_io_settings(150, 1)
+        self.assertGreater(self.cont.start_output_stream("volts", 100.0), 0)
+        for voltage in 5.0, 10.0, 15.0:
+            self.cont.set_output_setpoint(voltage)
+        with self.assertRaises(Exception):
+            self.cont.set_output_setpoint(200.0)
+        report = self.cont.stop_output_stream()
+        self.assertEqual(3, report["received"])
+        self.assertEqual(3, report["sent"] + report["coalesced"] + report["dropped"])
+        self.assertAlmostEqual(15.0, self.cont.get_output_volts(), delta=0.03)
+
+    def test_output_position_and_settle(self):
+        report = self.cont.set_output_position_and_settle(31000, 10, 1.0)
+        self.assertAlmostEqual(31000, report["value"], delta=10)
+        self.assertLessEqual(report["settle_time"], 1.0)
+
     def test_input_volts_source(self):
         for i in range(3):
             test_vector = i
@@ -144,6 +281,41 @@ class GenericTpzTest:
                 self.cont.set_tpz_io_settings(*test_vector)
                 self.assertEqual(test_vector, self.cont.get_tpz_io_settings())
 
+    def test_output_lut_array(self):
+        self.cont.set_tpz_io_settings(150, 1)
+        report = self.cont.set_output_lut_array([0.0, 75.0, 150.0], 2, 3)
+        self.assertEqual(3, report["samples"])
+        self.assertEqual((2, 3, 3, 1, 0, 0), self.cont.get_output_lut_parameters())
+
+    def test_output_lut_cache(self):
+        self.cont.set_tpz_io_settings(150, 1)
+        self.cont.invalidate_lut_cache()
+        waveform = [10.0, 20.0, 30.0, 40.0]
+        self.assertEqual(4, self.cont.set_output_lut_array(waveform)["uploaded"])
+        self.assertEqual(0, self.cont.set_output_lut_array(waveform)["uploaded"])
+        waveform[2] = 35.0
+        self.assertEqual(1, self.cont.set_output_lut_array(waveform)["uploaded"])
+
+    def test_stream_output_lut(self):
+        self.cont.set_tpz_io_settings(150, 1)
+        report = self.cont.stream_output_lut([75.0] * 1000, 8)
+        self.assertEqual(1000, report["samples"])
+        self.assertEqual(4, report["segments"])
+        self.assertEqual(0, report["underruns"])
+        self.assertEqual((2, 512, 2, 8, 0, 0), self.cont.get_output_lut_parameters())
+
+    def test_output_lut_compensated(self):
+        self.cont.set_tpz_io_settings(150, 1)
+        voltages = list(range(0, 151, 10)) + list(range(140, -1, -10))
+        positions = [v / 10 for v in voltages]
+        params = self.cont.fit_hysteresis_model(voltages, positions, 4)
+        self.assertLess(params["residual"], 1e-6)
+        self.assertEqual(params["version"], self.cont.set_hysteresis_model(params))
+        report = self.cont.set_output_lut_compensated([1.0, 5.0, 10.0])
+        self.assertEqual(params["version"], report["version"])
+        self.assertEqual(0, report["clipped"])
+        self.assertEqual(3, self.cont.get_output_lut_parameters()[1])
+
 class GenericKpzTest:
     def test_kcubemmi_params(self):
         test_vector = (1, 2, 3, 4, 5, 6, 7, 8, 9)
@@ -203,6 +375,55 @@ class GenericTpaTest:
         self.cont.set_quad_loop_params2(*test_vector)
         self.assertEqual(test_vector, self.cont.get_quad_loop_params2())
 
+    def test_beam_statistics(self):
+        self.cont.set_reading_buffer_size(100)
+        stats = self.cont.get_beam_statistics()
+        self.assertEqual(1, stats["samples"])
+        for field in "x_diff", "y_diff", "sum_val", "x_pos", "y_pos":
+            self.assertEqual(0.0, stats[field]["ptp"])
+        self.assertEqual(2, self.cont.get_beam_statistics(duration=10.0)["samples"])
+        self.cont.clear_readings()
+        self.assertEqual(1, self.cont.get_beam_statistics(5)["samples"])
+
+    def test_stability_analysis(self):
+        with self.assertRaises(Exception):
+            self.cont.get_stability()
+        self.cont.start_stability_analysis(8, 64)
+        report = self.cont.get_stability()
+        self.assertEqual(len(report["allan"]["tau"]), len(report["allan"]["x"]))
+        report = self.cont.stop_stability_analysis()
+        self.assertIn("psd", report)
+
+    def test_filter_chains(self):
+        stages = [{"type": "cic", "factor": 10, "order": 2}, {"type": "iir", "alpha": 0.5}]
+        factor = self.cont.add_filter_chain("slow", stages)
+        self.assertEqual(10, factor)
+        self.cont.add_filter_chain("smooth", [{"type": "moving_average", "length": 4}])
+        self.assertEqual(10, self.cont.get_filter_chains()["slow"]["decimation"])
+        self.assertEqual(1, len(self.cont.get_filtered("smooth")["x_diff"]))
+        with self.assertRaises(Exception):
+            self.cont.add_filter_chain("bad", [{"type": "fir"}])
+        self.cont.remove_filter_chain("slow")
+        self.cont.remove_filter_chain("smooth")
+        self.assertEqual({}, self.cont.get_filter_chains())
+
+    def test_trajectory(self):
+        x_positions = [0, 1000, -1000, 32767]
+        y_positions = [0, -32768, 500, 200]
+        duration = self.cont.start_trajectory(x_positions, y_positions, 400.0, 2)
+        self.assertAlmostEqual(0.02, duration)
+        stats = self.cont.wait_trajectory()
+        self.assertEqual(8, stats["sent"])
+        self.assertIsNone(stats["failure"])
+        self.assertEqual((32767, 200), tuple(self.cont.get_quad_position_outputs()))
+        self.cont.start_trajectory(x_positions, y_positions, 400.0, 0)
+        with self.assertRaises(Exception):
+            self.cont.wait_trajectory()
+        self.assertFalse(self.cont.stop_trajectory()["running"])
+        with self.assertRaises(Exception):
+            self.cont.start_trajectory([40000], [0], 400.0)
+
+
 class GenericKpaTest(GenericTpaTest):
 
     def test_trigger_config(self):
@@ -215,6 +436,34 @@ class GenericKpaTest(GenericTpaTest):
         self.cont.set_digital_outputs(test_vector)
         self.assertEqual(test_vector, self.cont.get_digital_outputs())
 
+    def test_calibrate_trigger(self):
+        self.cont.set_trigger_config(1, 0, 100, 200, 50, 2, 1, 150, 250, 75)
+        result = self.cont.calibrate_trigger(0.1, 0.01, apply=False)
+        self.assertFalse(result["applied"])
+        self.assertEqual((100, 200, 50), self.cont.get_trigger_config()[2:5])
+        result = self.cont.calibrate_trigger(0.1, 0.01)
+        thresholds = result["sum_min"], result["sum_max"], result["diff_threshold"]
+        config = self.cont.get_trigger_config()
+        self.assertEqual((1, 0) + thresholds + (2, 1) + thresholds, config)
+
+
+class GenericAlignmentLoopTest:
+    def test_start_stop(self):
+        self.cont.set_gains([1.0, -1.0], [10.0, 0.0])
+        self.cont.set_setpoint(0.1, 0.0)
+        self.cont.start(500.0, 10)
+        self.assertTrue(self.cont.get_stats()["running"])
+        with self.assertRaises(Exception):
+            self.cont.start()
+        stats = self.cont.stop()
+        self.assertFalse(stats["running"])
+        self.assertIsNone(stats["failure"])
+
+    def test_wrong_gain_count(self):
+        with self.assertRaises(Exception):
+            self.cont.set_gains([1.0], [1.0])
+
+
 class GenericTscTest:
     def test_absolute_position(self):
         test_position = 100000
@@ -316,6 +565,647 @@ class GenericKscTest(GenericTscTest):
         self.cont.set_kcubepostrig_params(*test_vector)
         self.assertEqual(test_vector, self.cont.get_kcubepostrig_params())
 
+    def test_position_scan(self):
+        self.assertEqual([1000, 1500, 2000], self.cont.position_scan(1000, 2000, 500))
+        self.assertEqual(
+            (1000, 500, 3, 0, 0, 0, 100, 1), self.cont.get_kcubepostrig_params()
+        )
+
+    def test_fly_scan(self):
+        samples = self.cont.fly_scan(0, 1000)
+        self.assertEqual([0, 1000], samples["position"])
+
+
+class TestCapture(unittest.TestCase):
+    def test_decode_dc_status(self):
+        frames = []
+        for i in range(100):
+            payload = st.pack("<HLHHL", 1, i, 2 * i, 0, 0x400)
+            frames.append(Message(MGMSG.MOT_GET_DCSTATUSUPDATE, data=payload).pack())
+            if i % 10 == 0:
+                frames.append(Message(MGMSG.HW_GET_INFO, 1, 2).pack())
+        capture = b"".join(frames) + b"\x91\x04\x0e"  # truncated last frame
+        self.assertEqual(110, len(index_frames(capture)))
+        status = decode_status_frames(capture, MGMSG.MOT_GET_DCSTATUSUPDATE)
+        self.assertEqual(list(range(100)), status["position"].tolist())
+        self.assertEqual(list(range(0, 200, 2)), status["velocity"].tolist())
+
+    def test_index_frames(self):
+        frames = []
+        for i in range(200):
+            # positions whose bytes hold known message IDs
+            payload = st.pack("<HlHHL", 1, 0x0464 - 0x91 * i, 0x0466, 0, 0x0491)
+            frames.append(Message(MGMSG.MOT_GET_DCSTATUSUPDATE, data=payload).pack())
+            if i % 26 == 25:
+                frames.append(Message(MGMSG.HW_GET_INFO, 0x91, 0x04).pack())
+        offsets = np.cumsum([0] + [len(frame) for frame in frames[:-1]])
+        capture = b"".join(frames)
+        index = index_frames(capture + b"\x91\x04\x0e\x00\x81")
+        self.assertEqual(offsets.tolist(), index["offset"].tolist())
+        status = decode_status_frames(capture, MGMSG.MOT_GET_DCSTATUSUPDATE)
+        positions = [0x0464 - 0x91 * i for i in range(200)]
+        self.assertEqual(positions, status["position"].tolist())
+        # frames of unknown type are still indexed
+        unknown = st.pack("<HHBB", 0xFFFF, 2, 0x81, 0x50) + b"\x00\x00"
+        index = index_frames(frames[0] + unknown + frames[1])
+        self.assertEqual([0, 20, 28], index["offset"].tolist())
+
+    def test_index_unknown_frames(self):
+        unknown = st.pack("<HHBB", 0xFFFF, 2, 0x81, 0x50) + b"\x91\x04"
+        frames = []
+        for i in range(3000):
+            payload = st.pack("<HlHHL", 1, 0x0464 - 0x91 * i, 0x0466, 0, 0x0491)
+            frames.append(Message(MGMSG.MOT_GET_DCSTATUSUPDATE, data=payload).pack())
+            if i % 26 == 25:
+                frames.append(Message(MGMSG.HW_GET_INFO, 0x91, 0x04).pack())
+            if i in (10, 1000, 1001):
+                frames.append(unknown)
+            if i == 2000:
+                frames += [unknown, unknown]
+        frames.append(unknown)
+        offsets = np.cumsum([0] + [len(frame) for frame in frames[:-1]])
+        index = index_frames(b"".join(frames) + b"\x91\x04\x0e\x00\x81")
+        self.assertEqual(offsets.tolist(), index["offset"].tolist())
+
+    def test_decode_quad_status(self):
+        payload = st.pack("<HHHhhIhhI", 3, 0, 0, -5, 6, 700, -8, 9, 0x11)
+        capture = Message(MGMSG.QUAD_GET_STATUSUPDATE, data=payload).pack() * 3
+        status = decode_status_frames(capture, MGMSG.QUAD_GET_STATUSUPDATE)
+        self.assertEqual([(-5, 6, 700, -8, 9, 0x11)] * 3, status.tolist())
+
+
+class TestProfile(unittest.TestCase):
+    def test_move_time(self):
+        # triangular, then trapezoidal profile
+        self.assertAlmostEqual(2.0, move_time(100, 100, 1000))
+        self.assertAlmostEqual(10.1, move_time(-100, 100, 10))
+        self.assertEqual([0.0, 1.1], move_time([0, 10], 100, 10).tolist())
+
+    def test_distance_travelled(self):
+        self.assertEqual(
+            [0.0, 12.5, 50.0, 100.0, 100.0],
+            distance_travelled([0, 0.5, 1, 2, 3], 100, 0, 100, 1000).tolist(),
+        )
+        # braking, then cruising or accelerating towards an unknown target
+        self.assertAlmostEqual(0.5, distance_travelled(1, 0.5, 10, 100, 10))
+        self.assertAlmostEqual(10.0, distance_travelled(1, np.inf, 10, 100, 10))
+        self.assertAlmostEqual(
+            9.5, distance_travelled(1, 1000, 0, 100, 10, brake=False)
+        )
+
+    def test_vector_profile(self):
+        accelerations, velocities, duration = vector_profile(
+            [100, -50, 0], 100, [10, 20, 30]
+        )
+        self.assertEqual([100.0, 50.0, 0.0], accelerations.tolist())
+        self.assertEqual([10.0, 5.0, 0.0], velocities.tolist())
+        self.assertAlmostEqual(duration, move_time(50, 50, 5))
+
+
+class TestScan(unittest.TestCase):
+    def test_position_trigger_scan(self):
+        scan = PositionTriggerScan(0, 95, 10)
+        self.assertEqual(list(range(0, 91, 10)), scan.positions.tolist())
+        self.assertEqual((-5, 95), (scan.move_from, scan.move_to))
+        self.assertEqual((0, 10, 10, 0, 0, 0, 100, 1), scan.trigger_parameters)
+        self.assertEqual((3, 1, 0x0D, 2), scan.trigger_io_config((3, 1, 4, 1), 2, 2))
+        with self.assertRaises(ValueError):
+            PositionTriggerScan(0, 100, 0)
+
+    def test_interpolate_positions(self):
+        positions = interpolate_positions([0.5, 1.5, 2.0, 3.0], [0, 1, 2], [0, 100, 300])
+        self.assertEqual([50.0, 200.0, 300.0], positions[:3].tolist())
+        self.assertTrue(np.isnan(positions[3]))
+        self.assertEqual(150.0, interpolate_positions(1.25, [1, 2], [100, 300]))
+
+
+class TestWaveform(unittest.TestCase):
+    def test_shapes(self):
+        np.testing.assert_allclose([5, 10, 5, 0], waveform.sine(4, 0, 10))
+        np.testing.assert_allclose([0, 5, 10, 5], waveform.triangle(4, 0, 10))
+        np.testing.assert_allclose([0, 5, 10], waveform.sawtooth(3, 0, 10))
+        np.testing.assert_allclose(
+            [0, 1, 2, 2, 1, 0], waveform.raster(2, 3, 0, 2, axis="fast")
+        )
+        np.testing.assert_allclose(
+            [0, 0, 0, 2, 2, 2], waveform.raster(2, 3, 0, 2, axis="slow")
+        )
+        np.testing.assert_allclose(
+            waveform.sine(64, 0, 1), waveform.chirp(64, 0, 1, 1, 1), atol=1e-12
+        )
+
+    def test_spline(self):
+        knots = [0.0, 1.0, 0.0, -1.0]
+        samples = waveform.spline(knots, 16)
+        np.testing.assert_allclose(knots, samples[::4], atol=1e-12)
+        np.testing.assert_allclose([0, 5, 10, 5], waveform.resample([0, 10], 4))
+
+    def test_quantize_and_timing(self):
+        np.testing.assert_allclose([0, 150], waveform.quantize([-1, 200], 150))
+        self.assertEqual(70, waveform.delay_time(1, 100))
+        self.assertEqual(1, waveform.delay_time(1e6, 100))
+        self.assertEqual(1.0, waveform.frequency(100, 70))
+
+
+class TestQuad(unittest.TestCase):
+    def test_reading_buffer(self):
+        buffer = ReadingBuffer(4)
+        for i in range(6):
+            buffer.append((i, -i, 100, 0, 0, 0), float(i))
+        self.assertEqual(4, len(buffer))
+        self.assertEqual([2, 3, 4, 5], buffer.latest()["x_diff"].tolist())
+        self.assertEqual([4, 5], buffer.latest(duration=1.5)["x_diff"].tolist())
+        self.assertEqual([5], buffer.latest(1)["x_diff"].tolist())
+
+    def test_beam_statistics(self):
+        buffer = ReadingBuffer(10)
+        for i, x_diff in enumerate([10, 30, 20, 20]):
+            buffer.append((x_diff, 0, 100 if i else 0, 0, 0, 0), 0.1 * i)
+        stats = beam_statistics(buffer.latest())
+        self.assertEqual(4, stats["samples"])
+        self.assertAlmostEqual(0.3, stats["duration"])
+        self.assertEqual(20.0, stats["x_diff"]["ptp"])
+        self.assertAlmostEqual(np.sqrt(50), stats["x_diff"]["rms"])
+        # the reading without sum signal is not part of the centroid
+        self.assertAlmostEqual(0.7 / 3, stats["x_centroid"]["mean"])
+        with self.assertRaises(ValueError):
+            beam_statistics(ReadingBuffer().latest())
+
+    def test_trigger_thresholds(self):
+        rng = np.random.default_rng(0)
+        readings = np.zeros(20000, dtype=READING_DTYPE)
+        readings["time"] = np.arange(20000) * 1e-3
+        readings["x_diff"] = rng.normal(0, 100, 20000)
+        readings["y_diff"] = rng.normal(0, 50, 20000)
+        readings["sum_val"] = rng.normal(20000, 300, 20000)
+        result = trigger_thresholds(readings, 0.01, bins=32)
+        # 0.25% on each side of a normal distribution
+        self.assertAlmostEqual(20000 - 2.81 * 300, result["sum_min"], delta=30)
+        self.assertAlmostEqual(20000 + 2.81 * 300, result["sum_max"], delta=30)
+        self.assertAlmostEqual(0.01, result["false_fraction"], delta=0.001)
+        self.assertAlmostEqual(1000.0, result["update_rate"], delta=0.1)
+        self.assertEqual(20000, sum(result["sum_histogram"]["counts"]))
+        self.assertEqual(33, len(result["diff_histogram"]["edges"]))
+        with self.assertRaises(ValueError):
+            trigger_thresholds(readings, 0)
+
+
+class TestFilters(unittest.TestCase):
+    def setUp(self):
+        self.values = np.random.default_rng(0).normal(size=(500, 5))
+        self.times = np.arange(500.0)
+
+    def process(self, stage):
+        # blocks of uneven sizes must give the same result as a single one
+        values, times = [], []
+        for start, stop in [(0, 1), (1, 8), (8, 8), (8, 300), (300, 500)]:
+            out, t = stage.process(self.values[start:stop], self.times[start:stop])
+            values.append(out)
+            times.append(t)
+        return np.concatenate(values), np.concatenate(times)
+
+    def test_moving_average(self):
+        values, times = self.process(MovingAverage(4))
+        padded = np.concatenate((np.repeat(self.values[:1], 3, axis=0), self.values))
+        expected = (padded[3:] + padded[2:-1] + padded[1:-2] + padded[:-3]) / 4
+        np.testing.assert_allclose(expected, values)
+        np.testing.assert_array_equal(self.times, times)
+
+    def test_cic_decimator(self):
+        values, times = self.process(CICDecimator(10, 2))
+        kernel = np.convolve(np.ones(10), np.ones(10)) / 100
+        padded = np.concatenate((np.repeat(self.values[:1], 18, axis=0), self.values))
+        expected = np.array([kernel @ padded[i : i + 19] for i in range(9, 500, 10)])
+        np.testing.assert_allclose(expected, values)
+        np.testing.assert_array_equal(self.times[9::10], times)
+
+    def test_first_order_iir(self):
+        values, _ = self.process(FirstOrderIIR(0.05))
+        expected = np.empty_like(self.values)
+        y = self.values[0]
+        for i, x in enumerate(self.values):
+            y = y + 0.05 * (x - y)
+            expected[i] = y
+        np.testing.assert_allclose(expected, values)
+
+    def test_filter_bank(self):
+        bank = FilterBank(block_size=16)
+        bank.add("slow", FilterChain([CICDecimator(10)], size=5))
+        bank.add("fast", FilterChain([]))
+        for i in range(100):
+            bank.append((i, -i, 1000, 0, 0, 0), float(i))
+        slow = bank.latest("slow")
+        self.assertEqual([54.5, 64.5, 74.5, 84.5, 94.5], slow["x_diff"])
+        self.assertEqual([59.0, 69.0, 79.0, 89.0, 99.0], slow["time"])
+        self.assertEqual([98.0, 99.0], bank.latest("fast", 2)["x_diff"])
+
+
+class TestStability(unittest.TestCase):
+    def test_allan_deviation(self):
+        samples = np.random.default_rng(0).normal(size=(1000, 1))
+        adev = AllanDeviation(4)
+        for start in range(0, 1000, 97):
+            adev.update(samples[start : start + 97])
+        factors, deviation, terms = adev.result()
+        cumulative = np.concatenate(([0.0], np.cumsum(samples[:, 0])))
+        for m, value, count in zip(factors, deviation[:, 0], terms):
+            diff = cumulative[2 * m :] - 2 * cumulative[m:-m] + cumulative[: -2 * m]
+            self.assertEqual(len(diff), count)
+            self.assertAlmostEqual(np.sqrt(np.mean((diff / m) ** 2) / 2), value)
+
+    def test_welch_psd(self):
+        # white noise of unit variance at 100 Hz has a density of 0.02 /Hz
+        samples = np.random.default_rng(0).normal(size=(20000, 1))
+        psd = WelchPSD(64)
+        psd.update(samples)
+        freqs, density = psd.result(100.0)
+        self.assertEqual(50.0, freqs[-1])
+        self.assertAlmostEqual(0.02, np.mean(density[1:-1]), delta=0.002)
+
+    def test_stability_analysis(self):
+        analysis = StabilityAnalysis(4, 16, block_size=10)
+        for i in range(100):
+            analysis.append((i % 2, 0, 0 if i == 99 else 100, 0, 0, 0), 0.01 * i)
+        report = analysis.report()
+        self.assertEqual(99, report["samples"])
+        np.testing.assert_allclose([0.02, 0.04], report["allan"]["tau"][1:3])
+        self.assertAlmostEqual(0.01 / np.sqrt(2), report["allan"]["x"][0])
+
+
+class TestHysteresis(unittest.TestCase):
+    def test_compensate(self):
+        # a piezo whose position lags behind the voltage
+        thresholds = [0.0, 10.0, 30.0]
+        weights = [0.05, 0.03, 0.02]
+        ramp = np.linspace(0, 150, 100)
+        sweep = np.concatenate([ramp, ramp[::-1], ramp, ramp[::-1]])
+        positions = play_operators(sweep, thresholds, 0.0) @ weights
+        model = HysteresisModel.fit(sweep, positions, 10)
+        target = np.concatenate([np.linspace(1, 12, 50), np.linspace(12, 1, 50)])
+        voltages = np.tile(model.compensate(target), 3)
+        reached = play_operators(voltages, thresholds, 0.0) @ weights
+        np.testing.assert_allclose(target, reached[-100:], atol=0.1)
+        self.assertEqual(
+            model.version, HysteresisModel.from_dict(model.to_dict()).version
+        )
+
+
+class TestStream(unittest.TestCase):
+    def test_latest_wins(self):
+        applied = []
+        timeouts = []
+
+        async def apply(setpoint):
+            applied.append(setpoint)
+
+        async def on_timeout():
+            timeouts.append(len(applied))
+
+        async def run():
+            stream = SetpointStream(apply, 10.0, 0.3, on_timeout)
+            for setpoint in range(10):
+                stream.update(setpoint)
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.5)
+            stream.update(10)
+            stream.update(11)
+            await stream.close()
+            with self.assertRaises(ValueError):
+                stream.update(12)
+
+        asyncio.run(run())
+        # the first setpoint goes out at once, then the latest after a period
+        self.assertEqual([0, 9, 11], applied)
+        self.assertEqual([2], timeouts)
+
+
+class _FakePort:
+    """In-memory serial port, answering each frame written with the replies
+    of a fake device."""
+
+    def __init__(self, device):
+        self.device = device
+        self.written = []
+        self._buffer = bytearray()
+        self._received = asyncio.Event()
+
+    async def write(self, data):
+        data = bytes(data)
+        while data:
+            size = 6 + (st.unpack("<H", data[2:4])[0] if data[4] & 0x80 else 0)
+            msg = Message.unpack(data[:size])
+            data = data[size:]
+            self.written.append(msg)
+            for delay, reply in self.device(msg):
+                asyncio.get_running_loop().call_later(delay, self._feed, reply)
+
+    def _feed(self, reply):
+        if callable(reply):
+            reply = reply()
+        self._buffer += reply.pack()
+        self._received.set()
+
+    async def read_exactly(self, n):
+        while len(self._buffer) < n:
+            self._received.clear()
+            await self._received.wait()
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    def close(self):
+        pass
+
+    def sent(self, msg_id):
+        return [msg for msg in self.written if msg.id == msg_id]
+
+
+class _FakeTdc:
+    """A DC servo controller whose moves take ``move_time`` seconds."""
+
+    def __init__(self, move_time=0.05):
+        self.move_time = move_time
+        self.position = 0
+        self.target = 0
+        self.moving = False
+        self.homed = False
+
+    def status_bits(self):
+        return (0x400 if self.homed else 0) | (0x10 if self.moving else 0)
+
+    def _status(self, msg_id):
+        data = st.pack("<HlHHL", 1, self.position, 0, 0, self.status_bits())
+        return Message(msg_id, data=data)
+
+    def _end_move(self, msg_id, position):
+        def reply():
+            if not self.moving:
+                return self._status(MGMSG.MOT_GET_DCSTATUSUPDATE)
+            self.moving = False
+            self.position = position
+            self.homed |= msg_id == MGMSG.MOT_MOVE_HOMED
+            return self._status(msg_id)
+
+        return reply
+
+    def __call__(self, msg):
+        if msg.id == MGMSG.MOT_SET_MOVEABSPARAMS:
+            self.target = st.unpack("<l", msg.data[2:6])[0]
+        elif msg.id in (MGMSG.MOT_MOVE_ABSOLUTE, MGMSG.MOT_MOVE_HOME):
+            if msg.data is not None:
+                self.target = st.unpack("<l", msg.data[2:6])[0]
+            self.moving = True
+            if msg.id == MGMSG.MOT_MOVE_HOME:
+                end = self._end_move(MGMSG.MOT_MOVE_HOMED, 0)
+            else:
+                end = self._end_move(MGMSG.MOT_MOVE_COMPLETED, self.target)
+            return [(self.move_time, end)]
+        elif msg.id == MGMSG.MOT_MOVE_VELOCITY:
+            self.moving = True
+        elif msg.id == MGMSG.MOT_MOVE_STOP:
+            if msg.param2 == 2 and self.moving:
+                # profiled stops take as long as a move
+                end = self._end_move(MGMSG.MOT_MOVE_STOPPED, self.position)
+                return [(self.move_time, end)]
+            self.moving = False
+            return [(0, self._status(MGMSG.MOT_MOVE_STOPPED))]
+        elif msg.id == MGMSG.MOT_REQ_POSCOUNTER:
+            data = st.pack("<Hl", 1, self.position)
+            return [(0, Message(MGMSG.MOT_GET_POSCOUNTER, data=data))]
+        elif msg.id == MGMSG.MOT_REQ_STATUSBITS:
+            data = st.pack("<HL", 1, self.status_bits())
+            return [(0, Message(MGMSG.MOT_GET_STATUSBITS, data=data))]
+        return []
+
+
+class _FakeTpz:
+    """A piezo controller in open loop, with a 150 V limit."""
+
+    def __init__(self, volts=50.0):
+        self.volts = volts
+
+    def __call__(self, msg):
+        if msg.id == MGMSG.PZ_SET_OUTPUTVOLTS:
+            self.volts = st.unpack("<H", msg.data[2:4])[0] * 150 / 32767
+        elif msg.id == MGMSG.PZ_REQ_OUTPUTVOLTS:
+            data = st.pack("<HH", 1, int(self.volts * 32767 / 150))
+            return [(0, Message(MGMSG.PZ_GET_OUTPUTVOLTS, data=data))]
+        return []
+
+
+def _quad_status(x_diff, y_diff, sum_val):
+    data = st.pack("<HHHhhIhhI", 3, 0, 0, x_diff, y_diff, sum_val, 0, 0, 0)
+    return Message(MGMSG.QUAD_GET_STATUSUPDATE, data=data)
+
+
+def _open(driver, *ports):
+    """Create a driver talking to fake ports, one per device."""
+    with mock.patch.object(base.asyncserial, "AsyncSerial", side_effect=ports):
+        return driver(*("/dev/fake{}".format(i) for i in range(len(ports))))
+
+
+class TestFakePort(unittest.TestCase):
+    def test_motor_group_home(self):
+        devices = [_FakeTdc(), _FakeTdc()]
+        devices[1].position = 500
+        ports = [_FakePort(device) for device in devices]
+        with tempfile.TemporaryDirectory() as directory:
+            state_file = os.path.join(directory, "homed.json")
+
+            async def run():
+                axes = [_open(Tdc, port) for port in ports]
+                group = MotorGroup(axes, ["x", "y"], state_file)
+                self.assertEqual(["homed", "homed"], await group.home([[0, 1]]))
+                await group.move_absolute([1000, 2000])
+                await group.move_absolute([1000, 3000])
+                group.close()
+                with open(state_file) as f:
+                    self.assertEqual({"x": 1000, "y": 3000}, json.load(f))
+                # a power cycle clears the homed bit and the position counter
+                devices[1].homed = False
+                devices[1].position = 0
+                group = MotorGroup(axes, ["x", "y"], state_file)
+                await group.move_absolute([1000, 777])
+                group.close()
+                with open(state_file) as f:
+                    self.assertEqual({"x": 1000}, json.load(f))
+                # without the homed bit, the recorded counter proves the axis
+                # kept its home
+                devices[0].homed = False
+                group = MotorGroup(axes, ["x", "y"], state_file)
+                self.assertEqual(["skipped", "homed"], await group.home())
+
+            asyncio.run(run())
+        self.assertEqual(
+            [1, 2], [len(port.sent(MGMSG.MOT_MOVE_HOME)) for port in ports]
+        )
+
+    def test_move_queue(self):
+        port = _FakePort(_FakeTdc())
+
+        async def run():
+            tdc = _open(Tdc, port)
+            steps = await tdc.run_move_queue([100, 200, 300], [0.0, 0.01, 0.0])
+            tdc.close()
+            return steps
+
+        steps = asyncio.run(run())
+        self.assertEqual([100, 200, 300], [step["position"] for step in steps])
+        self.assertEqual(["completed"] * 3, [step["end"] for step in steps])
+        # each next target is loaded while the previous move runs
+        self.assertEqual(
+            [MGMSG.MOT_SET_MOVEABSPARAMS, MGMSG.MOT_MOVE_ABSOLUTE] * 3,
+            [msg.id for msg in port.written],
+        )
+
+    def test_alignment_loop(self):
+        detector = _FakePort(lambda msg: [])
+        devices = [_FakeTpz(), _FakeTpz()]
+        ports = [_FakePort(device) for device in devices]
+
+        async def run():
+            tpa = _open(Tpa, detector)
+            piezos = [_open(Tpz, port) for port in ports]
+            for piezo in piezos:
+                await piezo.set_tpz_io_settings(150, 1)
+            loop = AlignmentLoop(tpa, piezos, ["x", "y"])
+            loop.set_gains([10.0, 10.0], [0.0, 0.0])
+            await loop.start()
+            detector._feed(_quad_status(100, -200, 1000))
+            await asyncio.sleep(0.05)
+            self.assertAlmostEqual(49.0, devices[0].volts, delta=0.01)
+            self.assertAlmostEqual(52.0, devices[1].volts, delta=0.01)
+            # a failed loop can be started again
+            piezos[0].voltage_limit = None
+            with self.assertLogs("thorlabs_cube.driver.align", "ERROR"):
+                detector._feed(_quad_status(0, 0, 1000))
+                await asyncio.sleep(0.05)
+            stats = loop.get_stats()
+            self.assertFalse(stats["running"])
+            self.assertIsNotNone(stats["failure"])
+            piezos[0].voltage_limit = 150
+            await loop.start()
+            detector._feed(_quad_status(0, 0, 1000))
+            await asyncio.sleep(0.05)
+            stats = await loop.stop()
+            self.assertEqual(1, stats["iterations"])
+            self.assertIsNone(stats["failure"])
+            loop.close()
+            tpa.close()
+
+        asyncio.run(run())
+        # restarted from the current outputs
+        self.assertAlmostEqual(49.0, devices[0].volts, delta=0.01)
+
+    def test_move_home(self):
+        device = _FakeTdc(move_time=0.3)
+        device.position = 10
+
+        async def run():
+            tdc = _open(Tdc, _FakePort(device))
+            await tdc.get_position_counter()
+            # the estimate from the position counter is far too short
+            tdc.velocity_parameters = (100000, 100000)
+            tdc.home_velocity = 100000
+            self.assertLess(tdc.estimate_home_time() * 2, 0.3)
+            with mock.patch("thorlabs_cube.driver.tcube.tdc._MOVE_TIMEOUT_MARGIN", 0):
+                handle = await tdc.start_move_home()
+                self.assertEqual("homed", await tdc.wait_move(handle))
+                # only the moves waited for explicitly time out
+                await tdc.move_absolute(10)
+                handle = await tdc.start_move_absolute(20)
+                with self.assertRaises(asyncio.TimeoutError):
+                    await tdc.wait_move(handle)
+                self.assertEqual("completed", await tdc.wait_move(handle, 1.0))
+            tdc.close()
+
+        asyncio.run(run())
+        self.assertEqual(20, device.position)
+
+    def test_move_stop(self):
+        port = _FakePort(_FakeTdc())
+
+        async def run():
+            tdc = _open(Tdc, port)
+            await tdc.move_absolute(1000)
+            self.assertFalse(tdc.moving)
+            await tdc.move_velocity(1)
+            self.assertTrue(tdc.moving)
+            await tdc.move_stop(2)
+            self.assertFalse(tdc.moving)
+            # sent even when the motor is believed to be stopped
+            await tdc.move_stop(1)
+            tdc.close()
+
+        asyncio.run(run())
+        stops = port.sent(MGMSG.MOT_MOVE_STOP)
+        self.assertEqual([2, 1], [msg.param2 for msg in stops])
+        # the status is only asked once the stop is sent
+        ids = [msg.id for msg in port.written]
+        start = ids.index(MGMSG.MOT_MOVE_VELOCITY)
+        self.assertEqual(MGMSG.MOT_MOVE_STOP, ids[start + 1])
+
+    def test_velocity_stream_failure(self):
+        device = _FakeTdc()
+
+        def failing_device(msg):
+            if msg.id == MGMSG.MOT_MOVE_VELOCITY and msg.param2 == 2:
+                raise OSError("write failed")
+            return device(msg)
+
+        port = _FakePort(failing_device)
+
+        async def run():
+            tdc = _open(Tdc, port)
+            tdc.velocity_parameters = (100, 1000)
+            await tdc.start_velocity_stream(max_rate=100.0, stop_mode=1)
+            tdc.set_velocity_setpoint(1000)
+            await asyncio.sleep(0.05)
+            self.assertTrue(device.moving)
+            with self.assertLogs("thorlabs_cube.driver.stream", "ERROR"):
+                tdc.set_velocity_setpoint(-1000)
+                await asyncio.sleep(0.05)
+            # the motor is stopped and the error ends the session
+            self.assertFalse(device.moving)
+            with self.assertRaises(OSError):
+                tdc.set_velocity_setpoint(0)
+            await tdc.stop_velocity_stream()
+            tdc.close()
+
+        asyncio.run(run())
+        stops = port.sent(MGMSG.MOT_MOVE_STOP)
+        self.assertEqual([1], [msg.param2 for msg in stops])
+
+    def test_motor_group(self):
+        devices = [_FakeTdc(), _FakeTdc()]
+        ports = [_FakePort(device) for device in devices]
+
+        async def run():
+            axes = [_open(Tdc, port) for port in ports]
+            group = MotorGroup(axes)
+            report = await group.move_absolute([1000, -2000])
+            self.assertEqual(["completed", "completed"], report["end"])
+            self.assertEqual([1000, -2000], [axis.position for axis in axes])
+            for axis in axes:
+                self.assertFalse(axis.moving)
+                self.assertEqual({}, axis._moves)
+            self.assertEqual({}, group._moves)
+            handle = await group.start_move_absolute([0, 0])
+            with self.assertRaises(asyncio.TimeoutError):
+                await group.wait_move(handle, 0.01)
+            self.assertEqual(["moving", "moving"], group.move_status(handle)["end"])
+            self.assertTrue(all(axis.moving for axis in axes))
+            report = await group.wait_move(handle)
+            self.assertEqual(["completed", "completed"], report["end"])
+            self.assertEqual({}, group._moves)
+            group.close()
+            with self.assertRaises(ValueError):
+                MotorGroup([axes[0], _open(Tsc, _FakePort(lambda msg: []))])
+
+        asyncio.run(run())
+        for port in ports:
+            self.assertEqual(2, len(port.sent(MGMSG.MOT_MOVE_ABSOLUTE)))
+
 
 class TestTdcSim(GenericRPCCase, GenericTdcTest):
     def setUp(self):
@@ -341,6 +1231,21 @@ class TestKdcSim(GenericRPCCase, GenericKdcTest):
         except:
             self.skipTest("Could not start server")
 
+
+class TestMotorGroupSim(GenericRPCCase, GenericMotorGroupTest):
+    def setUp(self):
+        GenericRPCCase.setUp(self)
+        command = (
+            sys.executable.replace("\\", "\\\\")
+            + " -m thorlabs_cube.aqctl_thorlabs_cube "
+            + "-p 3255 -P kdc101 --simulation -d y -d z"
+        )
+        try:
+            self.cont = self.start_server("kdc101", command, 3255)
+        except:
+            self.skipTest("Could not start server")
+
+
 class TestTpzSim(GenericRPCCase, GenericTpzTest):
     def setUp(self):
         GenericRPCCase.setUp(self)
@@ -367,6 +1272,22 @@ class TestKpzSim(GenericRPCCase, GenericKpzTest):
         except:
             self.skipTest("Could not start server")
 
+
+class TestAlignmentLoopSim(GenericRPCCase, GenericAlignmentLoopTest):
+    def setUp(self):
+        GenericRPCCase.setUp(self)
+        command = (
+            sys.executable.replace("\\", "\\\\")
+            + " -m thorlabs_cube.aqctl_thorlabs_cube "
+            + "-p 3255 -P kpa101 --simulation"
+            + " --piezo x:kpz101:a --piezo y:kpz101:b"
+        )
+        try:
+            self.cont = self.start_server("alignment", command, 3255)
+        except Exception as e:
+            self.skipTest(f"Could not start server: {e}")
+
+
 class TestTpaSim(GenericRPCCase, GenericTpaTest):
     def setUp(self):
         GenericRPCCase.setUp(self)